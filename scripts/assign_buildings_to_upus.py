@@ -0,0 +1,10 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from service_accessibility.services.precompute_accessibility import assign_buildings_to_upus
+
+if __name__ == "__main__":
+    # Run after raw.buildings_all_residential_2024 or raw.urban_planning_units were reloaded
+    assign_buildings_to_upus(force=True)
@@ -0,0 +1,48 @@
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from service_accessibility.services.network import PedestrianGraph
+
+def time_searches(compact, sources, length_type, max_distance):
+    results = []
+    started = time.perf_counter()
+    for source in sources:
+        results.append(compact.get_closeby_amenities(source, length_type, max_distance))
+    return time.perf_counter() - started, results
+
+if __name__ == "__main__":
+    # Contracts the degree-2 chains of the built network in memory and compares traversal times.
+    # To store a contracted network, build it with `python scripts/prebuild_network.py --contract`
+    length_type = 'length_m'
+    max_distance = 1000
+    samples = 200
+
+    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
+    original = G.compact()
+
+    started = time.perf_counter()
+    stats = G.contract_chains()
+    contracted = G.compact()
+    print(f"Contraction took {time.perf_counter() - started:.2f}s")
+    print(f"nodes: {stats['nodes_before']} -> {stats['nodes_after']} ({1 - stats['nodes_after'] / stats['nodes_before']:.1%} fewer)")
+    print(f"edges: {stats['edges_before']} -> {stats['edges_after']} ({1 - stats['edges_after'] / stats['edges_before']:.1%} fewer)")
+
+    # Sources among the nodes that were kept, e.g. the building nodes, so both graphs can start there
+    rng = np.random.default_rng(0)
+    sources = rng.choice(contracted.node_ids, size=min(samples, contracted.number_of_nodes), replace=False).tolist()
+
+    original_seconds, original_results = time_searches(original, sources, length_type, max_distance)
+    contracted_seconds, contracted_results = time_searches(contracted, sources, length_type, max_distance)
+
+    mismatches = sum(
+        a.keys() != b.keys() or any(not np.allclose(a[amenity], b[amenity], rtol=1e-5) for amenity in a)
+        for a, b in zip(original_results, contracted_results)
+    )
+    print(f"original:   {original_seconds / len(sources) * 1000:.2f} ms/query")
+    print(f"contracted: {contracted_seconds / len(sources) * 1000:.2f} ms/query ({original_seconds / contracted_seconds:.2f}x)")
+    print(f"mismatching results: {mismatches}/{len(sources)}")
@@ -0,0 +1,49 @@
+import sys
+import os
+import time
+import random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from service_accessibility.services.network import PedestrianGraph
+
+def time_engine(G, engine, sources, length_type, max_distance):
+    results = []
+    started = time.perf_counter()
+    for source in sources:
+        results.append(G.get_closeby_amenities(source, length_type, max_distance, engine=engine))
+    return time.perf_counter() - started, results
+
+def same_amenities(expected, actual, tolerance=1e-3):
+    if expected.keys() != actual.keys():
+        return False
+    for amenity, distances in expected.items():
+        other = actual[amenity]
+        if len(distances) != len(other):
+            return False
+        if any(abs(a - b) > tolerance for a, b in zip(sorted(distances), other)):
+            return False
+    return True
+
+if __name__ == "__main__":
+    length_type = 'length_m'
+    max_distance = 1000
+    samples = 200
+
+    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
+
+    started = time.perf_counter()
+    compact = G.compact()
+    print(f"CSR view built in {time.perf_counter() - started:.2f}s "
+          f"({compact.number_of_nodes} nodes, {compact.number_of_edges} edges)")
+
+    random.seed(0)
+    sources = [G.node_to_point(node) for node in random.sample(list(G.G.nodes), samples)]
+
+    networkx_seconds, networkx_results = time_engine(G, 'networkx', sources, length_type, max_distance)
+    csr_seconds, csr_results = time_engine(G, 'csr', sources, length_type, max_distance)
+
+    mismatches = sum(not same_amenities(a, b) for a, b in zip(networkx_results, csr_results))
+    print(f"networkx: {networkx_seconds / samples * 1000:.1f} ms/query")
+    print(f"csr:      {csr_seconds / samples * 1000:.1f} ms/query ({networkx_seconds / csr_seconds:.1f}x)")
+    print(f"mismatching results: {mismatches}/{samples}")
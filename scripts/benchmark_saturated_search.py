@@ -0,0 +1,45 @@
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from service_accessibility.services.network import PedestrianGraph
+from service_accessibility.services.walkability_service import WEIGHTS, compute_accessibility_index
+
+if __name__ == "__main__":
+    # Compares the full bounded search with the one that stops once every subgroup is saturated
+    length_type = 'length_m'
+    max_distance = 1000
+    k = 100
+    max_amenities = 3
+    f = 0.5
+    samples = 200
+
+    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
+    compact = G.compact()
+    sources = np.random.default_rng(0).choice(compact.node_ids, size=min(samples, compact.number_of_nodes), replace=False).tolist()
+
+    full_seconds = saturated_seconds = 0.0
+    reached_nodes = settled_nodes = mismatches = 0
+    for source in sources:
+        started = time.perf_counter()
+        distances = compact.distances_from(compact.index_of(source), length_type, max_distance)
+        full = compact.amenities_within(distances)
+        full_seconds += time.perf_counter() - started
+        reached_nodes += int(np.isfinite(distances).sum())
+
+        started = time.perf_counter()
+        saturated, settled = compact.saturated_amenities(source, length_type, max_distance, max_amenities, WEIGHTS)
+        saturated_seconds += time.perf_counter() - started
+        settled_nodes += settled
+
+        full_score = compute_accessibility_index(full, max_distance, k, max_amenities, f)
+        mismatches += full_score != compute_accessibility_index(saturated, max_distance, k, max_amenities, f)
+
+    print(f"full search:      {reached_nodes / len(sources):.0f} nodes, {full_seconds / len(sources) * 1000:.2f} ms/query")
+    print(f"saturated search: {settled_nodes / len(sources):.0f} nodes ({settled_nodes / max(reached_nodes, 1):.1%}), "
+          f"{saturated_seconds / len(sources) * 1000:.2f} ms/query")
+    print(f"mismatching scores: {mismatches}/{len(sources)}")
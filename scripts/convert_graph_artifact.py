@@ -0,0 +1,16 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from service_accessibility.services.network import PedestrianGraph
+
+if __name__ == "__main__":
+    # Migrates data/extended_network.gpickle (+ rtree files) to the binary data/extended_network.graph/ artifact
+    data_dir = 'data'
+    filename = 'extended_network'
+
+    G = PedestrianGraph.load_gpickle(data_dir=data_dir, filename=filename)
+    if G is None:
+        sys.exit(1)
+    G.save_graph()
@@ -0,0 +1,12 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from service_accessibility.services.precompute_accessibility import migrate_wide_results
+
+if __name__ == "__main__":
+    # Moves every column of results.building_accessibility into results.building_scores, one partition per parameter set
+    drop_columns = False
+
+    migrate_wide_results(drop_columns=drop_columns)
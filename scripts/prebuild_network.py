@@ -7,4 +7,5 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 's
 from service_accessibility.services.build_extended_network import build_and_save
 
 if __name__ == "__main__":
-    build_and_save()
+    # --contract merges chains of degree-2 nodes into single edges, see PedestrianGraph.contract_chains
+    build_and_save(contract='--contract' in sys.argv[1:])
@@ -3,7 +3,7 @@ import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 
-from service_accessibility.services.precompute_accessibility import compute_and_store_accessibility
+from service_accessibility.services.precompute_accessibility import compute_and_store_accessibility, compute_and_store_profiles
 
 if __name__ == "__main__":
     length_type = 'length_m'
@@ -11,5 +11,10 @@ if __name__ == "__main__":
     k = 300
     max_amenities = 3
     f = 0.5
+    mode = 'multi_source'  # or 'per_building' for one traversal per building
 
-    compute_and_store_accessibility(length_type, max_distance, k, max_amenities, f, recompute=True)
+    # Distance profiles serve any k, f, max_amenities <= 10 and max_distance <= the ceiling without a new run
+    max_distance_ceiling = 2000
+
+    compute_and_store_profiles(length_type, max_distance_ceiling)
+    compute_and_store_accessibility(length_type, max_distance, k, max_amenities, f, recompute=True, mode=mode)
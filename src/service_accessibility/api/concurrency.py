@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from fastapi import HTTPException, Request
+
+from ..config import API_CPU_THREADS, API_RETRY_AFTER_SECONDS
+
+# Scope key of the limiters a request holds a slot of, set up by ConcurrencySlotsMiddleware
+SLOTS_SCOPE_KEY = 'concurrency_slots'
+
+class ConcurrencyLimiter:
+    """ Caps the number of requests an endpoint handles at once.
+
+    Used as a FastAPI dependency. A request over the limit is rejected right away with
+    503 and Retry-After, so a burst cannot pile up unbounded work behind the slow ones.
+
+    The slot is released by ConcurrencySlotsMiddleware once the response is sent. Streaming
+    responses write their body after the endpoint and its dependencies have returned, so
+    releasing the slot in the dependency would not cover the serialization work.
+    """
+
+    def __init__(self, name: str, limit: int, retry_after: int = API_RETRY_AFTER_SECONDS):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        # Only touched from the event loop thread, so plain counters are enough
+        self.in_flight = 0
+        self.rejected = 0
+        limiters[name] = self
+
+    async def __call__(self, request: Request):
+        slots = request.scope.get(SLOTS_SCOPE_KEY)
+        if slots is None:
+            raise RuntimeError("ConcurrencyLimiter needs ConcurrencySlotsMiddleware on the app")
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many concurrent {self.name} requests, retry later.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.in_flight += 1
+        slots.append(self)
+
+    def release(self):
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
+
+limiters: Dict[str, ConcurrencyLimiter] = {}
+
+class ConcurrencySlotsMiddleware:
+    """ ASGI middleware releasing the limiter slots a request took, after the last byte of its
+    response was sent or the request failed or was cancelled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        slots = scope[SLOTS_SCOPE_KEY] = []
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in slots:
+                limiter.release()
+
+def limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+_cpu_executor: Optional[ThreadPoolExecutor] = None
+_cpu_executor_lock = threading.Lock()
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _cpu_executor_lock:
+            if _cpu_executor is None:
+                _cpu_executor = ThreadPoolExecutor(max_workers=API_CPU_THREADS, thread_name_prefix="cpu")
+    return _cpu_executor
+
+async def run_cpu(func, *args, **kwargs):
+    """ Run a graph search, scoring or serialization step on the CPU executor so the
+    event loop keeps serving other requests in the meantime.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), partial(func, *args, **kwargs))
+
+async def iterate_on_cpu(iterable: Iterable) -> AsyncIterator:
+    """ Async iterator over `iterable` that produces every item on the CPU executor, for
+    response bodies whose items are expensive to make, e.g. serialized and compressed chunks.
+    """
+    iterator = iter(iterable)
+    done = object()
+    while (item := await run_cpu(next, iterator, done)) is not done:
+        yield item
+
+def shutdown_cpu_executor():
+    global _cpu_executor
+    with _cpu_executor_lock:
+        if _cpu_executor is not None:
+            _cpu_executor.shutdown(wait=False, cancel_futures=True)
+        _cpu_executor = None
@@ -0,0 +1,99 @@
+import zlib
+from decimal import Decimal
+from typing import Iterable, Iterator, Optional
+
+import orjson
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from ..config import GEOJSON_FEATURES_PER_CHUNK
+from .concurrency import iterate_on_cpu
+
+# brotli is optional, without it only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GEOJSON_MEDIA_TYPE = "application/geo+json"
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+def _encode_default(value):
+    # NUMERIC columns, e.g. precomputed scores, come back from the drivers as Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def feature_collection_chunks(features: Iterable[dict], features_per_chunk: int = GEOJSON_FEATURES_PER_CHUNK) -> Iterator[bytes]:
+    """ Encode a FeatureCollection piece by piece, so only one chunk of features
+    is held in memory at a time no matter how large the collection is.
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    separator = b''
+    batch = []
+    for feature in features:
+        batch.append(orjson.dumps(feature, default=_encode_default, option=orjson.OPT_SERIALIZE_NUMPY))
+        if len(batch) >= features_per_chunk:
+            yield separator + b','.join(batch)
+            separator = b','
+            batch = []
+    if batch:
+        yield separator + b','.join(batch)
+    yield b']}'
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """ 'br', 'gzip' or None for an Accept-Encoding header. q-values of 0 opt out. """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+def compress_chunks(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    if encoding is None:
+        yield from chunks
+        return
+
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f"Unsupported encoding {encoding}")
+
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+def geojson_response(request: Request, features: Iterable[dict]) -> StreamingResponse:
+    """ Stream `features` as a FeatureCollection, compressed as the client accepts.
+    The iterator is consumed on the CPU executor while the response is written.
+    """
+    encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return StreamingResponse(
+        iterate_on_cpu(compress_chunks(feature_collection_chunks(features), encoding)),
+        media_type=GEOJSON_MEDIA_TYPE,
+        headers=headers,
+    )
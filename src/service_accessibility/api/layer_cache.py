@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional
+
+from fastapi import Request, Response
+
+from .geojson_response import BROTLI_QUALITY, GEOJSON_MEDIA_TYPE, GZIP_LEVEL, brotli, feature_collection_chunks, negotiate_encoding
+
+class CachedLayer:
+    """ A FeatureCollection serialized once, with its compressed variants and their ETags.
+    The identity, gzip and br bodies are all held in memory, see stats() for their sizes.
+    """
+
+    def __init__(self, version: Optional[str], body: bytes):
+        self.version = version
+        self.built_at = time.time()
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        # Every encoding is its own representation, so each gets its own strong ETag
+        self.bodies: Dict[Optional[str], bytes] = {None: body, 'gzip': gzip.compress(body, compresslevel=GZIP_LEVEL)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.etags = {encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"' for encoding in self.bodies}
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "built_at": self.built_at,
+            "bytes": {encoding or 'identity': len(body) for encoding, body in self.bodies.items()},
+        }
+
+class LayerCache:
+    """ Serialized layers keyed by name and data version. A layer is rebuilt the first time it
+    is requested for a new version, e.g. after the graph was rebuilt and reloaded.
+    """
+
+    def __init__(self):
+        self._layers: Dict[str, CachedLayer] = {}
+        # One lock per layer, so concurrent misses build it once and other layers are not held up
+        self._build_locks = defaultdict(threading.Lock)
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, name: str, version: Optional[str], features: Callable[[], Iterable[dict]]) -> CachedLayer:
+        layer = self._layers.get(name)
+        if layer is not None and layer.version == version:
+            self.hits += 1
+            return layer
+
+        with self._build_locks[name]:
+            layer = self._layers.get(name)
+            if layer is None or layer.version != version:
+                layer = CachedLayer(version, b''.join(feature_collection_chunks(features())))
+                self._layers[name] = layer
+                self.builds += 1
+            return layer
+
+    def invalidate(self, name: Optional[str] = None):
+        if name is None:
+            self._layers.clear()
+        else:
+            self._layers.pop(name, None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "builds": self.builds,
+            "layers": {name: layer.stats() for name, layer in self._layers.items()},
+        }
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    # If-None-Match uses weak comparison
+    return '*' in candidates or any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+def cached_geojson_response(request: Request, layer: CachedLayer) -> Response:
+    """ Serve a cached layer in the encoding the client accepts, or 304 when its copy is current. """
+    encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+    etag = layer.etags[encoding]
+    # Clients keep their copy but revalidate it on every use
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return Response(content=layer.bodies[encoding], media_type=GEOJSON_MEDIA_TYPE, headers=headers)
+
+layer_cache = LayerCache()
@@ -0,0 +1,44 @@
+from typing import Optional
+
+import numpy as np
+import orjson
+from fastapi import Response
+
+from ..config import API_BATCH_MAX_POINTS
+
+# Little-endian float64 x, y pairs, e.g. `points.astype('<f8').tobytes()` from numpy
+POINTS_MEDIA_TYPE = "application/octet-stream"
+
+def parse_points(body: bytes, content_type: Optional[str], max_points: int = API_BATCH_MAX_POINTS) -> np.ndarray:
+    """ An (N, 2) float64 array from a batch request body, either JSON `{"points": [[x, y], ...]}`
+    or raw float64 pairs. Raises ValueError for anything else.
+    """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type == POINTS_MEDIA_TYPE:
+        if len(body) % 16:
+            raise ValueError("Binary points must be float64 x, y pairs, 16 bytes each")
+        points = np.frombuffer(body, dtype='<f8').reshape(-1, 2)
+    elif media_type == 'application/json':
+        try:
+            payload = orjson.loads(body)
+            points = np.asarray(payload['points'], dtype=np.float64)
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+            raise ValueError('Expected a JSON body of the form {"points": [[x, y], ...]}')
+        if points.size == 0:
+            points = points.reshape(0, 2)
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError("Every point must be an [x, y] pair")
+    else:
+        raise ValueError(f"Unsupported content type {content_type}, use application/json or {POINTS_MEDIA_TYPE}")
+
+    if len(points) > max_points:
+        raise ValueError(f"At most {max_points} points per request")
+    if not np.isfinite(points).all():
+        raise ValueError("Coordinates must be finite numbers")
+    return points
+
+def scores_response(scores: np.ndarray, accept: Optional[str]) -> Response:
+    """ Scores in input order, as float64 bytes when the client asks for them and as JSON otherwise. """
+    if accept and POINTS_MEDIA_TYPE in accept:
+        return Response(content=np.asarray(scores, dtype='<f8').tobytes(), media_type=POINTS_MEDIA_TYPE)
+    return Response(content=orjson.dumps({"scores": scores}, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
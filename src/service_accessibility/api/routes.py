@@ -1,58 +1,130 @@
-from fastapi import APIRouter, Query
-from shapely.geometry import Point, mapping
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from shapely.geometry import Point
 
 from ..services import school_service
 from ..services import residential_buildings_service
 from ..services import urban_planning_unit_service
 from ..services.network import PedestrianGraph
+from ..services.graph_registry import graph_registry
+from ..database.connection import fetch_all_async, pool_status
+from ..services.accessibility_pool import accessibility_pool, score_node_ids
 from ..services.walkability_service import compute_accessibility_index
-from ..services.precompute_accessibility import get_buildings_with_precomputed_accessibility, get_upu_with_precomputed_accessibility
+from ..services.precompute_accessibility import precomputed_buildings_query, precomputed_upus_query, resolve_parameter_set
+from ..services.amenity_profile_cache import amenity_profile_cache
+from ..services.isochrones import isochrone_bands, isochrone_engine
+from ..services.vector_tiles import ACCESSIBILITY_LAYER, MVT_MEDIA_TYPE, tile_cache, tile_query, validate_tile
+from ..config import API_LIMIT_BUILDING_SCORING, API_LIMIT_ISOCHRONES, API_LIMIT_LAYERS, API_LIMIT_POINT_QUERIES, API_LIMIT_PRECOMPUTED, API_LIMIT_TILES
+from .concurrency import ConcurrencyLimiter, limiter_stats, run_cpu
+from .geojson_response import geojson_response
+from .point_batch import parse_points, scores_response
+from .layer_cache import cached_geojson_response, layer_cache
 
 router = APIRouter()
 
-@router.get("/pedestrian_network")
-async def get_pedestrian_network():
-    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
-    return G.graph_to_geojson()
-
-@router.get("/residential_buildings")
-async def residential_buildings():
-    residential_buildings = residential_buildings_service.get_all()
-    return {
-        "type": "FeatureCollection",
-        "features": residential_buildings
-    }
-
-@router.get("/urban_planning_units")
-async def get_urban_planning_units():
-    urban_planning_units = urban_planning_unit_service.get_all()
-    return {
-        "type": "FeatureCollection",
-        "features": urban_planning_units
-    }
-
-@router.get("/schools")
-async def get_schools():
-    schools = school_service.get_all()
-    return {
-        "type": "FeatureCollection",
-        "features": schools
-    }
-
-@router.get("/get_closeby_amenities")
+point_query_limit = ConcurrencyLimiter("point query", API_LIMIT_POINT_QUERIES)
+building_scoring_limit = ConcurrencyLimiter("building scoring", API_LIMIT_BUILDING_SCORING)
+precomputed_limit = ConcurrencyLimiter("precomputed", API_LIMIT_PRECOMPUTED)
+layer_limit = ConcurrencyLimiter("layer", API_LIMIT_LAYERS)
+tile_limit = ConcurrencyLimiter("tile", API_LIMIT_TILES)
+isochrone_limit = ConcurrencyLimiter("isochrone", API_LIMIT_ISOCHRONES)
+
+def get_pedestrian_graph() -> PedestrianGraph:
+    G = graph_registry.get()
+    if G is None:
+        raise HTTPException(status_code=503, detail="Pedestrian graph is not available. Run scripts/prebuild_network.py first.")
+    return G
+
+def warm_layers():
+    """ Build the cached layers of the loaded graph, so that their serialization and compression
+    are not paid for by the first request after startup or a reload. A layer that fails is built
+    on demand instead.
+    """
+    G = graph_registry.get()
+    if G is None:
+        return
+    for name, features in (('pedestrian_network', G.graph_features),
+                           ('urban_planning_units', urban_planning_unit_service.get_all),
+                           ('schools', school_service.get_all)):
+        try:
+            layer_cache.get(name, G.version, features)
+        except Exception as e:
+            print(f"Layer {name} could not be built: {e}")
+
+@router.get("/graph/status")
+async def get_graph_status():
+    return graph_registry.stats()
+
+@router.post("/graph/reload")
+async def reload_graph():
+    if await run_cpu(graph_registry.reload) is None:
+        raise HTTPException(status_code=503, detail="Pedestrian graph could not be loaded.")
+    # Workers hold their own copy of the graph, the next request starts fresh ones
+    await run_cpu(accessibility_pool.close)
+    layer_cache.invalidate()
+    isochrone_engine.invalidate()
+    amenity_profile_cache.clear()
+    await run_cpu(tile_cache.prune, graph_registry.version)
+    await run_cpu(warm_layers)
+    return graph_registry.stats()
+
+@router.get("/graph/amenity_cache")
+async def get_amenity_cache_status():
+    return amenity_profile_cache.stats()
+
+@router.get("/db/pool_status")
+async def get_db_pool_status():
+    return pool_status()
+
+@router.get("/concurrency/status")
+async def get_concurrency_status():
+    return limiter_stats()
+
+@router.get("/layers/status")
+async def get_layers_status():
+    return layer_cache.stats()
+
+@router.post("/layers/invalidate")
+async def invalidate_layers():
+    # For when the raw tables were reloaded without rebuilding the graph
+    layer_cache.invalidate()
+    return layer_cache.stats()
+
+@router.get("/pedestrian_network", dependencies=[Depends(layer_limit)])
+async def get_pedestrian_network(request: Request, G: PedestrianGraph = Depends(get_pedestrian_graph)):
+    layer = await run_cpu(layer_cache.get, 'pedestrian_network', G.version, G.graph_features)
+    return cached_geojson_response(request, layer)
+
+@router.get("/residential_buildings", dependencies=[Depends(layer_limit)])
+async def residential_buildings(request: Request):
+    residential_buildings = await run_cpu(residential_buildings_service.get_all)
+    return geojson_response(request, residential_buildings)
+
+@router.get("/urban_planning_units", dependencies=[Depends(layer_limit)])
+async def get_urban_planning_units(request: Request):
+    # The layer is rebuilt with every new graph, which is rebuilt whenever the raw tables change
+    layer = await run_cpu(layer_cache.get, 'urban_planning_units', graph_registry.version, urban_planning_unit_service.get_all)
+    return cached_geojson_response(request, layer)
+
+@router.get("/schools", dependencies=[Depends(layer_limit)])
+async def get_schools(request: Request):
+    layer = await run_cpu(layer_cache.get, 'schools', graph_registry.version, school_service.get_all)
+    return cached_geojson_response(request, layer)
+
+@router.get("/get_closeby_amenities", dependencies=[Depends(point_query_limit)])
 # http://localhost:8000/get_closeby_amenities?x=316221.88866994827&y=4729194.708270278&length_type=length_m&max_distance=1000
 async def get_closeby_amenities(
     x: float = Query(..., description="X coordinate of the point"),
     y: float = Query(..., description="Y coordinate of the point"),
     length_type: str = Query("length_m", description="Type of distance metric"),
     max_distance: int = Query(1000, description="Maximum distance for isochrones"),
+    G: PedestrianGraph = Depends(get_pedestrian_graph),
 ):
-    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
     source_point = Point(x, y)
-    amenities = G.get_closeby_amenities(source_point, length_type, max_distance)
+    amenities = await run_cpu(G.get_closeby_amenities, source_point, length_type, max_distance)
     return amenities
 
-@router.get("/get_accessibility_index")
+@router.get("/get_accessibility_index", dependencies=[Depends(point_query_limit)])
 # http://localhost:8000/get_accessibility_index?x=316221.88866994827&y=4729194.708270278&length_type=length_m&max_distance=1000&k=100&max_amenities=3&f=0.2
 async def get_accessibility_index(
     x: float = Query(..., description="X coordinate of the point"),
@@ -62,90 +134,169 @@ async def get_accessibility_index(
     k: int = Query(..., description="A parameter controlling the rate of decrease in accessibility beyond half of the maximum distance"), 
     max_amenities: int = Query(..., description="Sets the point of saturation. Only this amount of amenities will contribute to the index."),
     f: float = Query(..., description="A parameter controlling the rate at which the value of having additional amenities diminishes"),
+    G: PedestrianGraph = Depends(get_pedestrian_graph),
 ):
-    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
     source_point = Point(x, y)
-    proximity_dict = G.get_closeby_amenities(source_point, length_type, max_distance)
+    proximity_dict = await run_cpu(G.get_closeby_amenities, source_point, length_type, max_distance, max_amenities=max_amenities)
 
     return compute_accessibility_index(proximity_dict, max_distance, k, max_amenities, f)
 
-@router.get("/residential_buildings_with_accessibility_index")
+def _score_points(G: PedestrianGraph, points, length_type, max_distance, k, max_amenities, f):
+    if length_type not in ('length_m', 'minutes'):
+        raise ValueError("length_type must be either 'length_m' or 'minutes'")
+    return score_node_ids(G, G.find_nearest_nodes(points), length_type, max_distance, k, max_amenities, f)
+
+@router.post("/get_accessibility_index/batch", dependencies=[Depends(building_scoring_limit)])
+# curl -X POST -H 'Content-Type: application/json' -d '{"points": [[316221.9, 4729194.7], [316500.0, 4729300.0]]}' \
+#   'http://localhost:8000/get_accessibility_index/batch?length_type=length_m&max_distance=1000&k=100&max_amenities=3&f=0.2'
+async def get_accessibility_index_batch(
+    request: Request,
+    length_type: str = Query(..., description="Type of distance metric"),
+    max_distance: int = Query(..., description="Maximum distance for isochrones"),
+    k: int = Query(..., description="A parameter controlling the rate of decrease in accessibility beyond half of the maximum distance"),
+    max_amenities: int = Query(..., description="Sets the point of saturation. Only this amount of amenities will contribute to the index."),
+    f: float = Query(..., description="A parameter controlling the rate at which the value of having additional amenities diminishes"),
+    G: PedestrianGraph = Depends(get_pedestrian_graph),
+):
+    """ Scores for many points in one request, in input order. The body is JSON `{"points": [[x, y], ...]}`
+    or application/octet-stream float64 x, y pairs. Points snapping to the same node are scored once.
+    """
+    try:
+        points = parse_points(await request.body(), request.headers.get('content-type'))
+        scores = await run_cpu(_score_points, G, points, length_type, max_distance, k, max_amenities, f)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return scores_response(scores, request.headers.get('accept'))
+
+@router.get("/residential_buildings_with_accessibility_index", dependencies=[Depends(building_scoring_limit)])
 # http://localhost:8000/residential_buildings_with_accessibility_index?urban_planning_unit_id=21&length_type=length_m&max_distance=1000&k=100&max_amenities=3&f=0.2
 async def residential_buildings_with_accessibility_index(
+    request: Request,
     urban_planning_unit_id: int = Query(..., description="GID of a planning unit"),
     length_type: str = Query(..., description="Type of distance metric"),
     max_distance: int = Query(..., description="Maximum distance for isochrones"),
     k: int = Query(..., description="A parameter controlling the rate of decrease in accessibility beyond half of the maximum distance"), 
     max_amenities: int = Query(..., description="Sets the point of saturation. Only this amount of amenities will contribute to the index."),
     f: float = Query(..., description="A parameter controlling the rate at which the value of having additional amenities diminishes"),
+    G: PedestrianGraph = Depends(get_pedestrian_graph),
 ):
-    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
-    with_index = residential_buildings_service.get_with_accessibility(G, length_type, max_distance, k, max_amenities, f, urban_planning_unit_id)
+    with_index = await run_cpu(
+        residential_buildings_service.get_with_accessibility, G, length_type, max_distance, k, max_amenities, f, urban_planning_unit_id
+    )
 
-    return {
-        "type": "FeatureCollection",
-        "features": with_index
-    }
+    return geojson_response(request, with_index)
 
-@router.get("/precomputed_residential_accessibility_index")
+@router.get("/precomputed_residential_accessibility_index", dependencies=[Depends(precomputed_limit)])
 # http://localhost:8000/precomputed_residential_accessibility_index?length_type=length_m&max_distance=1000&k=300&max_amenities=3&f=0.5
 async def precomputed_residential_accessibility_index(
+    request: Request,
     length_type: str = Query(..., description="Type of distance metric"),
     max_distance: int = Query(..., description="Maximum distance for isochrones"),
     k: int = Query(..., description="A parameter controlling the rate of decrease in accessibility beyond half of the maximum distance"), 
     max_amenities: int = Query(..., description="Sets the point of saturation. Only this amount of amenities will contribute to the index."),
     f: float = Query(..., description="A parameter controlling the rate at which the value of having additional amenities diminishes"),
 ):
-    buildings = get_buildings_with_precomputed_accessibility(length_type, max_distance, k, max_amenities, f)
-    buildings_geojsons = residential_buildings_service.buildings_to_geojson(buildings)
+    # Rescoring profiles is CPU work, the query itself is awaited on the async engine
+    try:
+        sql, params = await run_cpu(precomputed_buildings_query, length_type, max_distance, k, max_amenities, f)
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
+    buildings = await fetch_all_async(sql, params)
 
-    return {
-        "type": "FeatureCollection",
-        "features": buildings_geojsons
-    }
+    return geojson_response(request, residential_buildings_service.buildings_to_geojson(buildings))
 
-@router.get("/precomputed_upu_accessibility_index")
+@router.get("/precomputed_upu_accessibility_index", dependencies=[Depends(precomputed_limit)])
 # http://localhost:8000/precomputed_upu_accessibility_index?length_type=length_m&max_distance=1000&k=300&max_amenities=3&f=0.5
 async def precomputed_upu_accessibility_index(
+    request: Request,
     length_type: str = Query(..., description="Type of distance metric"),
     max_distance: int = Query(..., description="Maximum distance for isochrones"),
     k: int = Query(..., description="A parameter controlling the rate of decrease in accessibility beyond half of the maximum distance"), 
     max_amenities: int = Query(..., description="Sets the point of saturation. Only this amount of amenities will contribute to the index."),
     f: float = Query(..., description="A parameter controlling the rate at which the value of having additional amenities diminishes"),
 ):
-    upus = get_upu_with_precomputed_accessibility(length_type, max_distance, k, max_amenities, f)
-    upus_geojsons = urban_planning_unit_service.upus_to_geojson(upus)
-
-    return {
-        "type": "FeatureCollection",
-        "features": upus_geojsons
-    }
-
-# @router.get("/get_isochrone")
-# # http://localhost:8000/get_isochrone?x=316221.88866994827&y=4729194.708270278&length_type=length_m&max_distance=1000
-# async def get_isochrones(
-#     x: float = Query(..., description="X coordinate of the point"),
-#     y: float = Query(..., description="Y coordinate of the point"),
-#     length_type: str = Query("length_m", description="Type of distance metric"),
-#     max_distance: int = Query(1000, description="Maximum distance for isochrones"),
-# ):
-#     G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
-#     source_point = Point(x, y)
-#     isochrones = G.compute_isochrone(source_point, length_type, max_distance)
-
-#     return mapping(isochrones)
-
-# @router.get("/get_isochrones")
-# # http://localhost:8000/get_isochrones?x=316221.88866994827&y=4729194.708270278&length_type=length_m&max_distance=1000&interval=200
-# async def get_isochrones(
-#     x: float = Query(..., description="X coordinate of the point"),
-#     y: float = Query(..., description="Y coordinate of the point"),
-#     length_type: str = Query("length_m", description="Type of distance metric"),
-#     max_distance: int = Query(1000, description="Maximum distance for isochrones"),
-#     interval: int = Query(100, description="Interval for isochrone calculation"),
-# ):
-#     G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
-#     source_point = Point(x, y)
-#     isochrones = G.compute_isochrones(source_point, length_type, max_distance, interval)
-
-#     return {key: mapping(value) for key, value in isochrones.items()}
+    try:
+        sql, params = await run_cpu(precomputed_upus_query, length_type, max_distance, k, max_amenities, f)
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
+    upus = await fetch_all_async(sql, params)
+
+    return geojson_response(request, urban_planning_unit_service.upus_to_geojson(upus))
+
+@router.get("/tiles/{layer}/{z}/{x}/{y}.mvt", dependencies=[Depends(tile_limit)])
+# http://localhost:8000/tiles/buildings/15/18610/12050.mvt?length_type=length_m&max_distance=1000&k=300&max_amenities=3&f=0.5
+async def get_tile(
+    layer: str,
+    z: int,
+    x: int,
+    y: int,
+    length_type: Optional[str] = Query(None, description="Type of distance metric, adds the accessibility index to the buildings layer"),
+    max_distance: Optional[int] = Query(None, description="Maximum distance for isochrones"),
+    k: Optional[int] = Query(None, description="A parameter controlling the rate of decrease in accessibility beyond half of the maximum distance"),
+    max_amenities: Optional[int] = Query(None, description="Sets the point of saturation. Only this amount of amenities will contribute to the index."),
+    f: Optional[float] = Query(None, description="A parameter controlling the rate at which the value of having additional amenities diminishes"),
+):
+    try:
+        validate_tile(layer, z, x, y)
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
+
+    parameters = (length_type, max_distance, k, max_amenities, f)
+    if all(value is None for value in parameters):
+        parameters = None
+    elif any(value is None for value in parameters):
+        raise HTTPException(status_code=400, detail="length_type, max_distance, k, max_amenities and f must be given together")
+
+    param_set_id, generation = None, None
+    if parameters is not None and layer == ACCESSIBILITY_LAYER:
+        try:
+            param_set_id, generation = await run_cpu(resolve_parameter_set, *parameters)
+        except ValueError as error:
+            raise HTTPException(status_code=404, detail=str(error))
+
+    path = tile_cache.path(graph_registry.version, layer, z, x, y, parameters, generation)
+    tile = await run_cpu(tile_cache.read, path)
+    if tile is None:
+        sql, params = await run_cpu(tile_query, layer, z, x, y, param_set_id)
+        rows = await fetch_all_async(sql, params)
+        tile = bytes(rows[0][0]) if rows and rows[0][0] is not None else b''
+        await run_cpu(tile_cache.write, path, tile)
+
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE)
+
+async def _isochrone_response(request: Request, G: PedestrianGraph, x: float, y: float, length_type: str, max_distance: int, interval: Optional[int]):
+    try:
+        bands = isochrone_bands(max_distance, interval)
+        features = await run_cpu(isochrone_engine.features, G, Point(x, y), length_type, bands)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return geojson_response(request, features)
+
+@router.get("/get_isochrone", dependencies=[Depends(isochrone_limit)])
+# http://localhost:8000/get_isochrone?x=316221.88866994827&y=4729194.708270278&length_type=length_m&max_distance=1000
+async def get_isochrone(
+    request: Request,
+    x: float = Query(..., description="X coordinate of the point"),
+    y: float = Query(..., description="Y coordinate of the point"),
+    length_type: str = Query("length_m", description="Type of distance metric"),
+    max_distance: int = Query(1000, description="Maximum distance for isochrones"),
+    G: PedestrianGraph = Depends(get_pedestrian_graph),
+):
+    return await _isochrone_response(request, G, x, y, length_type, max_distance, None)
+
+@router.get("/get_isochrones", dependencies=[Depends(isochrone_limit)])
+# http://localhost:8000/get_isochrones?x=316221.88866994827&y=4729194.708270278&length_type=length_m&max_distance=1000&interval=200
+async def get_isochrones(
+    request: Request,
+    x: float = Query(..., description="X coordinate of the point"),
+    y: float = Query(..., description="Y coordinate of the point"),
+    length_type: str = Query("length_m", description="Type of distance metric"),
+    max_distance: int = Query(1000, description="Maximum distance for isochrones"),
+    interval: int = Query(100, description="Interval for isochrone calculation"),
+    G: PedestrianGraph = Depends(get_pedestrian_graph),
+):
+    return await _isochrone_response(request, G, x, y, length_type, max_distance, interval)
+
+@router.get("/isochrones/status")
+async def get_isochrones_status():
+    return isochrone_engine.stats()
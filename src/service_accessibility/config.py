@@ -4,3 +4,52 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+
+GRAPH_DATA_DIR = os.getenv("GRAPH_DATA_DIR", "data")
+GRAPH_FILENAME = os.getenv("GRAPH_FILENAME", "extended_network")
+
+# Worker pool used to score the buildings of an urban planning unit on request
+ACCESSIBILITY_POOL_SIZE = int(os.getenv("ACCESSIBILITY_POOL_SIZE", os.cpu_count() or 1))
+ACCESSIBILITY_CHUNK_SIZE = int(os.getenv("ACCESSIBILITY_CHUNK_SIZE", 64))
+# Below this many buildings the scores are computed in-process, the pool round trip is not worth it
+ACCESSIBILITY_IN_PROCESS_THRESHOLD = int(os.getenv("ACCESSIBILITY_IN_PROCESS_THRESHOLD", 200))
+# Closeby-amenity results cached per graph version, source node and distance type, per process
+AMENITY_CACHE_MAX_BYTES = int(os.getenv("AMENITY_CACHE_MAX_BYTES", 64 * 2**20))
+# Score with the early-stopping heap search instead of scipy's bounded one. Off until
+# scripts/benchmark_saturated_search.py shows a gain on the city graph
+SATURATED_AMENITY_SEARCH = os.getenv("SATURATED_AMENITY_SEARCH", "false").lower() in ("1", "true", "yes")
+
+# Connection pool shared by every session of a process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Seconds after which a connection is replaced, keeps it below server and proxy idle timeouts
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+
+# Threads that run graph searches, scoring and serialization off the event loop
+API_CPU_THREADS = int(os.getenv("API_CPU_THREADS", os.cpu_count() or 1))
+# Requests over an endpoint's limit get a 503 with this Retry-After instead of queueing
+API_RETRY_AFTER_SECONDS = int(os.getenv("API_RETRY_AFTER_SECONDS", 5))
+API_LIMIT_POINT_QUERIES = int(os.getenv("API_LIMIT_POINT_QUERIES", 32))
+API_LIMIT_BUILDING_SCORING = int(os.getenv("API_LIMIT_BUILDING_SCORING", 4))
+API_LIMIT_PRECOMPUTED = int(os.getenv("API_LIMIT_PRECOMPUTED", 8))
+API_LIMIT_LAYERS = int(os.getenv("API_LIMIT_LAYERS", 4))
+# Largest number of points a batch scoring request may carry
+API_BATCH_MAX_POINTS = int(os.getenv("API_BATCH_MAX_POINTS", 100000))
+
+# 6 decimals of a degree is ~0.1 m, more only inflates the GeoJSON payloads
+GEOJSON_COORDINATE_DECIMALS = int(os.getenv("GEOJSON_COORDINATE_DECIMALS", 6))
+# Features encoded per chunk of a streamed FeatureCollection
+GEOJSON_FEATURES_PER_CHUNK = int(os.getenv("GEOJSON_FEATURES_PER_CHUNK", 500))
+
+# Generated vector tiles, one subdirectory per graph version
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(GRAPH_DATA_DIR, "tiles"))
+API_LIMIT_TILES = int(os.getenv("API_LIMIT_TILES", 32))
+
+# Isochrones: half-width of the corridor around reached edges, in metres of the graph CRS
+ISOCHRONE_BUFFER_METERS = float(os.getenv("ISOCHRONE_BUFFER_METERS", 25))
+ISOCHRONE_CACHE_SIZE = int(os.getenv("ISOCHRONE_CACHE_SIZE", 256))
+ISOCHRONE_MAX_BANDS = int(os.getenv("ISOCHRONE_MAX_BANDS", 20))
+API_LIMIT_ISOCHRONES = int(os.getenv("API_LIMIT_ISOCHRONES", 16))
@@ -1,12 +1,141 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import sqlalchemy as sa
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from starlette.concurrency import run_in_threadpool
 from geoalchemy2 import load_spatialite
-from ..config import DATABASE_URL
+from ..config import DATABASE_URL, DB_ECHO, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT
+
+class PoolMetrics:
+    """ How long callers waited for a pooled connection. The wait includes opening
+    a new connection when the pool had none idle.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def record(self, wait_seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_seconds": self.total_wait_seconds,
+                "mean_wait_seconds": self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+pool_metrics = PoolMetrics()
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that reports checkout waits to pool_metrics. """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - started)
+        return connection
+
+_engine = None
+_Session = None
+_engine_lock = threading.Lock()
 
 def get_db_engine():
-    return create_engine(DATABASE_URL, echo=True)
+    """ The process-wide engine, created on first use. """
+    global _engine, _Session
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    DATABASE_URL,
+                    echo=DB_ECHO,
+                    poolclass=TimedQueuePool,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=DB_POOL_PRE_PING,
+                )
+                # Loaded objects stay usable after session_scope has committed and closed
+                _Session = sessionmaker(bind=_engine, expire_on_commit=False)
+    return _engine
+
+def dispose_engine():
+    """ Close every pooled connection, e.g. on shutdown. The next call creates a new engine. """
+    global _engine, _Session
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _Session = None
 
 def get_db_session():
-    engine = get_db_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
\ No newline at end of file
+    """ A session bound to the shared engine. The caller has to close it, prefer session_scope. """
+    get_db_engine()
+    return _Session()
+
+@contextmanager
+def session_scope():
+    """ Session that is committed on success, rolled back on error and always closed,
+    which returns its connection to the pool.
+    """
+    session = get_db_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def fetch_all(sql: str, params: Optional[dict] = None):
+    with session_scope() as session:
+        return session.execute(sa.text(sql), params or {}).fetchall()
+
+async def fetch_all_async(sql: str, params: Optional[dict] = None):
+    """ Run a query without blocking the event loop, on the pooled sync engine in a worker thread.
+    The connections it uses are the same DB_POOL_SIZE + DB_MAX_OVERFLOW as every other query.
+    """
+    return await run_in_threadpool(fetch_all, sql, params)
+
+def _pool_counters(pool) -> dict:
+    return {
+        "pool_size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+
+def pool_status() -> dict:
+    engine = _engine
+    status = {"engine_created": engine is not None, **pool_metrics.stats()}
+    if engine is not None:
+        status.update(_pool_counters(engine.pool))
+    return status
@@ -1,8 +1,25 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from .api import routes
+from .services.graph_registry import graph_registry
+from .services.accessibility_pool import accessibility_pool
+from .database.connection import dispose_engine
+from .api.concurrency import ConcurrencySlotsMiddleware, run_cpu, shutdown_cpu_executor
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the pedestrian graph once per process instead of once per request
+    graph_registry.load()
+    await run_cpu(routes.warm_layers)
+    yield
+    accessibility_pool.close()
+    shutdown_cpu_executor()
+    graph_registry.unload()
+    dispose_engine()
 
 def create_app():
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(ConcurrencySlotsMiddleware)
     app.include_router(routes.router)
     return app
 
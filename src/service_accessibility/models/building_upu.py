@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, Table
+from .base import Base
+
+class BuildingUpu(Base):
+    """ Urban planning unit of every residential building, materialized once from ST_Within. """
+    __table__ = Table(
+        'building_upu',
+        Base.metadata,
+        Column('building_gid', Integer, primary_key=True),
+        Column('upu_gid', Integer, nullable=False, index=True),
+        schema='results'
+    )
@@ -0,0 +1,86 @@
+import multiprocessing
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from ..config import ACCESSIBILITY_CHUNK_SIZE, ACCESSIBILITY_IN_PROCESS_THRESHOLD, ACCESSIBILITY_POOL_SIZE, GRAPH_DATA_DIR, GRAPH_FILENAME
+from .amenity_profile_cache import amenity_profile_cache
+from .network import PedestrianGraph
+from .walkability_service import compute_accessibility_index
+
+# Graph of a worker process, set once by the pool initializer
+_worker_graph: Optional[PedestrianGraph] = None
+
+def _init_worker(data_dir: str, filename: str):
+    global _worker_graph
+    # Memory-mapped, so the workers share the pages of the artifact instead of copying the graph
+    _worker_graph = PedestrianGraph.load_graph(data_dir=data_dir, filename=filename)
+
+def score_nodes(G: PedestrianGraph, node_ids: Sequence[int], length_type, max_distance, k, max_amenities, f) -> List[float]:
+    """ Score from graph nodes directly, no snapping. Callers pass each node once. """
+    scores = []
+    for node_id in node_ids:
+        proximity_dict = amenity_profile_cache.get(G, node_id, length_type, max_distance, max_amenities)
+        scores.append(compute_accessibility_index(proximity_dict, max_distance, k, max_amenities, f))
+    return scores
+
+def _score_chunk(node_ids, params) -> List[float]:
+    return score_nodes(_worker_graph, node_ids, *params)
+
+class AccessibilityPool:
+    """ Long-lived process pool whose workers hold their own copy of the pedestrian graph.
+
+    Only chunks of node ids go to the workers and only the scores come back,
+    so the graph is never pickled per task. Workers are started from a forkserver: the API
+    process runs executor and anyio threads, and forking it could inherit a held lock.
+    """
+
+    def __init__(self, processes: int = ACCESSIBILITY_POOL_SIZE, chunk_size: int = ACCESSIBILITY_CHUNK_SIZE,
+                 data_dir: str = GRAPH_DATA_DIR, filename: str = GRAPH_FILENAME):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.data_dir = data_dir
+        self.filename = filename
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context('forkserver')
+                self._pool = context.Pool(processes=self.processes, initializer=_init_worker, initargs=(self.data_dir, self.filename))
+            return self._pool
+
+    def score_nodes(self, node_ids: Sequence[int], length_type, max_distance, k, max_amenities, f) -> List[float]:
+        params = (length_type, max_distance, k, max_amenities, f)
+        chunks = [node_ids[i:i + self.chunk_size] for i in range(0, len(node_ids), self.chunk_size)]
+        results = self._get_pool().starmap(_score_chunk, [(chunk, params) for chunk in chunks])
+        return [score for chunk_scores in results for score in chunk_scores]
+
+    def close(self):
+        """ Stop the workers, e.g. on shutdown or after the graph was reloaded. The next request
+        starts a new pool right away, only the old one waits for its running chunks. Blocks, so
+        the API calls it through run_cpu.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+accessibility_pool = AccessibilityPool()
+
+def score_node_ids(G: PedestrianGraph, node_ids: np.ndarray, length_type, max_distance, k, max_amenities, f) -> np.ndarray:
+    """ Score of every entry of node_ids, in order. Each distinct node is searched once,
+    in-process when there are few of them and on the pool otherwise.
+    """
+    unique_nodes, rows = np.unique(np.asarray(node_ids, dtype=np.int64), return_inverse=True)
+    unique_nodes = unique_nodes.tolist()
+    params = (length_type, max_distance, k, max_amenities, f)
+
+    if len(unique_nodes) < ACCESSIBILITY_IN_PROCESS_THRESHOLD:
+        node_scores = score_nodes(G, unique_nodes, *params)
+    else:
+        node_scores = accessibility_pool.score_nodes(unique_nodes, *params)
+    return np.asarray(node_scores, dtype=np.float64)[rows]
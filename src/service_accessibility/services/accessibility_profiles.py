@@ -0,0 +1,116 @@
+import glob
+import os
+import re
+from typing import Dict, List, Optional
+import numpy as np
+
+from ..config import GRAPH_DATA_DIR
+from .compact_graph import CompactGraph
+from .nearest_amenities import compute_nearest_amenities
+from .walkability_service import compute_accessibility_index_batch
+
+PROFILES_DIR = 'accessibility_profiles'
+# Number of nearest amenities kept per subgroup, the largest max_amenities the profiles can serve
+PROFILE_WIDTH = 10
+
+class AccessibilityProfiles:
+    """ Sorted nearest-amenity distances of every residential building, per subgroup.
+
+    Only `length_type` and the search cutoff affect the traversal, so one set of profiles
+    computed up to `max_distance_ceiling` can be rescored for any k, f, max_amenities <= width
+    and max_distance <= max_distance_ceiling without touching the graph.
+    """
+
+    def __init__(self, building_gids: np.ndarray, subgroups: List[str], distances: np.ndarray, counts: np.ndarray,
+                 length_type: str, max_distance_ceiling: float):
+        self.building_gids = building_gids
+        self.subgroups = list(subgroups)
+        self.distances = distances
+        self.counts = counts
+        self.length_type = length_type
+        self.max_distance_ceiling = max_distance_ceiling
+
+    @property
+    def width(self) -> int:
+        return self.distances.shape[2]
+
+    def can_serve(self, max_distance, max_amenities) -> bool:
+        return max_distance <= self.max_distance_ceiling and 1 <= max_amenities <= self.width
+
+    def score(self, max_distance, k, max_amenities, f) -> np.ndarray:
+        if not self.can_serve(max_distance, max_amenities):
+            raise ValueError(f"Profiles up to {self.max_distance_ceiling} with width {self.width} "
+                             f"cannot serve max_distance={max_distance}, max_amenities={max_amenities}")
+        return compute_accessibility_index_batch(self.distances, self.counts, self.subgroups, max_distance, k, max_amenities, f)
+
+    def scores_by_gid(self, max_distance, k, max_amenities, f) -> Dict[int, float]:
+        return dict(zip(self.building_gids.tolist(), self.score(max_distance, k, max_amenities, f).tolist()))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path,
+            building_gids=self.building_gids,
+            subgroups=np.array(self.subgroups),
+            distances=self.distances,
+            counts=self.counts,
+            length_type=np.array(self.length_type),
+            max_distance_ceiling=np.array(self.max_distance_ceiling),
+        )
+        print(f"Accessibility profiles saved to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'AccessibilityProfiles':
+        with np.load(path) as data:
+            return cls(
+                building_gids=data['building_gids'],
+                subgroups=data['subgroups'].tolist(),
+                distances=data['distances'],
+                counts=data['counts'],
+                length_type=str(data['length_type']),
+                max_distance_ceiling=float(data['max_distance_ceiling']),
+            )
+
+def profiles_path(length_type: str, max_distance_ceiling, data_dir: str = GRAPH_DATA_DIR) -> str:
+    return os.path.join(data_dir, PROFILES_DIR, f'{length_type}_{int(max_distance_ceiling)}.npz')
+
+def build_profiles(compact: CompactGraph, building_gids, building_nodes, length_type: str, max_distance_ceiling,
+                   width: int = PROFILE_WIDTH) -> AccessibilityProfiles:
+    """ building_nodes are CompactGraph indices, one per entry of building_gids. """
+    building_nodes = np.asarray(building_nodes, dtype=np.int64)
+    unique_nodes, rows = np.unique(building_nodes, return_inverse=True)
+    table = compute_nearest_amenities(compact, length_type, max_distance_ceiling, width, target_indices=unique_nodes)
+
+    return AccessibilityProfiles(
+        building_gids=np.asarray(building_gids, dtype=np.int64),
+        subgroups=table.amenity_names,
+        distances=table.distances[rows].astype(np.float32),
+        counts=table.counts[rows].astype(np.int16),
+        length_type=length_type,
+        max_distance_ceiling=max_distance_ceiling,
+    )
+
+_loaded_profiles = {}
+
+def _load_cached(path: str) -> AccessibilityProfiles:
+    mtime = os.path.getmtime(path)
+    cached = _loaded_profiles.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, AccessibilityProfiles.load(path))
+        _loaded_profiles[path] = cached
+    return cached[1]
+
+def find_profiles(length_type: str, max_distance, max_amenities, data_dir: str = GRAPH_DATA_DIR) -> Optional[AccessibilityProfiles]:
+    """ The profiles with the smallest ceiling that can serve the parameters, or None. """
+    pattern = re.compile(rf'^{re.escape(length_type)}_(\d+)\.npz$')
+    ceilings = []
+    for path in glob.glob(os.path.join(data_dir, PROFILES_DIR, f'{length_type}_*.npz')):
+        match = pattern.match(os.path.basename(path))
+        if match and int(match.group(1)) >= max_distance:
+            ceilings.append((int(match.group(1)), path))
+
+    for _, path in sorted(ceilings):
+        profiles = _load_cached(path)
+        if profiles.can_serve(max_distance, max_amenities):
+            return profiles
+    return None
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..config import AMENITY_CACHE_MAX_BYTES, SATURATED_AMENITY_SEARCH
+from .walkability_service import WEIGHTS
+
+# Rough size of an entry besides its arrays: key tuple, OrderedDict slot, profile object and names tuple
+ENTRY_OVERHEAD_BYTES = 400
+
+class AmenityProfile:
+    """ The amenities reached from one node within `cutoff`, each type's distances sorted and
+    packed into one float64 array. With `max_amenities` only the nearest ones of each type are
+    kept, as returned by CompactGraph.scoring_amenities.
+    """
+    __slots__ = ('cutoff', 'max_amenities', 'names', 'offsets', 'distances')
+
+    def __init__(self, cutoff: float, amenities: Dict[str, List[float]], max_amenities: Optional[int] = None):
+        self.cutoff = cutoff
+        self.max_amenities = max_amenities
+        self.names = tuple(amenities)
+        lengths = [len(distances) for distances in amenities.values()]
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.distances = np.fromiter(
+            (distance for distances in amenities.values() for distance in distances),
+            dtype=np.float64, count=int(self.offsets[-1]),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.distances.nbytes + ENTRY_OVERHEAD_BYTES
+
+    def covers(self, cutoff: float, max_amenities: Optional[int] = None) -> bool:
+        if cutoff > self.cutoff:
+            return False
+        if self.max_amenities is None:
+            return True
+        # The nearest n amenities within a smaller cutoff are a prefix of the nearest n within a larger one
+        return max_amenities is not None and max_amenities <= self.max_amenities
+
+    def within(self, cutoff: float, max_amenities: Optional[int] = None) -> Dict[str, List[float]]:
+        """ Same result as a search bounded at `cutoff`, for any request the profile covers. """
+        amenities = {}
+        for name, start, end in zip(self.names, self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            distances = self.distances[start:end]
+            reached = int(np.searchsorted(distances, cutoff, side='right'))
+            if max_amenities is not None:
+                reached = min(reached, max_amenities)
+            if reached:
+                amenities[name] = distances[:reached].tolist()
+        return amenities
+
+class AmenityProfileCache:
+    """ LRU cache of get_closeby_amenities results keyed by (graph version, source node, distance type).
+
+    An entry keeps the profile of the largest cutoff asked for so far, so a smaller cutoff is
+    answered by cutting the sorted distances instead of searching again. Entries are evicted,
+    least recently used first, once their estimated size passes `max_bytes`.
+
+    Requests for scoring pass `max_amenities`, only that many distances per type are kept. With
+    `saturated` they run the search that stops once every subgroup in WEIGHTS has that many.
+    The settled node counts of these searches are kept in the stats.
+    """
+
+    def __init__(self, max_bytes: int = AMENITY_CACHE_MAX_BYTES, saturated: bool = SATURATED_AMENITY_SEARCH):
+        self.max_bytes = max_bytes
+        self.saturated = saturated
+        self._profiles: 'OrderedDict[tuple, AmenityProfile]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scoring_searches = 0
+        self.settled_nodes = 0
+
+    def _search(self, compact, source_node: int, distance_type: str, distance_max_value: float,
+                max_amenities: Optional[int]) -> Dict[str, List[float]]:
+        if max_amenities is None:
+            return compact.get_closeby_amenities(source_node, distance_type, distance_max_value)
+
+        amenities, settled = compact.scoring_amenities(
+            source_node, distance_type, distance_max_value, max_amenities, self.saturated, WEIGHTS
+        )
+        with self._lock:
+            self.scoring_searches += 1
+            self.settled_nodes += settled
+        return amenities
+
+    def get(self, G, source_node: int, distance_type: str, distance_max_value: float,
+            max_amenities: Optional[int] = None) -> Dict[str, List[float]]:
+        compact = G.compact()
+        if G.version is None or self.max_bytes <= 0:
+            # A graph that was never saved has no version to key on
+            return self._search(compact, source_node, distance_type, distance_max_value, max_amenities)
+
+        key = (G.version, source_node, distance_type)
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is not None and profile.covers(distance_max_value, max_amenities):
+                self._profiles.move_to_end(key)
+                self.hits += 1
+                return profile.within(distance_max_value, max_amenities)
+            self.misses += 1
+
+        amenities = self._search(compact, source_node, distance_type, distance_max_value, max_amenities)
+        profile = AmenityProfile(distance_max_value, amenities, max_amenities)
+        self._store(key, profile)
+        return profile.within(distance_max_value, max_amenities)
+
+    def _store(self, key: tuple, profile: AmenityProfile):
+        with self._lock:
+            previous = self._profiles.get(key)
+            if previous is not None:
+                if previous.covers(profile.cutoff, profile.max_amenities):
+                    # Another thread stored a larger profile in the meantime
+                    return
+                self.nbytes -= previous.nbytes
+            self._profiles[key] = profile
+            self._profiles.move_to_end(key)
+            self.nbytes += profile.nbytes
+
+            while self.nbytes > self.max_bytes and self._profiles:
+                _, evicted = self._profiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._profiles),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "saturated": self.saturated,
+            "scoring_searches": self.scoring_searches,
+            "settled_nodes_per_search": self.settled_nodes / self.scoring_searches if self.scoring_searches else None,
+        }
+
+amenity_profile_cache = AmenityProfileCache()
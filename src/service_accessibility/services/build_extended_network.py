@@ -1,27 +1,37 @@
 from .network import PedestrianGraph
-from ..database.connection import get_db_session
+from ..database.connection import session_scope
 from ..models.point_of_interest import CulturePOI, HealthPOI, KidsPOI, MobilityPOI, SchoolPOI, ServicePOI, GreenPOI, SportPOI 
 from ..models.residential import Residential
+from geoalchemy2.shape import to_shape
 from sqlalchemy import func
 
-def build_and_save():
+def build_and_save(contract: bool = False):
     pedestrian_graph = PedestrianGraph()
     pedestrian_graph.build_pedestrian_graph()
     
     poi_types = [CulturePOI, HealthPOI, KidsPOI, MobilityPOI, SchoolPOI, ServicePOI, GreenPOI, SportPOI]
 
-    session = get_db_session()
-    for poi_type in poi_types:
-        pois = session.query(
-            poi_type.subgroup_i,
-            func.array_agg(poi_type.gid).label('poi_ids')  # Aggregate the IDs
-        ).group_by(poi_type.subgroup_i).all()
+    with session_scope() as session:
+        for poi_type in poi_types:
+            pois = session.query(
+                poi_type.subgroup_i,
+                func.array_agg(poi_type.gid).label('poi_ids')  # Aggregate the IDs
+            ).group_by(poi_type.subgroup_i).all()
         
-        for subgroup, poi_ids in pois:
-            # Query the full objects based on the aggregated IDs
-            grouped_pois = session.query(poi_type).filter(poi_type.gid.in_(poi_ids)).all()
-            pedestrian_graph.extend_graph_with(grouped_pois, amenity_type=subgroup)
+            for subgroup, poi_ids in pois:
+                # Query the full objects based on the aggregated IDs
+                grouped_pois = session.query(poi_type).filter(poi_type.gid.in_(poi_ids)).all()
+                pedestrian_graph.extend_graph_with(grouped_pois, amenity_type=subgroup, bulk=True)
 
-    residential_buildings = session.query(Residential).all()
-    pedestrian_graph.extend_graph_with(residential_buildings)
+        residential_buildings = session.query(Residential).all()
+        pedestrian_graph.extend_graph_with(residential_buildings, bulk=True)
+        # Scoring looks buildings up in this map instead of snapping their centroids every time
+        centroids = [to_shape(building.geom).centroid for building in residential_buildings]
+        pedestrian_graph.record_buildings(
+            [building.gid for building in residential_buildings],
+            [(centroid.x, centroid.y) for centroid in centroids],
+        )
+    if contract:
+        # After the buildings are recorded, so their nodes are kept
+        pedestrian_graph.contract_chains()
     pedestrian_graph.save_graph()
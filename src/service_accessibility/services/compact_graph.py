@@ -0,0 +1,262 @@
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+WEIGHT_TYPES = ('length_m', 'minutes')
+
+class CompactGraph:
+    """ Frozen, read-only view of a pedestrian graph backed by flat arrays.
+
+    Nodes are renumbered to 0..N-1 (`node_ids[i]` is the original node id) and the
+    undirected adjacency is stored in both directions as CSR (`indptr`, `indices`)
+    with float32 `length_m` and `minutes` weights. Amenity membership is stored as
+    integer codes into `amenity_names`, again in CSR layout per node.
+    """
+
+    def __init__(self, node_ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 length_m: np.ndarray, minutes: np.ndarray,
+                 amenity_names: List[str], amenity_indptr: np.ndarray, amenity_codes: np.ndarray):
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = {'length_m': length_m, 'minutes': minutes}
+        self.amenity_names = list(amenity_names)
+        self.amenity_indptr = amenity_indptr
+        self.amenity_codes = amenity_codes
+
+        for array in (node_ids, indptr, indices, length_m, minutes, amenity_indptr, amenity_codes):
+            if array.flags.writeable:
+                array.flags.writeable = False
+
+        # One (node, amenity code) pair per membership, used to collect amenities from a distance array
+        self.amenity_pair_nodes = np.repeat(np.arange(self.number_of_nodes, dtype=np.int64), np.diff(amenity_indptr))
+        self._csgraphs = {}
+        self._amenity_totals = None
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def number_of_edges(self) -> int:
+        # Every undirected edge is stored twice
+        return len(self.indices) // 2
+
+    @property
+    def length_m(self) -> np.ndarray:
+        return self.weights['length_m']
+
+    @property
+    def minutes(self) -> np.ndarray:
+        return self.weights['minutes']
+
+    @classmethod
+    def from_networkx(cls, G: nx.Graph) -> 'CompactGraph':
+        node_ids = np.array(sorted(G.nodes), dtype=np.int64)
+        n = len(node_ids)
+
+        edges = list(G.edges(data=True))
+        u = np.searchsorted(node_ids, np.fromiter((e[0] for e in edges), dtype=np.int64, count=len(edges)))
+        v = np.searchsorted(node_ids, np.fromiter((e[1] for e in edges), dtype=np.int64, count=len(edges)))
+        length_m = np.fromiter((e[2]['length_m'] for e in edges), dtype=np.float64, count=len(edges))
+        minutes = np.fromiter((e[2]['minutes'] for e in edges), dtype=np.float64, count=len(edges))
+
+        # Store both directions and sort by source node to get the CSR layout
+        sources = np.concatenate([u, v])
+        targets = np.concatenate([v, u])
+        order = np.lexsort((targets, sources))
+        # int32 offsets match what scipy.sparse.csgraph uses internally, so nothing is copied per search
+        indptr = np.zeros(n + 1, dtype=np.int32 if len(sources) < 2 ** 31 else np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+
+        amenity_names = sorted({amenity for _, data in G.nodes(data=True) for amenity in data.get('amenity_types', ())})
+        amenity_code_of = {name: code for code, name in enumerate(amenity_names)}
+        amenity_counts = np.zeros(n, dtype=np.int64)
+        amenity_codes = []
+        for i, node_id in enumerate(node_ids):
+            amenity_types = G.nodes[int(node_id)].get('amenity_types')
+            if amenity_types:
+                codes = sorted(amenity_code_of[amenity] for amenity in amenity_types)
+                amenity_counts[i] = len(codes)
+                amenity_codes.extend(codes)
+        amenity_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(amenity_counts, out=amenity_indptr[1:])
+
+        return cls(
+            node_ids=node_ids,
+            indptr=indptr,
+            indices=targets[order].astype(np.int32),
+            length_m=np.concatenate([length_m, length_m])[order].astype(np.float32),
+            minutes=np.concatenate([minutes, minutes])[order].astype(np.float32),
+            amenity_names=amenity_names,
+            amenity_indptr=amenity_indptr,
+            amenity_codes=np.array(amenity_codes, dtype=np.int16),
+        )
+
+    def to_networkx(self) -> nx.Graph:
+        """ Rebuild the mutable networkx graph, e.g. for code that still needs PedestrianGraph.G. """
+        G = nx.Graph()
+        G.add_nodes_from(self.node_ids.tolist())
+        for i in np.flatnonzero(np.diff(self.amenity_indptr)):
+            codes = self.amenity_codes[self.amenity_indptr[i]:self.amenity_indptr[i + 1]]
+            G.nodes[int(self.node_ids[i])]['amenity_types'] = {self.amenity_names[code] for code in codes.tolist()}
+
+        sources, targets, positions = self.undirected_edges()
+        u = self.node_ids[sources].tolist()
+        v = self.node_ids[targets].tolist()
+        length_m = self.length_m[positions].astype(np.float64).tolist()
+        minutes = self.minutes[positions].astype(np.float64).tolist()
+        G.add_edges_from(
+            (a, b, {'length_m': length, 'minutes': minute})
+            for a, b, length, minute in zip(u, v, length_m, minutes)
+        )
+        return G
+
+    def undirected_edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Every edge once as (source indices, target indices, positions in the CSR weight arrays). """
+        sources = np.repeat(np.arange(self.number_of_nodes), np.diff(self.indptr))
+        positions = np.flatnonzero(sources < self.indices)
+        return sources[positions], np.asarray(self.indices[positions], dtype=np.int64), positions
+
+    def index_of(self, node_id: int) -> int:
+        i = int(np.searchsorted(self.node_ids, node_id))
+        if i >= self.number_of_nodes or self.node_ids[i] != node_id:
+            raise ValueError(f"Node {node_id} does not exist in the graph.")
+        return i
+
+    def indices_of(self, node_ids) -> np.ndarray:
+        """ Vectorized index_of. """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        indices = np.searchsorted(self.node_ids, node_ids)
+        clipped = np.minimum(indices, self.number_of_nodes - 1)
+        unknown = (indices >= self.number_of_nodes) | (self.node_ids[clipped] != node_ids)
+        if unknown.any():
+            raise ValueError(f"Node {int(node_ids[unknown][0])} does not exist in the graph.")
+        return indices
+
+    def csgraph(self, weight: str) -> csr_matrix:
+        """ scipy adjacency matrix for a weight type. The float32 weights are widened once
+        and cached here, otherwise scipy would copy them on every search.
+        """
+        if weight not in WEIGHT_TYPES:
+            raise ValueError("distance_type must be either 'length_m' or 'minutes'")
+        if weight not in self._csgraphs:
+            n = self.number_of_nodes
+            self._csgraphs[weight] = csr_matrix(
+                (self.weights[weight].astype(np.float64), self.indices, self.indptr), shape=(n, n)
+            )
+        return self._csgraphs[weight]
+
+    def distances_from(self, source_index: int, weight: str, limit: float) -> np.ndarray:
+        """ Bounded Dijkstra from one node. Returns an array with the distance to every node,
+        `inf` for nodes further than `limit`.
+        """
+        return dijkstra(self.csgraph(weight), directed=True, indices=source_index, limit=limit)
+
+    def amenities_within(self, distances: np.ndarray) -> Dict[str, List[float]]:
+        """ Group the finite entries of a distance array by amenity type. """
+        pair_distances = distances[self.amenity_pair_nodes]
+        reached = np.isfinite(pair_distances)
+        codes = self.amenity_codes[reached]
+        pair_distances = pair_distances[reached]
+
+        order = np.lexsort((pair_distances, codes))
+        codes = codes[order]
+        pair_distances = pair_distances[order]
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+
+        return {
+            self.amenity_names[int(group_codes[0])]: group_distances.tolist()
+            for group_codes, group_distances in zip(np.split(codes, boundaries), np.split(pair_distances, boundaries))
+            if len(group_codes)
+        }
+
+    def get_closeby_amenities(self, source_node: int, distance_type: str, distance_max_value: float) -> Dict[str, List[float]]:
+        """ Same result as the networkx traversal in PedestrianGraph, with each list sorted by distance. """
+        distances = self.distances_from(self.index_of(source_node), distance_type, distance_max_value)
+        return self.amenities_within(distances)
+
+    def capped_amenities(self, source_node: int, distance_type: str, distance_max_value: float,
+                         max_amenities: int) -> Tuple[Dict[str, List[float]], int]:
+        """ The `max_amenities` nearest distances per amenity type from the bounded scipy search,
+        and the number of nodes it settled.
+        """
+        distances = self.distances_from(self.index_of(source_node), distance_type, distance_max_value)
+        amenities = {name: values[:max_amenities] for name, values in self.amenities_within(distances).items()}
+        return amenities, int(np.count_nonzero(np.isfinite(distances)))
+
+    def scoring_amenities(self, source_node: int, distance_type: str, distance_max_value: float, max_amenities: int,
+                          saturated: bool = False, subgroups: Optional[Iterable[str]] = None) -> Tuple[Dict[str, List[float]], int]:
+        """ What the accessibility index reads: the nearest `max_amenities` distances per type, and the settled node count.
+        `saturated` picks saturated_amenities over capped_amenities.
+        """
+        if saturated:
+            return self.saturated_amenities(source_node, distance_type, distance_max_value, max_amenities, subgroups)
+        return self.capped_amenities(source_node, distance_type, distance_max_value, max_amenities)
+
+    def amenity_totals(self) -> np.ndarray:
+        """ Number of nodes carrying each amenity code. """
+        if self._amenity_totals is None:
+            self._amenity_totals = np.bincount(self.amenity_codes, minlength=len(self.amenity_names))
+        return self._amenity_totals
+
+    def saturated_amenities(self, source_node: int, distance_type: str, distance_max_value: float, max_amenities: int,
+                            subgroups: Optional[Iterable[str]] = None) -> Tuple[Dict[str, List[float]], int]:
+        """ Scoring-aware get_closeby_amenities: at most the `max_amenities` nearest distances per amenity type.
+
+        A heap-based Dijkstra over the CSR arrays stops as soon as every type in `subgroups` (all types
+        by default) has `max_amenities` entries, or as many as the graph has of it. A type with fewer
+        reachable amenities keeps the search going to the cutoff. Since the index only reads the nearest
+        `max_amenities` distances and saturates the count there, it scores the same as the full result.
+
+        Being pure Python, it is only faster than the scipy search when it settles a small share of
+        the nodes. A type that is rare near the source keeps it going to the cutoff, so it is opt-in
+        (SATURATED_AMENITY_SEARCH), see scripts/benchmark_saturated_search.py.
+
+        Returns the amenities and the number of settled nodes.
+        """
+        if distance_type not in WEIGHT_TYPES:
+            raise ValueError("distance_type must be either 'length_m' or 'minutes'")
+        if max_amenities < 1:
+            raise ValueError("max_amenities must be at least 1")
+        weights = self.weights[distance_type]
+
+        tracked = set(self.amenity_names) if subgroups is None else set(subgroups)
+        needed = [
+            min(max_amenities, int(total)) if name in tracked else 0
+            for name, total in zip(self.amenity_names, self.amenity_totals().tolist())
+        ]
+        unsaturated = sum(1 for need in needed if need)
+        found = {}
+
+        source = self.index_of(source_node)
+        best = {source: 0.0}
+        settled = set()
+        heap = [(0.0, source)]
+        while heap and unsaturated:
+            distance, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+
+            amenity_start, amenity_end = self.amenity_indptr[node], self.amenity_indptr[node + 1]
+            if amenity_start != amenity_end:
+                for code in self.amenity_codes[amenity_start:amenity_end].tolist():
+                    distances = found.setdefault(code, [])
+                    if len(distances) < needed[code]:
+                        distances.append(distance)
+                        if len(distances) == needed[code]:
+                            unsaturated -= 1
+
+            start, end = self.indptr[node], self.indptr[node + 1]
+            for neighbour, weight in zip(self.indices[start:end].tolist(), weights[start:end].tolist()):
+                candidate = distance + weight
+                if candidate <= distance_max_value and candidate < best.get(neighbour, np.inf):
+                    best[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, neighbour))
+
+        amenities = {self.amenity_names[code]: distances for code, distances in sorted(found.items()) if distances}
+        return amenities, len(settled)
@@ -1,12 +1,40 @@
-from typing import Tuple, Union
+from functools import lru_cache
+from typing import Sequence, Tuple, Union
+import numpy as np
+import shapely
 from pyproj import Transformer
 from shapely.geometry import Point, MultiPoint, LineString, Polygon, MultiPolygon, GeometryCollection
 
 BGS2005 = "EPSG:7801"
 WGS84 = "EPSG:4326"
 
+@lru_cache(maxsize=None)
 def get_transformer(source_crs: str = BGS2005, target_crs: str = WGS84, always_xy: bool = True):
-    return Transformer.from_crs(source_crs, target_crs, always_xy)
+    """ Building a Transformer parses the CRS definitions, so one instance per CRS pair is kept.
+    pyproj transformers are thread-safe since 3.1.
+    """
+    return Transformer.from_crs(source_crs, target_crs, always_xy=always_xy)
+
+def crs_transform_array(transformer: Transformer, coords: np.ndarray, swap_coords: bool = False) -> np.ndarray:
+    """ Project an (N, 2) array of x, y coordinates with a single transformer call. """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    lon, lat = transformer.transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([lat, lon] if swap_coords else [lon, lat])
+
+def crs_transform_many(transformer: Transformer, geometries: Sequence, swap_coords: bool = False) -> np.ndarray:
+    """ Transform many geometries at once: all their coordinates are projected as one array
+    and written back, so rings, holes and multipart structure are kept as they are.
+    Only x, y are projected, Z is dropped: the 3D school MultiPoints come back 2D.
+    Raises ValueError("Not Valid") if any geometry is invalid, like crs_transform_polygon.
+    Returns an array of geometries in the input order.
+    """
+    geometries = np.array(geometries, dtype=object)
+    if not shapely.is_valid(geometries).all():
+        raise ValueError("Not Valid")
+    coords = shapely.get_coordinates(geometries)
+    if len(coords) == 0:
+        return geometries
+    return shapely.set_coordinates(geometries.copy(), crs_transform_array(transformer, coords, swap_coords))
 
 def crs_transform_point(transformer: Transformer, point: Point, swap_coords: bool = False) -> Point:
     """ In the database we have point in 7801 (x, y) which translates to 4326 (lon, lat),
@@ -51,12 +79,7 @@ def crs_transform_polygon(transformer: Transformer, polygon: Polygon, swap_coord
     """
     if not polygon.is_valid:
         raise ValueError("Not Valid")
-    transformed_coords = [transformer.transform(x, y) for x, y in polygon.exterior.coords]
-
-    if swap_coords:
-        transformed_coords = [(lat, lon) for lon, lat in transformed_coords]
-
-    return Polygon(transformed_coords)
+    return crs_transform_many(transformer, [polygon], swap_coords)[0]
 
 def crs_transform_multipolygon(transformer: Transformer, multipolygon: MultiPolygon, swap_coords: bool = False) -> MultiPolygon:
     if not multipolygon.is_valid:
@@ -0,0 +1,12 @@
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from ..config import GEOJSON_COORDINATE_DECIMALS
+
+def round_coordinates(geometry, decimals: int = GEOJSON_COORDINATE_DECIMALS):
+    return shapely.transform(geometry, lambda coords: np.round(coords, decimals))
+
+def geometry_mapping(geometry, decimals: int = GEOJSON_COORDINATE_DECIMALS) -> dict:
+    """ GeoJSON geometry of a shapely object, with the coordinates rounded to `decimals`. """
+    return mapping(round_coordinates(geometry, decimals))
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+import numpy as np
+
+from .compact_graph import CompactGraph
+
+FORMAT_NAME = 'pedestrian-graph'
+FORMAT_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+# Every array is stored as a raw .npy so it can be memory-mapped and shared between processes
+ARRAY_NAMES = ('node_ids', 'coords', 'indptr', 'indices', 'length_m', 'minutes', 'amenity_indptr', 'amenity_codes')
+
+# Builds kept next to the live one, so a reader that resolved the previous build can finish loading it
+KEEP_PREVIOUS_BUILDS = 1
+
+def artifact_path(data_dir: str, filename: str) -> str:
+    return os.path.join(data_dir, f'{filename}.graph')
+
+def build_path(path: str, build_id: str) -> str:
+    return f'{path}.{build_id}'
+
+def artifact_exists(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILENAME))
+
+def read_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('format') != FORMAT_NAME:
+        raise ValueError(f"{path} is not a {FORMAT_NAME} artifact")
+    if manifest.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {manifest['version']}, this code reads up to {FORMAT_VERSION}")
+    return manifest
+
+def save_artifact(path: str, compact: CompactGraph, coords: np.ndarray, extra: Optional[dict] = None) -> dict:
+    """ Write the graph to a directory of .npy files plus a manifest.
+
+    Every build gets its own directory next to the target, and path is a symlink to the live
+    one. The link is replaced with os.replace, so path always resolves to a complete build.
+    Older builds beyond KEEP_PREVIOUS_BUILDS are removed. Returns the manifest.
+    """
+    arrays = {
+        'node_ids': compact.node_ids,
+        'coords': np.ascontiguousarray(coords, dtype=np.float64),
+        'indptr': compact.indptr,
+        'indices': compact.indices,
+        'length_m': compact.length_m,
+        'minutes': compact.minutes,
+        'amenity_indptr': compact.amenity_indptr,
+        'amenity_codes': compact.amenity_codes,
+    }
+    if extra:
+        arrays.update(extra)
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'build_id': uuid.uuid4().hex,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'nodes': compact.number_of_nodes,
+        'edges': compact.number_of_edges,
+        'amenity_names': compact.amenity_names,
+        'arrays': sorted(arrays),
+    }
+
+    version_path = build_path(path, manifest['build_id'])
+    os.makedirs(version_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(version_path, f'{name}.npy'), np.asarray(array))
+    with open(os.path.join(version_path, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        # An artifact from before the symlink layout is moved aside once
+        os.rename(path, build_path(path, read_manifest(path)['build_id']))
+
+    link_path = f'{path}.link-{manifest["build_id"]}'
+    os.symlink(os.path.basename(version_path), link_path)
+    os.replace(link_path, path)
+
+    _remove_old_builds(path, version_path)
+    return manifest
+
+def _remove_old_builds(path: str, live_path: str):
+    directory, name = os.path.split(path)
+    builds = [
+        os.path.join(directory, entry) for entry in os.listdir(directory or '.')
+        if entry.startswith(f'{name}.') and not entry.startswith(f'{name}.link-')
+        and os.path.isdir(os.path.join(directory, entry)) and not os.path.islink(os.path.join(directory, entry))
+    ]
+    builds = [build for build in builds if os.path.abspath(build) != os.path.abspath(live_path)]
+    builds.sort(key=os.path.getmtime, reverse=True)
+    for build in builds[KEEP_PREVIOUS_BUILDS:]:
+        shutil.rmtree(build, ignore_errors=True)
+
+def load_artifact(path: str, mmap_mode: Optional[str] = 'r') -> Tuple[CompactGraph, np.ndarray, dict, dict]:
+    """ Load an artifact written by save_artifact. With mmap_mode='r' the arrays are mapped,
+    not read, so loading is near-instant and the pages are shared between processes.
+
+    Returns the CompactGraph, the node coordinates indexed by node id, the manifest and any extra arrays.
+    """
+    # Resolved once, so every array comes from the same build even if the link is swapped meanwhile
+    path = os.path.realpath(path)
+    manifest = read_manifest(path)
+    arrays = {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+        for name in manifest['arrays']
+    }
+
+    compact = CompactGraph(
+        node_ids=arrays.pop('node_ids'),
+        indptr=arrays.pop('indptr'),
+        indices=arrays.pop('indices'),
+        length_m=arrays.pop('length_m'),
+        minutes=arrays.pop('minutes'),
+        amenity_names=manifest['amenity_names'],
+        amenity_indptr=arrays.pop('amenity_indptr'),
+        amenity_codes=arrays.pop('amenity_codes'),
+    )
+    coords = arrays.pop('coords')
+    return compact, coords, manifest, arrays
@@ -0,0 +1,107 @@
+import os
+import resource
+import threading
+import time
+from typing import Optional
+
+from ..config import GRAPH_DATA_DIR, GRAPH_FILENAME
+from .network import PedestrianGraph
+
+def _current_rss_bytes() -> int:
+    """ Resident set size of the current process. /proc is read when available,
+    otherwise the peak RSS reported by getrusage is used as an approximation.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class GraphRegistry:
+    """ Holds the single PedestrianGraph instance shared by all requests of a process.
+
+    The graph is loaded once (normally from the FastAPI lifespan hook) and handed
+    to the routes as a dependency, so a point query only pays for the traversal.
+    """
+
+    def __init__(self, data_dir: str = GRAPH_DATA_DIR, filename: str = GRAPH_FILENAME):
+        self.data_dir = data_dir
+        self.filename = filename
+        self._graph: Optional[PedestrianGraph] = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.memory_bytes: Optional[int] = None
+        self.loaded_at: Optional[float] = None
+        self.load_count = 0
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._graph is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._graph.version if self._graph is not None else None
+
+    def load(self) -> Optional[PedestrianGraph]:
+        """ Load the graph unless it is already loaded. """
+        with self._lock:
+            if self._graph is None:
+                self._load()
+            return self._graph
+
+    def reload(self) -> Optional[PedestrianGraph]:
+        """ Load the graph from disk again and swap it in, e.g. after the network was rebuilt.
+        Returns None if it could not be loaded, the previous graph is then kept.
+        """
+        with self._lock:
+            return self._graph if self._load() else None
+
+    def unload(self):
+        with self._lock:
+            self._graph = None
+
+    def get(self) -> Optional[PedestrianGraph]:
+        if self._graph is None:
+            return self.load()
+        return self._graph
+
+    def _load(self) -> bool:
+        rss_before = _current_rss_bytes()
+        started = time.perf_counter()
+        try:
+            graph = PedestrianGraph.load_graph(data_dir=self.data_dir, filename=self.filename)
+        except (OSError, ValueError) as e:
+            print(f"Pedestrian graph could not be loaded: {e}")
+            graph = None
+
+        if graph is None:
+            # Keep serving the previous graph if a reload could not find or read the artifact
+            return False
+
+        self.load_seconds = time.perf_counter() - started
+        self.memory_bytes = max(_current_rss_bytes() - rss_before, 0)
+        self._graph = graph
+        self.loaded_at = time.time()
+        self.load_count += 1
+        print(f"Pedestrian graph loaded in {self.load_seconds:.2f}s, ~{self.memory_bytes / 2**20:.1f} MiB")
+        return True
+
+    def stats(self) -> dict:
+        graph = self._graph
+        compact = graph.compact() if graph is not None else None
+        return {
+            "loaded": graph is not None,
+            "data_dir": self.data_dir,
+            "filename": self.filename,
+            "version": graph.version if graph is not None else None,
+            "nodes": compact.number_of_nodes if compact is not None else None,
+            "edges": compact.number_of_edges if compact is not None else None,
+            "load_seconds": self.load_seconds,
+            "memory_bytes": self.memory_bytes,
+            "loaded_at": self.loaded_at,
+            "load_count": self.load_count,
+        }
+
+graph_registry = GraphRegistry()
@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import Point
+
+from ..config import ISOCHRONE_BUFFER_METERS, ISOCHRONE_CACHE_SIZE, ISOCHRONE_MAX_BANDS
+from .compact_graph import WEIGHT_TYPES
+from .crs_transform import crs_transform_many, get_transformer
+from .geojson import geometry_mapping
+
+def isochrone_bands(max_distance: int, interval: Optional[int] = None) -> Tuple[int, ...]:
+    """ Cutoffs of the requested bands in increasing order, the last one is always max_distance. """
+    if max_distance <= 0:
+        raise ValueError("max_distance must be positive")
+    if interval is None:
+        return (max_distance,)
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+
+    bands = tuple(range(interval, max_distance, interval)) + (max_distance,)
+    if len(bands) > ISOCHRONE_MAX_BANDS:
+        raise ValueError(f"At most {ISOCHRONE_MAX_BANDS} bands per request, increase the interval")
+    return bands
+
+def _reached_fraction(distances: np.ndarray, weights: np.ndarray, cutoff: float) -> np.ndarray:
+    """ Share of each edge walkable from one of its ends within cutoff. """
+    # Zero-length edges are either reached or not
+    fraction = (distances <= cutoff).astype(np.float64)
+    np.divide(cutoff - distances, weights, out=fraction, where=weights > 0)
+    return np.clip(fraction, 0.0, 1.0)
+
+def reached_segments(start: np.ndarray, end: np.ndarray, weights: np.ndarray,
+                     start_distances: np.ndarray, end_distances: np.ndarray, cutoff: float) -> np.ndarray:
+    """ The parts of the edges (start[i], end[i]) that are within cutoff, as an (M, 2, 2) array.
+
+    An edge reached from only one end is cut where the cutoff falls, by linear interpolation
+    along it. One reached from both ends is whole unless the two reached parts do not meet.
+    """
+    from_start = _reached_fraction(start_distances, weights, cutoff)
+    from_end = _reached_fraction(end_distances, weights, cutoff)
+    whole = from_start + from_end >= 1.0
+    partial_start = ~whole & (from_start > 0)
+    partial_end = ~whole & (from_end > 0)
+
+    direction = end - start
+    segments = [
+        np.stack([start[whole], end[whole]], axis=1),
+        np.stack([start[partial_start], start[partial_start] + from_start[partial_start, None] * direction[partial_start]], axis=1),
+        np.stack([end[partial_end], end[partial_end] - from_end[partial_end, None] * direction[partial_end]], axis=1),
+    ]
+    return np.concatenate(segments)
+
+class IsochroneEngine:
+    """ Isochrone polygons around the node nearest to a point, one per band.
+
+    A single bounded search to the largest cutoff gives the distance map that every band is
+    cut from. A band is the union of the reached edge parts, buffered. Results are kept in
+    an LRU cache keyed by graph version, snapped node, metric and bands.
+    """
+
+    def __init__(self, cache_size: int = ISOCHRONE_CACHE_SIZE, buffer: float = ISOCHRONE_BUFFER_METERS):
+        self.cache_size = cache_size
+        self.buffer = buffer
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._edges = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _edge_arrays(self, G):
+        """ Straight pieces of the undirected edges of the current CompactGraph. Rebuilt after a reload.
+
+        An edge made by contract_chains is split back into the pieces through its removed nodes,
+        each covering the [from, to] share of the edge, apportioned by length.
+        """
+        compact = G.compact()
+        edges = self._edges
+        if edges is None or edges[0] is not compact:
+            sources, targets, positions = compact.undirected_edges()
+            node_coords = np.asarray(G.node_coords, dtype=np.float64)
+            start_nodes = compact.node_ids[sources]
+            end_nodes = compact.node_ids[targets]
+            piece_edges = np.arange(len(sources))
+            start = node_coords[start_nodes]
+            end = node_coords[end_nodes]
+            share_from = np.zeros(len(sources))
+            share_to = np.ones(len(sources))
+
+            via = G.edge_via()
+            if via:
+                pieces = [(piece_edges, start, end, share_from, share_to)]
+                contracted = [
+                    (edge, via[(u, v)])
+                    for edge, (u, v) in enumerate(zip(start_nodes.tolist(), end_nodes.tolist())) if (u, v) in via
+                ]
+                keep = np.ones(len(sources), dtype=bool)
+                for edge, via_nodes in contracted:
+                    keep[edge] = False
+                    points = node_coords[[start_nodes[edge], *via_nodes, end_nodes[edge]]]
+                    cumulative = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))])
+                    shares = cumulative / cumulative[-1] if cumulative[-1] > 0 else np.linspace(0, 1, len(points))
+                    pieces.append((np.full(len(points) - 1, edge), points[:-1], points[1:], shares[:-1], shares[1:]))
+                pieces[0] = tuple(array[keep] for array in pieces[0])
+                piece_edges, start, end, share_from, share_to = (np.concatenate(arrays) for arrays in zip(*pieces))
+
+            coords = node_coords[compact.node_ids]
+            edges = (compact, sources, targets, positions, coords, piece_edges, start, end, share_from, share_to)
+            self._edges = edges
+        return edges
+
+    def polygons(self, G, node_id: int, distance_type: str, bands: Tuple[float, ...]) -> List:
+        """ One (Multi)Polygon per band around node_id, in the graph's CRS. """
+        if distance_type not in WEIGHT_TYPES:
+            raise ValueError("distance_type must be either 'length_m' or 'minutes'")
+
+        compact, sources, targets, positions, coords, piece_edges, start, end, share_from, share_to = self._edge_arrays(G)
+        source_index = compact.index_of(node_id)
+        distances = compact.distances_from(source_index, distance_type, max(bands))
+
+        source_distances = distances[sources]
+        target_distances = distances[targets]
+        near = (np.minimum(source_distances, target_distances) <= max(bands))[piece_edges]
+        edges = piece_edges[near]
+        weights = np.asarray(compact.weights[distance_type][positions[edges]], dtype=np.float64)
+        share_from, share_to = share_from[near], share_to[near]
+        # Distance to both ends of every piece, through whichever end of its edge is closer
+        from_distances = np.minimum(source_distances[edges] + share_from * weights, target_distances[edges] + (1 - share_from) * weights)
+        to_distances = np.minimum(source_distances[edges] + share_to * weights, target_distances[edges] + (1 - share_to) * weights)
+        piece_weights = (share_to - share_from) * weights
+
+        polygons = []
+        for cutoff in bands:
+            segments = reached_segments(start[near], end[near], piece_weights, from_distances, to_distances, cutoff)
+            if len(segments):
+                polygon = shapely.buffer(shapely.multilinestrings(shapely.linestrings(segments)), self.buffer, quad_segs=4)
+            else:
+                # Nothing but the source node itself is reachable
+                polygon = Point(coords[source_index]).buffer(self.buffer, quad_segs=4)
+            polygons.append(polygon)
+        return polygons
+
+    def features(self, G, source: Point, distance_type: str, bands: Tuple[float, ...]) -> List[dict]:
+        """ GeoJSON features of the bands around the node nearest to source, largest band
+        first so the smaller ones are drawn on top of it.
+        """
+        node_id = G.find_nearest_node(source)
+        key = (G.version, node_id, distance_type, tuple(bands))
+        with self._lock:
+            features = self._cache.get(key)
+            if features is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return features
+            self.misses += 1
+
+        geometries = crs_transform_many(get_transformer(), self.polygons(G, node_id, distance_type, bands))
+        features = [
+            {
+                "type": "Feature",
+                "geometry": geometry_mapping(geometry),
+                "properties": {
+                    "distance_type": distance_type,
+                    "max_distance": cutoff,
+                },
+            }
+            for cutoff, geometry in reversed(list(zip(bands, geometries)))
+        ]
+
+        with self._lock:
+            self._cache[key] = features
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return features
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+            self._edges = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+isochrone_engine = IsochroneEngine()
@@ -0,0 +1,109 @@
+import heapq
+from typing import Dict, List, Optional
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from tqdm import tqdm
+
+from .compact_graph import CompactGraph
+
+class NearestAmenityTable:
+    """ For a set of nodes, the `max_amenities` smallest distances to each amenity subgroup.
+
+    `distances` has shape (nodes, subgroups, max_amenities), is sorted along the last axis
+    and padded with `inf`. `counts` holds how many of those entries are finite. Because the
+    accessibility index saturates at `max_amenities`, this is all it needs from a traversal.
+    """
+
+    def __init__(self, node_indices: np.ndarray, amenity_names: List[str], distances: np.ndarray,
+                 distance_type: str, max_distance: float):
+        self.node_indices = node_indices
+        self.amenity_names = list(amenity_names)
+        self.distances = distances
+        self.counts = np.isfinite(distances).sum(axis=2)
+        self.distance_type = distance_type
+        self.max_distance = max_distance
+        self._row_of = {int(node_index): row for row, node_index in enumerate(node_indices)}
+
+    @property
+    def max_amenities(self) -> int:
+        return self.distances.shape[2]
+
+    def row_of(self, node_index: int) -> int:
+        return self._row_of[node_index]
+
+    def proximity_dict(self, node_index: int) -> Dict[str, List[float]]:
+        """ Same shape as PedestrianGraph.get_closeby_amenities, truncated to the nearest `max_amenities`. """
+        row = self.row_of(node_index)
+        return {
+            amenity: self.distances[row, s, :self.counts[row, s]].tolist()
+            for s, amenity in enumerate(self.amenity_names)
+            if self.counts[row, s]
+        }
+
+def _nearest_for_sources(compact: CompactGraph, sources: np.ndarray, distance_type: str, max_distance: float,
+                         max_amenities: int, target_indices: np.ndarray) -> np.ndarray:
+    """ Multi-source bounded search from all `sources`, keeping the `max_amenities`
+    smallest distances at every target node. Returns a (targets, max_amenities) array.
+    """
+    if max_amenities == 1:
+        # scipy keeps only the nearest source per node, a single traversal is enough
+        nearest = dijkstra(compact.csgraph(distance_type), directed=True, indices=sources, limit=max_distance, min_only=True)
+        return nearest[target_indices][:, None]
+
+    # One traversal carrying up to max_amenities labels per node, each from a different source.
+    # Labels leave the heap in increasing distance, so the first ones a node accepts are from its
+    # nearest sources. A label is only passed on while the neighbour still has room for its source.
+    indptr = compact.indptr.tolist()
+    indices = compact.indices.tolist()
+    weights = compact.weights[distance_type].tolist()
+    reached_from = [None] * compact.number_of_nodes
+    reached_at = [None] * compact.number_of_nodes
+
+    heap = [(0.0, source, source) for source in sources.tolist()]
+    heapq.heapify(heap)
+    while heap:
+        distance, node, source = heapq.heappop(heap)
+        node_sources = reached_from[node]
+        if node_sources is None:
+            node_sources = reached_from[node] = []
+            reached_at[node] = []
+        elif len(node_sources) == max_amenities or source in node_sources:
+            continue
+        node_sources.append(source)
+        reached_at[node].append(distance)
+
+        for position in range(indptr[node], indptr[node + 1]):
+            candidate = distance + weights[position]
+            if candidate <= max_distance:
+                neighbour_sources = reached_from[indices[position]]
+                if neighbour_sources is None or (len(neighbour_sources) < max_amenities and source not in neighbour_sources):
+                    heapq.heappush(heap, (candidate, indices[position], source))
+
+    best = np.full((len(target_indices), max_amenities), np.inf)
+    for row, node in enumerate(target_indices.tolist()):
+        if reached_at[node] is not None:
+            best[row, :len(reached_at[node])] = reached_at[node]
+    return best
+
+def compute_nearest_amenities(compact: CompactGraph, distance_type: str, max_distance: float, max_amenities: int,
+                              target_indices: Optional[np.ndarray] = None) -> NearestAmenityTable:
+    """ Build the nearest-amenity table with one multi-source search per amenity subgroup, so the
+    cost depends on the number of subgroups rather than on the number of target or amenity nodes.
+    """
+    if max_amenities < 1:
+        raise ValueError("max_amenities must be at least 1")
+
+    if target_indices is None:
+        target_indices = np.arange(compact.number_of_nodes)
+    target_indices = np.asarray(target_indices, dtype=np.int64)
+
+    amenity_names = compact.amenity_names
+    distances = np.full((len(target_indices), len(amenity_names), max_amenities), np.inf)
+
+    for code, amenity in enumerate(tqdm(amenity_names, desc="Amenity subgroups", unit="subgroup")):
+        sources = np.unique(compact.amenity_pair_nodes[compact.amenity_codes == code])
+        distances[:, code, :] = _nearest_for_sources(
+            compact, sources, distance_type, max_distance, max_amenities, target_indices
+        )
+
+    return NearestAmenityTable(target_indices, amenity_names, distances, distance_type, max_distance)
@@ -1,49 +1,148 @@
-from typing import Dict, Tuple
+from typing import Dict, Iterator, Optional, Tuple
 import networkx as nx
 from rtree import index
 import pickle
 import os
 from geoalchemy2.shape import to_shape
-from shapely.geometry import LineString, MultiLineString, Point, Polygon, MultiPoint, MultiPolygon, box
-from shapely import wkt
-from ..database.connection import get_db_session
+from shapely.geometry import LineString, MultiLineString, Point, Polygon, MultiPoint, MultiPolygon
+import shapely
+from ..database.connection import session_scope
 from ..models.pedestrian_path import PedestrianPath
-from .crs_transform import get_transformer, crs_transform
+from .crs_transform import get_transformer, crs_transform_array
+from .compact_graph import CompactGraph
+from .amenity_profile_cache import amenity_profile_cache
+from ..config import GEOJSON_COORDINATE_DECIMALS
+from .graph_artifact import artifact_exists, artifact_path, load_artifact, save_artifact
 from tqdm import tqdm
 from collections import defaultdict
 import numpy as np
-import alphashape
 
 class PedestrianGraph:
-    POINT_BUFFER = 1.0  # 1 meter buffer as rtree requires a rectangle to work with
+    ENGINES = ('networkx', 'csr')
 
-    def __init__(self, data_dir: str = 'data', filename: str = "extended_network"):
+    def __init__(self, data_dir: str = 'data', filename: str = "extended_network",
+                 snap_tolerance: float = 0.0, coordinate_decimals: Optional[int] = None):
         self.graph_filename = os.path.join(data_dir, f'{filename}.gpickle')
-        nodes_idx_filename = os.path.join(data_dir, f'{filename}_nodes')
-        edges_idx_filename = os.path.join(data_dir, f'{filename}_edges')
+        self.artifact_path = artifact_path(data_dir, filename)
 
-        self.G = nx.Graph()
-        self.rtree_nodes_index = index.Index(nodes_idx_filename)
-        self.rtree_edges_index = index.Index(edges_idx_filename)
+        self._G = nx.Graph()
+        # The edge index only lives in memory while building, the artifact does not need it.
+        # Nearest-node queries go through node_tree
+        self.rtree_edges_index = index.Index()
         self.node_id_counter = 0
         self.edge_id_counter = 0
         self.edge_id_to_nodes = {}  # Mapping from edge_id to (start_node, end_node)
         self.nodes_to_edge_id = {}  # Mapping from (start_node, end_node) to edge_id
+        # An artifact keeps no edge ids, they are numbered again on first use, see _restore_edge_maps
+        self._edge_maps_stale = False
+        # Node coordinates, row i holds node i. Grows by doubling while building, see node_coords
+        self._coords = np.empty((1024, 2), dtype=np.float64)
+        self._compact = None
+        self._node_tree = None
+        self.version = None
+        # Building gid -> node the building is scored from, sorted by gid. Recorded by the build and kept in the artifact
+        self.building_gids = np.empty(0, dtype=np.int64)
+        self.building_nodes = np.empty(0, dtype=np.int64)
+        # Edges made by contract_chains and the removed nodes along each, ordered from via_edges[i, 0] to via_edges[i, 1]
+        self.via_edges = np.empty((0, 2), dtype=np.int64)
+        self.via_indptr = np.zeros(1, dtype=np.int64)
+        self.via_nodes = np.empty(0, dtype=np.int64)
+
+        # Exact-match node lookup keyed by (optionally rounded) coordinates, see _coord_key
+        self.coordinate_decimals = coordinate_decimals
+        self._node_lookup = {}
+        # Endpoints closer than snap_tolerance are merged through a grid hash with cells of that size
+        self.snap_tolerance = snap_tolerance
+        self._node_grid = defaultdict(list)
+
+    @property
+    def node_coords(self) -> np.ndarray:
+        """ (node_id_counter, 2) float64 coordinates indexed by node id. """
+        return self._coords[:self.node_id_counter]
+
+    def _append_node_coords(self, x: float, y: float) -> int:
+        node_id = self.node_id_counter
+        if node_id >= len(self._coords) or not self._coords.flags.writeable:
+            grown = np.empty((max(2 * len(self._coords), 1024), 2), dtype=np.float64)
+            grown[:node_id] = self._coords[:node_id]
+            self._coords = grown
+        self._coords[node_id] = (x, y)
+        self.node_id_counter += 1
+        return node_id
+
+    def _invalidate_views(self):
+        self._compact = None
+        self._node_tree = None
+
+    @property
+    def G(self) -> nx.Graph:
+        if self._G is None:
+            # Loaded from an artifact: networkx is only materialized for code that still needs it
+            self._G = self._compact.to_networkx()
+        return self._G
+
+    @G.setter
+    def G(self, G: nx.Graph):
+        self._G = G
+
+    def compact(self) -> CompactGraph:
+        """ Frozen array-backed view of G used by the 'csr' engine. It is built on first use
+        and dropped whenever the graph is built or extended.
+        """
+        if self._compact is None:
+            self._compact = CompactGraph.from_networkx(self.G)
+        return self._compact
 
     def save_graph(self):
-        # Save the graph and other data
-        with open(self.graph_filename, 'wb') as f:
-            pickle.dump((self.G, self.node_id_counter, self.edge_id_counter, self.edge_id_to_nodes, self.nodes_to_edge_id), f)
+        extra = {}
+        if len(self.building_gids):
+            extra.update(building_gids=self.building_gids, building_nodes=self.building_nodes)
+        if len(self.via_edges):
+            extra.update(via_edges=self.via_edges, via_indptr=self.via_indptr, via_nodes=self.via_nodes)
+        manifest = save_artifact(self.artifact_path, self.compact(), self.node_coords, extra)
+        self.version = manifest['build_id']
+
+        print(f"Graph saved to {self.artifact_path} (build {self.version})")
 
-        # The index files are automatically saved when closing
-        self.rtree_nodes_index.close()
-        self.rtree_edges_index.close()
+    @classmethod
+    def load_graph(cls, data_dir: str = 'data', filename: str = 'extended_network', mmap_mode: str = 'r'):
+        """ Load the binary artifact if there is one, otherwise a legacy gpickle. """
+        if artifact_exists(artifact_path(data_dir, filename)):
+            return cls.load_artifact(data_dir, filename, mmap_mode)
+
+        graph_filename = os.path.join(data_dir, f'{filename}.gpickle')
+        if os.path.exists(graph_filename):
+            return cls.load_gpickle(data_dir, filename)
 
-        print(f"Graph and indices saved to {self.graph_filename}")
+        print(f"Graph file {artifact_path(data_dir, filename)} not found.")
+        return None
 
     @classmethod
-    def load_graph(cls, data_dir: str = 'data', filename: str = 'extended_network'):
-        nodes_idx_filename = os.path.join(data_dir, f'{filename}_nodes')
+    def load_artifact(cls, data_dir: str = 'data', filename: str = 'extended_network', mmap_mode: str = 'r'):
+        pedestrian_graph = cls(data_dir, filename)
+        compact, coords, manifest, extra = load_artifact(pedestrian_graph.artifact_path, mmap_mode)
+
+        pedestrian_graph._G = None
+        pedestrian_graph._compact = compact
+        pedestrian_graph._coords = coords
+        pedestrian_graph.node_id_counter = len(coords)
+        pedestrian_graph._node_lookup = None
+        pedestrian_graph._edge_maps_stale = True
+        pedestrian_graph.version = manifest['build_id']
+        if 'building_gids' in extra:
+            pedestrian_graph.building_gids = extra['building_gids']
+            pedestrian_graph.building_nodes = extra['building_nodes']
+        if 'via_edges' in extra:
+            pedestrian_graph.via_edges = extra['via_edges']
+            pedestrian_graph.via_indptr = extra['via_indptr']
+            pedestrian_graph.via_nodes = extra['via_nodes']
+
+        print(f"Graph loaded from {pedestrian_graph.artifact_path} (build {pedestrian_graph.version})")
+        return pedestrian_graph
+
+    @classmethod
+    def load_gpickle(cls, data_dir: str = 'data', filename: str = 'extended_network'):
+        """ Legacy format: a pickled networkx graph next to libspatialindex files. """
         edges_idx_filename = os.path.join(data_dir, f'{filename}_edges')
         graph_filename = os.path.join(data_dir, f'{filename}.gpickle')
 
@@ -51,33 +150,54 @@ class PedestrianGraph:
             print(f"Graph file {graph_filename} not found.")
             return None
 
-        pedestrian_graph = cls()
+        pedestrian_graph = cls(data_dir, filename)
         with open(graph_filename, 'rb') as f:
             pedestrian_graph.G, pedestrian_graph.node_id_counter, pedestrian_graph.edge_id_counter, pedestrian_graph.edge_id_to_nodes, pedestrian_graph.nodes_to_edge_id = pickle.load(f)
+        pedestrian_graph.version = f'gpickle-{int(os.path.getmtime(graph_filename))}'
+        pedestrian_graph._coords_from_wkt()
+        pedestrian_graph._node_lookup = None
 
-        # Load R-tree indices or rebuild
-        if os.path.exists(f'{nodes_idx_filename}.idx') and os.path.exists(f'{edges_idx_filename}.idx'):
-            pedestrian_graph.rtree_nodes_index = index.Index(nodes_idx_filename)
+        # Load the edge R-tree or rebuild it
+        if os.path.exists(f'{edges_idx_filename}.idx'):
             pedestrian_graph.rtree_edges_index = index.Index(edges_idx_filename)
-            print(f"Graph and indices loaded from {dir}")
+            print(f"Graph and indices loaded from {data_dir}")
         else:
             print(f"R-tree index files not found. Rebuilding indices.")
             pedestrian_graph.rebuild_rtree_indices()
 
         return pedestrian_graph
 
-    def rebuild_rtree_indices(self):
-        self.rtree_nodes_index = index.Index()
-        for node_id, node_data in self.G.nodes(data=True):
-            point = wkt.loads(node_data['wkt'])
-            self.rtree_nodes_index.insert(node_id, point.bounds)
+    def _coords_from_wkt(self):
+        """ Legacy graphs keep each node location as a 'wkt' attribute, move them into node_coords. """
+        node_ids = [node_id for node_id, data in self.G.nodes(data=True) if 'wkt' in data]
+        coords = shapely.get_coordinates(shapely.from_wkt([self.G.nodes[node_id]['wkt'] for node_id in node_ids]))
+
+        self._coords = np.full((max(self.node_id_counter, 1024), 2), np.nan)
+        self._coords[node_ids] = coords
+        for node_id in node_ids:
+            del self.G.nodes[node_id]['wkt']
+
+    def _restore_edge_maps(self):
+        """ Number the edges of a graph loaded from an artifact and bulk-load the edge R-tree,
+        so it can be extended like a freshly built one. Serving never needs them.
+        """
+        if not self._edge_maps_stale:
+            return
+        compact = self.compact()
+        sources, targets, _ = compact.undirected_edges()
+        edges = list(zip(compact.node_ids[sources].tolist(), compact.node_ids[targets].tolist()))
 
-        self.rtree_edges_index = index.Index()
-        for edge_id, (start_node, end_node) in self.edge_id_to_nodes.items():
-            start_point = wkt.loads(self.G.nodes[start_node]['wkt'])
-            end_point = wkt.loads(self.G.nodes[end_node]['wkt'])
-            line = LineString([start_point, end_point])
-            self.rtree_edges_index.insert(edge_id, line.bounds)
+        self.edge_id_to_nodes = dict(enumerate(edges))
+        self.nodes_to_edge_id = {}
+        for edge_id, (start_node, end_node) in enumerate(edges):
+            self.nodes_to_edge_id[(start_node, end_node)] = edge_id
+            self.nodes_to_edge_id[(end_node, start_node)] = edge_id
+        self.edge_id_counter = len(edges)
+        self._edge_maps_stale = False
+        self._rebuild_edges_index()
+
+    def rebuild_rtree_indices(self):
+        self._rebuild_edges_index()
 
         print("R-tree indices rebuilt from graph data")
 
@@ -88,8 +208,8 @@ class PedestrianGraph:
                 self = loaded_graph
                 return
 
-        session = get_db_session()
-        pedestrian_networks = session.query(PedestrianPath).all()
+        with session_scope() as session:
+            pedestrian_networks = session.query(PedestrianPath).all()
         
         for path in pedestrian_networks:
             geom = to_shape(path.geom)
@@ -103,6 +223,10 @@ class PedestrianGraph:
                     else:
                         raise ValueError(f'{linestring} is not a Linestring, valid: {linestring.is_valid}')
 
+        # The edge index is bulk-loaded once instead of one insert per edge
+        self.rebuild_rtree_indices()
+        self._invalidate_views()
+
     def get_edge_id(self, start_node: int, end_node: int) -> int:
         if (start_node, end_node) in self.nodes_to_edge_id:
             return self.nodes_to_edge_id[(start_node, end_node)]
@@ -140,55 +264,140 @@ class PedestrianGraph:
             minutes=path.minutes,
         )
 
-        edge_id = self.get_edge_id(start_node_id, end_node_id)
-        self.rtree_edges_index.insert(edge_id, linestring.bounds)
+        self.get_edge_id(start_node_id, end_node_id)
+
+    def _coord_key(self, x: float, y: float) -> Tuple[float, float]:
+        if self.coordinate_decimals is None:
+            return (x, y)
+        return (round(x, self.coordinate_decimals), round(y, self.coordinate_decimals))
+
+    def _grid_cell(self, x: float, y: float) -> Tuple[int, int]:
+        return (int(np.floor(x / self.snap_tolerance)), int(np.floor(y / self.snap_tolerance)))
+
+    def _register_node(self, node_id: int, x: float, y: float):
+        self._node_lookup[self._coord_key(x, y)] = node_id
+        if self.snap_tolerance > 0:
+            self._node_grid[self._grid_cell(x, y)].append(node_id)
+
+    def _node_lookup_table(self) -> dict:
+        """ Loaded graphs build the lookup from node_coords the first time it is needed. """
+        if self._node_lookup is None:
+            self._node_lookup = {}
+            self._node_grid = defaultdict(list)
+            # From the CSR view, so a graph loaded from an artifact is not materialized in networkx
+            node_ids = self.compact().node_ids
+            for node_id, (x, y) in zip(node_ids.tolist(), self.node_coords[node_ids].tolist()):
+                self._register_node(node_id, x, y)
+        return self._node_lookup
+
+    def _find_node_at(self, x: float, y: float) -> Optional[int]:
+        node_id = self._node_lookup_table().get(self._coord_key(x, y))
+        if node_id is not None or self.snap_tolerance <= 0:
+            return node_id
+
+        # Nearest node within snap_tolerance, it can only be in the neighbouring grid cells
+        cell_x, cell_y = self._grid_cell(x, y)
+        best_distance = self.snap_tolerance
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for candidate in self._node_grid.get((cell_x + dx, cell_y + dy), ()):
+                    candidate_x, candidate_y = self._coords[candidate]
+                    distance = np.hypot(candidate_x - x, candidate_y - y)
+                    if distance <= best_distance:
+                        best_distance = distance
+                        node_id = candidate
+        return node_id
 
     def add_or_get_node(self, point: Point, amenity_type=None) -> int:
         # Check if a node already exists at this point
-        nearest = list(self.rtree_nodes_index.nearest(point.bounds, 1))
-        if nearest:
-            existing_node_id = nearest[0]
-            existing_point = wkt.loads(self.G.nodes[existing_node_id]['wkt'])
-            if existing_point.equals(point):
-                if amenity_type:
-                    if 'amenity_types' not in self.G.nodes[existing_node_id]:
-                        self.G.nodes[existing_node_id]['amenity_types'] = set()
-                    self.G.nodes[existing_node_id]['amenity_types'].add(amenity_type)
-                
-                return existing_node_id
+        existing_node_id = self._find_node_at(point.x, point.y)
+        if existing_node_id is not None:
+            if amenity_type:
+                if 'amenity_types' not in self.G.nodes[existing_node_id]:
+                    self.G.nodes[existing_node_id]['amenity_types'] = set()
+                self.G.nodes[existing_node_id]['amenity_types'].add(amenity_type)
+
+            return existing_node_id
 
         # If no existing node, create a new one
-        new_node_id = self.node_id_counter
-        self.node_id_counter += 1
-        node_data = {'wkt': point.wkt}
+        new_node_id = self._append_node_coords(point.x, point.y)
+        node_data = {}
         if amenity_type:
             node_data['amenity_types'] = { amenity_type }
         self.G.add_node(new_node_id, **node_data)
-        self.rtree_nodes_index.insert(new_node_id, point.buffer(self.POINT_BUFFER).bounds)
+        self._register_node(new_node_id, point.x, point.y)
         return new_node_id
 
-    def point_to_node_id(self, point: Point) -> int:
-        nearest = list(self.rtree_nodes_index.nearest(point.bounds, 1))
-        if nearest:
-            existing_node_id = nearest[0]
-            existing_point = wkt.loads(self.G.nodes[existing_node_id]['wkt'])
-            
-            return existing_node_id if existing_point == point else None
+    def point_to_node_id(self, point: Point) -> Optional[int]:
+        return self._find_node_at(point.x, point.y)
 
     def node_to_point(self, node_id: int) -> Point:
-        if self.G.has_node(node_id):
-            return wkt.loads(self.G.nodes[node_id]['wkt'])
+        """ Points are only created here, at the API boundary. Inside the graph locations live in node_coords. """
+        if 0 <= node_id < self.node_id_counter:
+            return Point(self._coords[node_id])
         else:
             raise ValueError(f"Node {node_id} does not exist in the graph.")
 
+    def node_tree(self) -> shapely.STRtree:
+        """ STRtree over the coordinates of the nodes in compact(), for nearest-node queries. """
+        if self._node_tree is None:
+            self._node_tree = shapely.STRtree(shapely.points(self.node_coords[self.compact().node_ids]))
+        return self._node_tree
+
     def find_nearest_node(self, point: Point) -> int:
-        nearest_node_candidates = list(self.rtree_nodes_index.nearest(point.bounds, 10))
-        if not nearest_node_candidates:
+        nearest = self.node_tree().query_nearest(point)
+        if len(nearest) == 0:
             raise ValueError("No nodes found in the graph.")
 
-        return min(nearest_node_candidates, key=lambda n: self.node_to_point(n).distance(point))
+        return int(self.compact().node_ids[nearest.min()])
+
+    def find_nearest_nodes(self, points: np.ndarray) -> np.ndarray:
+        """ Vectorized find_nearest_node for an (N, 2) array of points. """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        point_index, tree_index = self.node_tree().query_nearest(shapely.points(points))
+        if len(point_index) == 0:
+            raise ValueError("No nodes found in the graph.")
+
+        # Equidistant nodes are all returned, keep the lowest tree index like find_nearest_node does
+        nearest = np.full(len(points), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(nearest, point_index, tree_index)
+        return self.compact().node_ids[nearest]
+
+    def record_buildings(self, gids, points: np.ndarray):
+        """ Remember the node nearest to each building's centroid, so scoring does not snap them again. """
+        gids = np.asarray(gids, dtype=np.int64)
+        order = np.argsort(gids, kind='stable')
+        self.building_gids = gids[order]
+        self.building_nodes = self.find_nearest_nodes(points)[order]
+
+    def building_node_ids(self, gids) -> np.ndarray:
+        """ Recorded node id of each building gid, -1 for buildings the graph was not built with. """
+        gids = np.asarray(gids, dtype=np.int64)
+        node_ids = np.full(len(gids), -1, dtype=np.int64)
+        if len(self.building_gids) == 0:
+            return node_ids
+
+        positions = np.minimum(np.searchsorted(self.building_gids, gids), len(self.building_gids) - 1)
+        known = self.building_gids[positions] == gids
+        node_ids[known] = self.building_nodes[positions[known]]
+        return node_ids
+
+    def locate_buildings(self, buildings) -> np.ndarray:
+        """ Node id every building is scored from. Buildings missing from the recorded map,
+        e.g. with a graph built before it existed, are snapped by their centroid.
+        """
+        node_ids = self.building_node_ids([building.gid for building in buildings])
+        missing = np.flatnonzero(node_ids < 0)
+        if len(missing):
+            centroids = [to_shape(buildings[i].geom).centroid for i in missing.tolist()]
+            node_ids[missing] = self.find_nearest_nodes([(centroid.x, centroid.y) for centroid in centroids])
+        return node_ids
 
     def find_nearest_edge(self, point: Point) -> Tuple[int, int]:
+        self._restore_edge_maps()
         nearest_edges_candidates = list(self.rtree_edges_index.nearest(point.bounds, 20))
 
         min_distance = float('inf')
@@ -215,7 +424,7 @@ class PedestrianGraph:
         return nearest_edge
 
     def extend_graph_with_point(self, point: Point, amenity_type=None) -> int:
-        if self.point_to_node_id(point):
+        if self.point_to_node_id(point) is not None:
             # TODO: refactor!
             # Just add the amenity type if the point already has a node for in G
             self.add_or_get_node(point, amenity_type)
@@ -282,39 +491,282 @@ class PedestrianGraph:
 
         return new_node_id
 
-    def extend_graph_with(self, locations, amenity_type = None):
+    @staticmethod
+    def location_points(shape) -> list:
+        """ The points a location is snapped at, or None for unsupported geometry types. """
+        if isinstance(shape, Point):
+            # There are 3D Multipoints in the database
+            return [Point(shape.x, shape.y)]
+        elif isinstance(shape, MultiPoint):
+            # There are 3D Multipoints in the database
+            return [Point(point.x, point.y) for point in shape.geoms]
+        elif isinstance(shape, Polygon):
+            return [shape.centroid]
+        elif isinstance(shape, MultiPolygon):
+            return [polygon.centroid for polygon in shape.geoms]
+        return None
+
+    def extend_graph_with(self, locations, amenity_type = None, bulk: bool = False):
         total_locations = len(locations)
-        
+
+        if bulk:
+            points = []
+            for location in locations:
+                shape = to_shape(location.geom)
+                location_points = self.location_points(shape)
+                if location_points is None:
+                    print(f"Skipping unsupported geometry type: {type(shape)}")
+                    continue
+                points.extend((point.x, point.y) for point in location_points)
+
+            self.extend_graph_with_points(np.array(points, dtype=np.float64).reshape(-1, 2), amenity_type)
+            print(f"Graph extension completed. Processed {total_locations} locations.")
+            return
+
         with tqdm(total=total_locations, desc="Extending graph", unit="location") as pbar:
             for location in locations:
                 shape = to_shape(location.geom)
-                if isinstance(shape, Point):
-                    # There are 3D Multipoints in the database
-                    simple_point = Point(shape.x, shape.y)
-                    self.extend_graph_with_point(simple_point, amenity_type)
-                elif isinstance(shape, MultiPoint):
-                    for point in shape.geoms:
-                        # There are 3D Multipoints in the database
-                        simple_point = Point(point.x, point.y)
-                        self.extend_graph_with_point(simple_point, amenity_type)
-                elif isinstance(shape, Polygon):
-                    centroid = shape.centroid
-                    self.extend_graph_with_point(centroid, amenity_type)
-                elif isinstance(shape, MultiPolygon):
-                    for polygon in shape.geoms:
-                        centroid = polygon.centroid
-                        self.extend_graph_with_point(centroid, amenity_type)
-                else:
+                location_points = self.location_points(shape)
+                if location_points is None:
                     pbar.write(f"Skipping unsupported geometry type: {type(shape)}")
+                else:
+                    for point in location_points:
+                        self.extend_graph_with_point(point, amenity_type)
                 pbar.update(1)
         
+        self._invalidate_views()
         print(f"Graph extension completed. Processed {total_locations} locations.")
 
-    def get_closeby_amenities(self, source: Point, distance_type: str, distance_max_value: float) -> dict:
+    def extend_graph_with_points(self, points: np.ndarray, amenity_type=None) -> np.ndarray:
+        """ Bulk version of extend_graph_with_point for an (N, 2) array of points.
+
+        All points are snapped at once against the edges as they are before the call, using a
+        vectorized STRtree nearest query. Each edge is then split a single time at all of its
+        sorted projection points. Returns the node id of every input point.
+        """
+        node_ids = np.full(len(points), -1, dtype=np.int64)
+        if len(points) == 0:
+            return node_ids
+
+        unique_points, point_rows = np.unique(points, axis=0, return_inverse=True)
+        point_rows = point_rows.reshape(-1)
+        unique_node_ids = np.full(len(unique_points), -1, dtype=np.int64)
+
+        # Points that already are nodes only get the amenity type
+        to_snap = []
+        for i, (x, y) in enumerate(unique_points.tolist()):
+            point = Point(x, y)
+            if self.point_to_node_id(point) is not None:
+                unique_node_ids[i] = self.add_or_get_node(point, amenity_type)
+            else:
+                to_snap.append(i)
+        to_snap = np.array(to_snap, dtype=np.int64)
+
+        if len(to_snap):
+            self._restore_edge_maps()
+            edge_ids = np.fromiter(self.edge_id_to_nodes.keys(), dtype=np.int64, count=len(self.edge_id_to_nodes))
+            if len(edge_ids) == 0:
+                raise ValueError("No edges found in the graph.")
+            edge_nodes = np.array([self.edge_id_to_nodes[edge_id] for edge_id in edge_ids.tolist()], dtype=np.int64)
+            edge_lines = shapely.linestrings(np.stack([self._coords[edge_nodes[:, 0]], self._coords[edge_nodes[:, 1]]], axis=1))
+
+            snap_points = shapely.points(unique_points[to_snap])
+            point_index, edge_index = shapely.STRtree(edge_lines).query_nearest(snap_points, all_matches=False)
+            offsets = shapely.line_locate_point(edge_lines[edge_index], snap_points[point_index])
+            projections = shapely.get_coordinates(shapely.line_interpolate_point(edge_lines[edge_index], offsets))
+
+            # Group the projections per edge, sorted along the edge
+            order = np.lexsort((offsets, edge_index))
+            boundaries = np.flatnonzero(np.diff(edge_index[order])) + 1
+            for group in np.split(order, boundaries):
+                edge_position = int(edge_index[group[0]])
+                split_nodes = self._split_edge_at(
+                    int(edge_ids[edge_position]),
+                    unique_points[to_snap[point_index[group]]],
+                    projections[group],
+                    amenity_type,
+                )
+                unique_node_ids[to_snap[point_index[group]]] = split_nodes
+
+            self._rebuild_edges_index()
+
+        self._invalidate_views()
+        node_ids[:] = unique_node_ids[point_rows]
+        return node_ids
+
+    def _split_edge_at(self, edge_id: int, points: np.ndarray, projections: np.ndarray, amenity_type=None) -> list:
+        """ Split an edge at projections sorted from its start node and connect each point to its
+        projection, with the same weights extend_graph_with_point assigns. Returns the point nodes.
+        """
+        start_node_id, end_node_id = self.edge_id_to_nodes[edge_id]
+        edge_data = self.G[start_node_id][end_node_id]
+        total_length = edge_data['length_m']
+
+        point_node_ids = [self.add_or_get_node(Point(x, y), amenity_type) for x, y in points.tolist()]
+        chain = [start_node_id]
+        for x, y in projections.tolist():
+            projected_node_id = self.add_or_get_node(Point(x, y))
+            if projected_node_id != chain[-1]:
+                chain.append(projected_node_id)
+        if end_node_id != chain[-1]:
+            chain.append(end_node_id)
+
+        self.G.remove_edge(start_node_id, end_node_id)
+        del self.edge_id_to_nodes[edge_id]
+        self.nodes_to_edge_id.pop((start_node_id, end_node_id), None)
+        self.nodes_to_edge_id.pop((end_node_id, start_node_id), None)
+
+        for from_node_id, to_node_id in zip(chain[:-1], chain[1:]):
+            segment_length = float(np.hypot(*(self._coords[to_node_id] - self._coords[from_node_id])))
+            proportion = segment_length / total_length if total_length != 0 else 0
+            self.G.add_edge(
+                from_node_id,
+                to_node_id,
+                length_m=edge_data['length_m'] * proportion,
+                minutes=edge_data['minutes'] * proportion
+            )
+            self.get_edge_id(from_node_id, to_node_id)
+
+        for point_node_id, (x, y) in zip(point_node_ids, projections.tolist()):
+            projected_node_id = self.add_or_get_node(Point(x, y))
+            if projected_node_id == point_node_id:
+                # The point lies on the edge, it already is part of the chain
+                continue
+            length_from_point_to_projection = float(np.hypot(*(self._coords[point_node_id] - (x, y))))
+            self.G.add_edge(
+                point_node_id,
+                projected_node_id,
+                length_m=length_from_point_to_projection,
+                minutes=length_from_point_to_projection / edge_data['max_speed'] if 'max_speed' in edge_data else 1
+            )
+            self.get_edge_id(point_node_id, projected_node_id)
+
+        return point_node_ids
+
+    def _rebuild_edges_index(self):
+        """ Bulk-load the edge R-tree from edge_id_to_nodes. """
+        def entries():
+            for edge_id, (start_node, end_node) in self.edge_id_to_nodes.items():
+                (x1, y1), (x2, y2) = self._coords[start_node], self._coords[end_node]
+                yield edge_id, (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), None
+
+        self.rtree_edges_index = index.Index(entries()) if self.edge_id_to_nodes else index.Index()
+
+    def contract_chains(self) -> dict:
+        """ Replace chains of degree-2 nodes by single edges with the summed length_m and minutes.
+
+        Nodes with amenities or a recorded building are never removed. The removed nodes of every new
+        edge are kept in order in via_edges/via_nodes, so exported geometry still follows the street.
+        Running it again keeps them: a chain that absorbs an already contracted edge takes its via nodes along.
+        A chain whose ends are the same node or already share an edge is left as it is, since the new
+        edge would be a loop or a parallel edge. Meant as the last step before save_graph: the graph
+        must not be extended afterwards. Returns the node and edge counts before and after.
+        """
+        G = self.G
+        nodes_before, edges_before = G.number_of_nodes(), G.number_of_edges()
+        protected = set(self.building_nodes.tolist())
+
+        def removable(node) -> bool:
+            neighbours = G.adj[node]
+            return len(neighbours) == 2 and node not in neighbours and node not in protected and not G.nodes[node].get('amenity_types')
+
+        tracks_edge_ids = bool(self.nodes_to_edge_id)
+        via = {tuple(edge): self.via_nodes[start:end].tolist()
+               for edge, start, end in zip(self.via_edges.tolist(), self.via_indptr[:-1].tolist(), self.via_indptr[1:].tolist())}
+
+        def pop_via(a, b) -> list:
+            if (a, b) in via:
+                return via.pop((a, b))
+            return via.pop((b, a), [])[::-1]
+
+        visited = set()
+        for node in list(G.nodes):
+            if node in visited or node not in G or not removable(node):
+                continue
+            visited.add(node)
+
+            # Walk away from the node in both directions until a node that has to stay
+            ends = []
+            for neighbour in list(G.adj[node]):
+                previous, current, path = node, neighbour, []
+                while removable(current) and current not in visited:
+                    visited.add(current)
+                    path.append(current)
+                    previous, current = current, next(n for n in G.adj[current] if n != previous)
+                ends.append((current, path))
+            (start, start_path), (end, end_path) = ends
+
+            if removable(start) or removable(end) or start == end or G.has_edge(start, end):
+                # A ring of removable nodes, a loop or a parallel edge
+                continue
+
+            chain = [start] + start_path[::-1] + [node] + end_path + [end]
+            length_m = sum(G[a][b]['length_m'] for a, b in zip(chain, chain[1:]))
+            minutes = sum(G[a][b]['minutes'] for a, b in zip(chain, chain[1:]))
+            if tracks_edge_ids:
+                for a, b in zip(chain, chain[1:]):
+                    edge_id = self.nodes_to_edge_id.pop((a, b), None)
+                    self.nodes_to_edge_id.pop((b, a), None)
+                    self.edge_id_to_nodes.pop(edge_id, None)
+
+            # The nodes an absorbed edge was contracted from stay in between its ends
+            via_nodes = []
+            for a, b in zip(chain, chain[1:]):
+                via_nodes.extend(pop_via(a, b))
+                via_nodes.append(b)
+
+            G.remove_nodes_from(chain[1:-1])
+            G.add_edge(start, end, length_m=length_m, minutes=minutes)
+            via[(start, end)] = via_nodes[:-1]
+            if tracks_edge_ids:
+                self.get_edge_id(start, end)
+
+        self.via_edges = np.array(list(via), dtype=np.int64).reshape(-1, 2)
+        self.via_indptr = np.zeros(len(via) + 1, dtype=np.int64)
+        np.cumsum([len(nodes) for nodes in via.values()], out=self.via_indptr[1:])
+        self.via_nodes = np.array([n for nodes in via.values() for n in nodes], dtype=np.int64)
+
+        self._node_lookup = None
+        self._invalidate_views()
+        # No longer the saved build, so nothing cached for that version applies
+        self.version = None
+        if tracks_edge_ids:
+            self.rebuild_rtree_indices()
+
+        stats = {
+            "nodes_before": nodes_before,
+            "nodes_after": G.number_of_nodes(),
+            "edges_before": edges_before,
+            "edges_after": G.number_of_edges(),
+        }
+        print(f"Contracted degree-2 chains: {stats['nodes_before']} -> {stats['nodes_after']} nodes, "
+              f"{stats['edges_before']} -> {stats['edges_after']} edges")
+        return stats
+
+    def edge_via(self) -> Dict[Tuple[int, int], list]:
+        """ Removed nodes along each contracted edge, keyed by both (u, v) and (v, u) and ordered from the first to the second. """
+        via = {}
+        for (u, v), start, end in zip(self.via_edges.tolist(), self.via_indptr[:-1].tolist(), self.via_indptr[1:].tolist()):
+            nodes = self.via_nodes[start:end].tolist()
+            via[(u, v)] = nodes
+            via[(v, u)] = nodes[::-1]
+        return via
+
+    def get_closeby_amenities(self, source: Point, distance_type: str, distance_max_value: float, engine: str = 'csr',
+                              max_amenities: Optional[int] = None) -> dict:
+        """ Distances to the amenities within distance_max_value of the node nearest to source, per amenity type.
+        With max_amenities only the nearest ones of each type are returned, which is all the accessibility
+        index reads, and the csr engine stops searching once every type has that many.
+        """
         if distance_type not in ['length_m', 'minutes']:
             raise ValueError("distance_type must be either 'length_m' or 'minutes'")
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}")
 
         source_node = self.find_nearest_node(source)
+        if engine == 'csr':
+            return amenity_profile_cache.get(self, source_node, distance_type, distance_max_value, max_amenities)
+
         distances = nx.single_source_dijkstra_path_length(self.G, 
                                                         source_node, 
                                                         cutoff=distance_max_value, 
@@ -325,82 +777,43 @@ class PedestrianGraph:
             if 'amenity_types' in self.G.nodes[node]:
                 for amenity in self.G.nodes[node]['amenity_types']:
                     amenities[amenity].append(distance)
-        
-        return dict(amenities)
 
-    # def compute_isochrone(self, source: Point, distance_type: str, distance_max_value: float) -> Polygon:
-    #     if distance_type not in ['length_m', 'minutes']:
-    #         raise ValueError("distance_type must be either 'length_m' or 'minutes'")
-        
-    #     # Create a bounding box for the search area
-    #     search_area = box(source.x - distance_max_value, source.y - distance_max_value,
-    #                     source.x + distance_max_value, source.y + distance_max_value)
-        
-    #     # Use R-tree to get potential nodes within the bounding box
-    #     potential_nodes = list(self.rtree_nodes_index.intersection(search_area.bounds))
-        
-    #     source_node = self.find_nearest_node(source)
-        
-    #     # Use NetworkX to compute distances, but only for the potential nodes
-    #     distances = nx.single_source_dijkstra_path_length(self.G.subgraph(potential_nodes), 
-    #                                                     source_node, 
-    #                                                     cutoff=distance_max_value, 
-    #                                                     weight=distance_type)
-        
-    #     isochrone_points = [self.node_to_point(node) for node in distances.keys()]
-        
-    #     if len(isochrone_points) < 3:
-    #         return None  # Not enough points to form a polygon
-        
-    #     # Create a concave hull (alpha shape) from the points
-    #     points = np.array([(p.x, p.y) for p in isochrone_points])
-    #     alpha_shape = alphashape.alphashape(points, alpha=0.5)
-        
-    #     if isinstance(alpha_shape, Polygon):
-    #         return alpha_shape
-    #     elif isinstance(alpha_shape, MultiPoint):
-    #         return alpha_shape.convex_hull  # Fallback if alphashape fails to create a Polygon
-    #     elif isinstance(alpha_shape, MultiPolygon):
-    #         # TODO: What should happen if the shape is MultiPolygon? For now simplify to the largest shape
-    #         largest_polygon = max(alpha_shape.geoms, key=lambda p: p.area)
-    #         print(largest_polygon)
-    #         return largest_polygon
-    #     else:
-    #         print(alpha_shape)
-    #         return None  # Handle unexpected results
-
-    # def compute_isochrones(self, source: Point, distance_type: str, distance_max_value: int, step: int) -> dict:
-    #     # TODO: If this is going to be used for more than a single point at a time
-    #     # it should be rewriten not to reuse the results from one dijkstra traversal
-    #     isochrones = {}
-    #     for distance in range(step, distance_max_value + step, step):
-    #         isochrone = self.compute_isochrone(source, distance_type, distance)
-    #         if isochrone:
-    #             isochrones[distance] = isochrone
-    #     return isochrones
+        if max_amenities is not None:
+            return {amenity: sorted(distances)[:max_amenities] for amenity, distances in amenities.items()}
+        return dict(amenities)
 
-    def graph_to_geojson(self) -> Dict:
-        features = []
-        transformer = get_transformer()
-        for u, v, data in self.G.edges(data=True):
-            start_point = self.node_to_point(u)
-            end_point = self.node_to_point(v)
-            linestring = LineString([start_point, end_point])
-            geom_in_world_crs = crs_transform(transformer, linestring, swap_coords=False)
-            feature = {
+    def graph_features(self, decimals: int = GEOJSON_COORDINATE_DECIMALS) -> Iterator[Dict]:
+        """ One GeoJSON LineString feature per edge, produced lazily. """
+        compact = self.compact()
+        sources, targets, edge_positions = compact.undirected_edges()
+        sources = compact.node_ids[sources]
+        targets = compact.node_ids[targets]
+        # Every node is projected once, in a single transformer call. This includes the nodes removed by
+        # contract_chains, which contracted edges still pass through
+        world_coords = np.round(crs_transform_array(get_transformer(), self.node_coords), decimals)
+        start_coords = world_coords[sources].tolist()
+        end_coords = world_coords[targets].tolist()
+        length_m = compact.length_m[edge_positions].tolist()
+        minutes = compact.minutes[edge_positions].tolist()
+        via = self.edge_via()
+
+        for start_node, end_node, start, end, edge_length_m, edge_minutes in zip(
+                sources.tolist(), targets.tolist(), start_coords, end_coords, length_m, minutes):
+            via_nodes = via.get((start_node, end_node))
+            yield {
                 "type": "Feature",
                 "geometry": {
                     "type": "LineString",
-                    "coordinates": list(geom_in_world_crs.coords)
+                    "coordinates": [start, *world_coords[via_nodes].tolist(), end] if via_nodes else [start, end]
                 },
                 "properties": {
-                    "length_m": data['length_m'],
-                    "minutes": data['minutes'],
+                    "length_m": edge_length_m,
+                    "minutes": edge_minutes,
                 }
             }
-            features.append(feature)
-        
+
+    def graph_to_geojson(self) -> Dict:
         return {
             "type": "FeatureCollection",
-            "features": features
+            "features": list(self.graph_features())
         }
@@ -1,140 +1,504 @@
 from .network import PedestrianGraph
-from ..database.connection import get_db_session
+from ..database.connection import fetch_all, get_db_engine, session_scope
 from ..models.residential import Residential
-from geoalchemy2.shape import to_shape
-from .walkability_service import compute_accessibility_index
+from ..config import GRAPH_DATA_DIR, GRAPH_FILENAME, SATURATED_AMENITY_SEARCH
+from .walkability_service import WEIGHTS, compute_accessibility_index, compute_accessibility_index_batch
+from .nearest_amenities import compute_nearest_amenities
+from .accessibility_profiles import PROFILE_WIDTH, build_profiles, find_profiles, profiles_path
 from .network import PedestrianGraph
+from tqdm import tqdm
+from itertools import islice
 import sqlalchemy as sa
+import io
 import re
-
-def process_building(building, G, length_type, max_distance, k, max_amenities, f):
-    """Compute accessibility score for a building."""
-    centroid = to_shape(building.geom).centroid
-    proximity_dict = G.get_closeby_amenities(centroid, length_type, max_distance)
+import threading
+import time
+
+PRECOMPUTE_MODES = ('per_building', 'multi_source')
+# Scores are sent to the database in COPY batches of this many rows
+WRITE_CHUNK_SIZE = 10000
+COPY_NULL = '\\N'
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+# First key of the advisory locks taken while a parameter set's partition is rewritten
+ADVISORY_LOCK_CLASS = 7801
+
+RESULTS_SCHEMA = 'results'
+PARAMETER_SETS_TABLE = f'{RESULTS_SCHEMA}.parameter_sets'
+SCORES_TABLE = f'{RESULTS_SCHEMA}.building_scores'
+BUILDING_UPU_TABLE = f'{RESULTS_SCHEMA}.building_upu'
+UPU_SCORES_TABLE = f'{RESULTS_SCHEMA}.upu_scores'
+# Wide table with one column per parameter set, only read by the migration
+LEGACY_TABLE = 'building_accessibility'
+LEGACY_COLUMN_PATTERN = re.compile(r'^(length_m|minutes)_(\d+)_(\d+)_(\d+)_(\d+(?:_\d+)?)$')
+# Serializes materialize_profile_scores within a process, stream_scores_to_partition locks across processes
+_materialize_lock = threading.Lock()
+_results_tables_ready = False
+_building_upu_lock = threading.Lock()
+_building_upu_ready = False
+
+def process_node(compact, node_id, length_type, max_distance, k, max_amenities, f):
+    """Compute the accessibility score of a graph node."""
+    proximity_dict, _ = compact.scoring_amenities(node_id, length_type, max_distance, max_amenities, SATURATED_AMENITY_SEARCH, WEIGHTS)
 
     return compute_accessibility_index(proximity_dict, max_distance, k, max_amenities, f)
 
-def sanitize_column_name(length_type, max_distance, k, max_amenities, f):
-    """Sanitize column names to follow PostgreSQL naming rules."""
-    column_name = f"{length_type}_{max_distance}_{k}_{max_amenities}_{f}"
-    column_name = re.sub(r'[^a-zA-Z0-9_]', '_', column_name)  # Replace invalid chars
-    return column_name[:63]  # PostgreSQL column name limit is 63 characters
-
-def create_table_and_index(schema, table_name):
-    session = get_db_session()
-    
-    session.execute(sa.text(f'CREATE SCHEMA IF NOT EXISTS {schema};'))
-    
-    session.execute(sa.text(f'''
-        CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
-            building_gid INTEGER PRIMARY KEY,
-            UNIQUE(building_gid)
-        );
-    '''))
+def compute_scores_per_building(buildings, G, length_type, max_distance, k, max_amenities, f):
+    """One bounded Dijkstra per distinct building node. Yields (gid, score) as they are computed."""
+    compact = G.compact()
+    node_scores = {}
+    for building, node_id in zip(buildings, G.locate_buildings(buildings).tolist()):
+        if node_id not in node_scores:
+            node_scores[node_id] = process_node(compact, node_id, length_type, max_distance, k, max_amenities, f)
+        yield building.gid, node_scores[node_id]
+
+def snap_buildings(buildings, G):
+    """CompactGraph index of the node each building is scored from."""
+    return G.compact().indices_of(G.locate_buildings(buildings)).tolist()
+
+def compute_scores_multi_source(buildings, G, length_type, max_distance, k, max_amenities, f, chunk_size=WRITE_CHUNK_SIZE):
+    """One multi-source search per amenity subgroup, then a table lookup per building.
+    Yields (gid, score), scoring chunk_size buildings at a time.
+    """
+    compact = G.compact()
+    building_nodes = snap_buildings(buildings, G)
+    table = compute_nearest_amenities(compact, length_type, max_distance, max_amenities, target_indices=sorted(set(building_nodes)))
+
+    for start in range(0, len(buildings), chunk_size):
+        rows = [table.row_of(node_index) for node_index in building_nodes[start:start + chunk_size]]
+        scores = compute_accessibility_index_batch(
+            table.distances[rows], table.counts[rows], table.amenity_names, max_distance, k, max_amenities, f
+        )
+        for building, score in zip(buildings[start:start + chunk_size], scores.tolist()):
+            yield building.gid, score
+
+def copy_value(value):
+    """One field of COPY's text format: NULL for None, backslash, tab and newlines escaped."""
+    if value is None:
+        return COPY_NULL
+    return str(value).translate(COPY_ESCAPES)
+
+def copy_rows(cursor, table_name, columns, rows):
+    """COPY tuples into table_name, None is written as NULL."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def partition_name(param_set_id):
+    return f"{SCORES_TABLE}_p{int(param_set_id)}"
+
+def create_results_tables():
+    """Parameter sets and the narrow score table, one list partition per parameter set.
+
+    The primary key doubles as the covering index: (param_set_id, building_gid) INCLUDE (score)
+    lets a lookup by parameter set be answered from the index alone.
+    """
+    with session_scope() as session:
+        session.execute(sa.text(f'CREATE SCHEMA IF NOT EXISTS {RESULTS_SCHEMA};'))
+
+        session.execute(sa.text(f'''
+            CREATE TABLE IF NOT EXISTS {PARAMETER_SETS_TABLE} (
+                id SERIAL PRIMARY KEY,
+                length_type TEXT NOT NULL,
+                max_distance NUMERIC NOT NULL,
+                k NUMERIC NOT NULL,
+                max_amenities INTEGER NOT NULL,
+                f NUMERIC NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                computed_at TIMESTAMPTZ,
+                from_profiles BOOLEAN NOT NULL DEFAULT false,
+                UNIQUE (length_type, max_distance, k, max_amenities, f)
+            );
+        '''))
+        # computed_at is set whenever a partition is (re)written and keys the cached tiles of the set
+        session.execute(sa.text(f'''
+            ALTER TABLE {PARAMETER_SETS_TABLE}
+                ADD COLUMN IF NOT EXISTS computed_at TIMESTAMPTZ,
+                ADD COLUMN IF NOT EXISTS from_profiles BOOLEAN NOT NULL DEFAULT false;
+        '''))
+
+        session.execute(sa.text(f'''
+            CREATE TABLE IF NOT EXISTS {SCORES_TABLE} (
+                param_set_id INTEGER NOT NULL,
+                building_gid INTEGER NOT NULL,
+                score NUMERIC,
+                CONSTRAINT building_scores_pkey PRIMARY KEY (param_set_id, building_gid) INCLUDE (score)
+            ) PARTITION BY LIST (param_set_id);
+        '''))
+
+        # Sets stored before computed_at existed
+        session.execute(sa.text(f'''
+            UPDATE {PARAMETER_SETS_TABLE} AS p SET computed_at = p.created_at
+            WHERE p.computed_at IS NULL AND EXISTS (SELECT 1 FROM {SCORES_TABLE} AS s WHERE s.param_set_id = p.id);
+        '''))
+
+        session.execute(sa.text(f'''
+            CREATE TABLE IF NOT EXISTS {BUILDING_UPU_TABLE} (
+                building_gid INTEGER PRIMARY KEY,
+                upu_gid INTEGER NOT NULL
+            );
+        '''))
+
+        session.execute(sa.text(f'''
+            CREATE INDEX IF NOT EXISTS idx_building_upu_upu_gid
+            ON {BUILDING_UPU_TABLE} (upu_gid) INCLUDE (building_gid);
+        '''))
+
+        session.execute(sa.text(f'''
+            CREATE TABLE IF NOT EXISTS {UPU_SCORES_TABLE} (
+                param_set_id INTEGER NOT NULL,
+                upu_gid INTEGER NOT NULL,
+                app_count BIGINT,
+                floor_count BIGINT,
+                building_count BIGINT,
+                accessibility_index NUMERIC,
+                PRIMARY KEY (param_set_id, upu_gid)
+            );
+        '''))
+
+def ensure_results_tables():
+    """create_results_tables once per process, for readers that may run before any precompute."""
+    global _results_tables_ready
+    if not _results_tables_ready:
+        create_results_tables()
+        _results_tables_ready = True
+
+def find_computed_parameter_set(length_type, max_distance, k, max_amenities, f):
+    """(id, generation) of the parameter set if its scores were written, otherwise None.
+    The generation changes every time the scores are rewritten.
+    """
+    with session_scope() as session:
+        row = session.execute(sa.text(f'''
+            SELECT id, CAST(EXTRACT(EPOCH FROM computed_at) * 1000000 AS BIGINT) FROM {PARAMETER_SETS_TABLE}
+            WHERE length_type = :length_type AND max_distance = :max_distance AND k = :k
+              AND max_amenities = :max_amenities AND f = :f AND computed_at IS NOT NULL;
+        '''), {"length_type": length_type, "max_distance": max_distance, "k": k, "max_amenities": max_amenities, "f": f}).first()
+    if row is None:
+        return None
+    return row[0], f'{row[0]}_{row[1]}'
+
+def get_or_create_parameter_set(session, length_type, max_distance, k, max_amenities, f):
+    """Id of the parameter set, registering it and creating its partition when it is new."""
+    param_set_id = session.execute(sa.text(f'''
+        INSERT INTO {PARAMETER_SETS_TABLE} (length_type, max_distance, k, max_amenities, f)
+        VALUES (:length_type, :max_distance, :k, :max_amenities, :f)
+        ON CONFLICT (length_type, max_distance, k, max_amenities, f) DO UPDATE SET length_type = EXCLUDED.length_type
+        RETURNING id;
+    '''), {"length_type": length_type, "max_distance": max_distance, "k": k, "max_amenities": max_amenities, "f": f}).scalar()
 
     session.execute(sa.text(f'''
-        CREATE INDEX IF NOT EXISTS idx_{table_name}_building_gid 
-        ON {schema}.{table_name} (building_gid);
+        CREATE TABLE IF NOT EXISTS {partition_name(param_set_id)}
+        PARTITION OF {SCORES_TABLE} FOR VALUES IN ({int(param_set_id)});
     '''))
-
-    query = sa.text(f"SELECT COUNT(*) FROM {schema}.{table_name}")
-    records_count = session.execute(query).scalar()
-
-    if records_count == 0:
-      copy_building_gid_from_building_table = f"""
-          INSERT INTO {schema}.{table_name} (building_gid)
-          SELECT gid
-          FROM raw.buildings_all_residential_2024;
-
-      """
-      session.execute(sa.text(copy_building_gid_from_building_table))
-
-    session.commit()
-    session.close()
-
-def check_column_exists(schema, table_name, column_name, drop=False):
-    session = get_db_session()
-
-    if drop:
-        drop_column_query = sa.text(f'''
-            ALTER TABLE {schema}.{table_name}
-            DROP COLUMN IF EXISTS {column_name};
+    return param_set_id
+
+def parameter_set_has_scores(session, param_set_id):
+    return session.execute(sa.text(
+        f"SELECT EXISTS (SELECT 1 FROM {partition_name(param_set_id)} LIMIT 1);"
+    )).scalar()
+
+def drop_parameter_set(param_set_id):
+    """Detach and drop the partition of a parameter set, no row-by-row DELETE is needed."""
+    with session_scope() as session:
+        session.execute(sa.text(f"ALTER TABLE {SCORES_TABLE} DETACH PARTITION {partition_name(param_set_id)};"))
+        session.execute(sa.text(f"DROP TABLE {partition_name(param_set_id)};"))
+        session.execute(sa.text(f"DELETE FROM {UPU_SCORES_TABLE} WHERE param_set_id = :id;"), {"id": param_set_id})
+        session.execute(sa.text(f"DELETE FROM {PARAMETER_SETS_TABLE} WHERE id = :id;"), {"id": param_set_id})
+
+def store_upu_aggregates(session, param_set_id=None):
+    """(Re)compute the per-UPU aggregates of one parameter set, or of all of them when param_set_id is None."""
+    where = 'WHERE s.param_set_id = :param_set_id' if param_set_id is not None else ''
+    params = {"param_set_id": param_set_id} if param_set_id is not None else {}
+
+    session.execute(sa.text(f"DELETE FROM {UPU_SCORES_TABLE} AS s {where};"), params)
+    session.execute(sa.text(f'''
+        INSERT INTO {UPU_SCORES_TABLE} (param_set_id, upu_gid, app_count, floor_count, building_count, accessibility_index)
+        SELECT
+            s.param_set_id,
+            bu.upu_gid,
+            SUM(r.appcount),
+            SUM(r.floorcount),
+            COUNT(r.gid),
+            SUM(s.score * r.appcount) / NULLIF(SUM(r.appcount), 0)
+        FROM
+            {SCORES_TABLE} AS s
+        JOIN
+            {BUILDING_UPU_TABLE} AS bu ON bu.building_gid = s.building_gid
+        JOIN
+            raw.buildings_all_residential_2024 AS r ON r.gid = s.building_gid
+        {where}
+        GROUP BY
+            s.param_set_id, bu.upu_gid;
+    '''), params)
+
+def assign_buildings_to_upus(force=False):
+    """Materialize the building -> UPU spatial join. Needs to run again after the raw tables change,
+    which also refreshes the aggregates of every stored parameter set.
+    Returns False when the assignment already existed and was kept.
+    """
+    create_results_tables()
+
+    with session_scope() as session:
+        if not force and session.execute(sa.text(f"SELECT EXISTS (SELECT 1 FROM {BUILDING_UPU_TABLE} LIMIT 1);")).scalar():
+            return False
+
+        session.execute(sa.text(f"TRUNCATE {BUILDING_UPU_TABLE};"))
+        # A building on the border of two overlapping units is assigned to one of them only
+        session.execute(sa.text(f'''
+            INSERT INTO {BUILDING_UPU_TABLE} (building_gid, upu_gid)
+            SELECT DISTINCT ON (r.gid)
+                r.gid,
+                upu.gid
+            FROM
+                raw.buildings_all_residential_2024 AS r
+            JOIN
+                raw.urban_planning_units AS upu
+            ON
+                ST_Within(r.geom, upu.geom)
+            ORDER BY
+                r.gid, upu.gid;
+        '''))
+        session.execute(sa.text(f"ANALYZE {BUILDING_UPU_TABLE};"))
+        store_upu_aggregates(session)
+
+    print("Assigned residential buildings to urban planning units.")
+    return True
+
+def ensure_building_upu():
+    """Make sure the building -> UPU assignment exists before a query relies on it, building
+    it on first use in a database where it was never run. Checked once per process.
+    """
+    global _building_upu_ready
+    with _building_upu_lock:
+        if not _building_upu_ready:
+            assign_buildings_to_upus()
+            _building_upu_ready = True
+
+def stream_scores_to_partition(scores, param_set_id, total=None, chunk_size=WRITE_CHUNK_SIZE, from_profiles=False):
+    """Write (gid, score) pairs as they are produced: chunks are COPYed into a staging table,
+    which then replaces the parameter set's partition.
+
+    Only the final swap (detach, attach, drop, rename) runs in a transaction that locks the
+    score table, so readers keep getting the previous scores while the new ones are written.
+    The CHECK constraint and the primary key are in place before the swap, so ATTACH neither
+    scans the table nor builds an index while holding its locks. An advisory lock keeps two
+    writers of the same parameter set from sharing the staging table. The UPU aggregates of
+    the previous scores are deleted in the same transaction, readers aggregate the new scores
+    until they are stored again.
+    """
+    connection = get_db_engine().raw_connection()
+    partition = partition_name(param_set_id)
+    staging = f"{partition}_load"
+    partition_table = partition.split('.')[-1]
+    staging_table = staging.split('.')[-1]
+    started = time.perf_counter()
+    written = 0
+    cursor = connection.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s, %s);", (ADVISORY_LOCK_CLASS, int(param_set_id)))
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging};")
+        cursor.execute(f'''
+            CREATE TABLE {staging} (LIKE {SCORES_TABLE} INCLUDING DEFAULTS,
+                CHECK (param_set_id = {int(param_set_id)}));
         ''')
-  
-        session.execute(drop_column_query)
-        exsists = False
-    else:
-        check_query = f"""
-        SELECT EXISTS (
-            SELECT FROM information_schema.columns 
-            WHERE table_schema = '{schema}' 
-            AND table_name = '{table_name}'
-            AND column_name = '{column_name}'
-        );
-        """
-  
-        exsists = session.execute(sa.text(check_query)).scalar()
-
-    session.commit()
-    session.close()
-
-    return exsists
-
-def compute_and_store_accessibility(length_type, max_distance, k, max_amenities, f, recompute=False):
-    schema = 'results'
-    table_name = 'building_accessibility'
-    G = PedestrianGraph.load_graph(data_dir='data', filename='extended_network')
-
-    session = get_db_session()
+        connection.commit()
+
+        scores = iter(scores)
+        with tqdm(total=total, desc="Writing scores", unit="building") as pbar:
+            while chunk := list(islice(scores, chunk_size)):
+                copy_rows(cursor, staging, ('param_set_id', 'building_gid', 'score'),
+                          ((param_set_id, gid, score) for gid, score in chunk))
+                written += len(chunk)
+                pbar.update(len(chunk))
+
+        cursor.execute(f"ALTER TABLE {staging} ADD CONSTRAINT {staging_table}_pkey PRIMARY KEY (param_set_id, building_gid) INCLUDE (score);")
+        cursor.execute(f"ANALYZE {staging};")
+        connection.commit()
+
+        cursor.execute(f"ALTER TABLE {SCORES_TABLE} DETACH PARTITION {partition};")
+        cursor.execute(f"ALTER TABLE {SCORES_TABLE} ATTACH PARTITION {staging} FOR VALUES IN ({int(param_set_id)});")
+        cursor.execute(f"DROP TABLE {partition};")
+        cursor.execute(f"ALTER TABLE {staging} RENAME TO {partition_table};")
+        cursor.execute(f"ALTER TABLE {partition} RENAME CONSTRAINT {staging_table}_pkey TO {partition_table}_pkey;")
+        cursor.execute(f"DELETE FROM {UPU_SCORES_TABLE} WHERE param_set_id = %s;", (int(param_set_id),))
+        cursor.execute(f"UPDATE {PARAMETER_SETS_TABLE} SET computed_at = clock_timestamp(), from_profiles = %s WHERE id = %s;",
+                       (from_profiles, int(param_set_id)))
+        connection.commit()
+    except Exception:
+        # A staging table left behind is dropped by the next run
+        connection.rollback()
+        raise
+    finally:
+        # The lock belongs to the session, and the pool keeps the connection open
+        cursor.execute("SELECT pg_advisory_unlock(%s, %s);", (ADVISORY_LOCK_CLASS, int(param_set_id)))
+        connection.commit()
+        connection.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written} scores in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} buildings/s).")
+
+def parse_legacy_column_name(column_name):
+    """(length_type, max_distance, k, max_amenities, f) encoded in a column of the old wide table, or None."""
+    match = LEGACY_COLUMN_PATTERN.match(column_name)
+    if match is None:
+        return None
+    length_type, max_distance, k, max_amenities, f = match.groups()
+    return length_type, int(max_distance), int(k), int(max_amenities), float(f.replace('_', '.'))
+
+def migrate_wide_results(drop_columns=False):
+    """Move every score column of results.building_accessibility into its own parameter set partition."""
+    create_results_tables()
+
+    with session_scope() as session:
+        columns = session.execute(sa.text('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = :table_name AND column_name <> 'building_gid'
+            ORDER BY ordinal_position;
+        '''), {"schema": RESULTS_SCHEMA, "table_name": LEGACY_TABLE}).scalars().all()
+
+        for column_name in columns:
+            parameters = parse_legacy_column_name(column_name)
+            if parameters is None:
+                print(f"Skipping column {column_name}, it does not name a parameter set.")
+                continue
+
+            param_set_id = get_or_create_parameter_set(session, *parameters)
+            if parameter_set_has_scores(session, param_set_id):
+                print(f"Parameter set {param_set_id} already has scores, skipping column {column_name}.")
+            else:
+                session.execute(sa.text(f'''
+                    INSERT INTO {partition_name(param_set_id)} (param_set_id, building_gid, score)
+                    SELECT {int(param_set_id)}, building_gid, {column_name}
+                    FROM {RESULTS_SCHEMA}.{LEGACY_TABLE};
+                '''))
+                session.execute(sa.text(f"UPDATE {PARAMETER_SETS_TABLE} SET computed_at = clock_timestamp() WHERE id = :id;"), {"id": param_set_id})
+                print(f"Migrated column {column_name} to parameter set {param_set_id}.")
+
+            if drop_columns:
+                session.execute(sa.text(f"ALTER TABLE {RESULTS_SCHEMA}.{LEGACY_TABLE} DROP COLUMN {column_name};"))
+            session.commit()
+
+    if not assign_buildings_to_upus():
+        with session_scope() as session:
+            store_upu_aggregates(session)
+
+def compute_and_store_accessibility(length_type, max_distance, k, max_amenities, f, recompute=False, mode='multi_source'):
+    if mode not in PRECOMPUTE_MODES:
+        raise ValueError(f"mode must be one of {PRECOMPUTE_MODES}")
+
+    G = PedestrianGraph.load_graph(data_dir=GRAPH_DATA_DIR, filename=GRAPH_FILENAME)
+
+    create_results_tables()
+
+    with session_scope() as session:
+        param_set_id = get_or_create_parameter_set(session, length_type, max_distance, k, max_amenities, f)
+        has_scores = parameter_set_has_scores(session, param_set_id)
+
+    if has_scores and not recompute:
+        print(f"Parameter set {param_set_id} already has scores. Exiting.")
+        return
 
-    column_name = sanitize_column_name(length_type, max_distance, k, max_amenities, f)
+    with session_scope() as session:
+        buildings = session.query(Residential.gid, Residential.geom).all()
 
-    create_table_and_index(schema, table_name)
+    # Compute accessibility index for each building, scores are written while they are computed
+    if mode == 'multi_source':
+        scores = compute_scores_multi_source(buildings, G, length_type, max_distance, k, max_amenities, f)
+    else:
+        scores = compute_scores_per_building(buildings, G, length_type, max_distance, k, max_amenities, f)
 
-    if check_column_exists(schema, table_name, column_name, drop=recompute):
-        print(f"Column {column_name} already exists. Exiting.")
-        return
+    stream_scores_to_partition(scores, param_set_id, total=len(buildings))
 
-    query = session.query(Residential.gid, Residential.geom)
-    buildings = query.all()
+    # A fresh assignment aggregates every parameter set, this one included
+    if not assign_buildings_to_upus():
+        with session_scope() as session:
+            store_upu_aggregates(session, param_set_id)
 
-    # Compute accessibility index for each building
-    scores = []
-    for building in buildings:
-        score = process_building(building, G, length_type, max_distance, k, max_amenities, f)
-        scores.append((building.gid, score))
+    print(f"Successfully computed and saved accessibility scores for parameter set {param_set_id}.")
 
-    alter_table_query = f"""
-    ALTER TABLE {schema}.{table_name}
-    ADD COLUMN IF NOT EXISTS {column_name} NUMERIC;
+def compute_and_store_profiles(length_type, max_distance_ceiling, width=PROFILE_WIDTH, data_dir=GRAPH_DATA_DIR):
+    """Store every building's nearest-amenity distances up to max_distance_ceiling, so that
+    any k, f, max_amenities <= width and max_distance <= max_distance_ceiling can be served
+    by rescoring instead of traversing the graph again.
     """
-    session.execute(sa.text(alter_table_query))
-
-    update_query = f"""
-    UPDATE {schema}.{table_name} 
-    SET {column_name} = data.score
-    FROM (VALUES {', '.join([f"({gid}, {score})" for gid, score in scores])}) AS data(building_gid, score)
-    WHERE {schema}.{table_name}.building_gid = data.building_gid;
+    G = PedestrianGraph.load_graph(data_dir=data_dir, filename=GRAPH_FILENAME)
+
+    with session_scope() as session:
+        buildings = session.query(Residential.gid, Residential.geom).all()
+
+    building_nodes = snap_buildings(buildings, G)
+    profiles = build_profiles(G.compact(), [building.gid for building in buildings], building_nodes, length_type, max_distance_ceiling, width)
+    profiles.save(profiles_path(length_type, max_distance_ceiling, data_dir))
+
+    # Scores materialized from the previous profiles are stale, they are written again on demand
+    create_results_tables()
+    with session_scope() as session:
+        stale = session.execute(sa.text(
+            f"SELECT id FROM {PARAMETER_SETS_TABLE} WHERE from_profiles AND length_type = :length_type;"
+        ), {"length_type": length_type}).scalars().all()
+    for param_set_id in stale:
+        drop_parameter_set(param_set_id)
+
+def materialize_profile_scores(length_type, max_distance, k, max_amenities, f):
+    """Rescore the stored profiles once and write the scores as a parameter set, for readers
+    that query them many times, such as the tiles. Returns (id, generation) of the set, or
+    None when no profiles cover the parameters.
     """
+    with _materialize_lock:
+        # Another request may have written it while this one waited
+        computed = find_computed_parameter_set(length_type, max_distance, k, max_amenities, f)
+        if computed is not None:
+            return computed
+
+        profiles = find_profiles(length_type, max_distance, max_amenities)
+        if profiles is None:
+            return None
+
+        scores = profiles.score(max_distance, k, max_amenities, f)
+        ensure_results_tables()
+        with session_scope() as session:
+            param_set_id = get_or_create_parameter_set(session, length_type, max_distance, k, max_amenities, f)
+        stream_scores_to_partition(zip(profiles.building_gids.tolist(), scores.tolist()), param_set_id,
+                                   total=len(scores), from_profiles=True)
+        ensure_building_upu()
+        with session_scope() as session:
+            store_upu_aggregates(session, param_set_id)
+        return find_computed_parameter_set(length_type, max_distance, k, max_amenities, f)
+
+def resolve_parameter_set(length_type, max_distance, k, max_amenities, f):
+    """(id, generation) of the stored scores of a parameter set. Scores that only stored
+    profiles cover are materialized first, so readers never rescore the city per request.
+    Raises ValueError when there are neither.
+    """
+    ensure_results_tables()
+    computed = (find_computed_parameter_set(length_type, max_distance, k, max_amenities, f)
+                or materialize_profile_scores(length_type, max_distance, k, max_amenities, f))
+    if computed is None:
+        raise ValueError("No precomputed scores or profiles for these parameters")
+    return computed
+
+def scores_source(param_set_id):
+    """SQL producing (building_gid, accessibility_index) from the partition of a parameter set, and its bound parameters."""
+    sql = f'''
+      SELECT building_gid, score AS accessibility_index
+      FROM {SCORES_TABLE}
+      WHERE param_set_id = :param_set_id
+    '''
+    return sql, {"param_set_id": param_set_id}
 
-    session.execute(sa.text(update_query))
-    session.commit()
-    session.close()
-
-    print(f"Successfully computed and saved accessibility scores in column {column_name}.")
-
-def get_buildings_with_precomputed_accessibility(length_type, max_distance, k, max_amenities, f):
-    column_name = sanitize_column_name(length_type, max_distance, k, max_amenities, f)
+def accessibility_source(length_type, max_distance, k, max_amenities, f):
+    """scores_source of the parameter set, see resolve_parameter_set."""
+    param_set_id, _ = resolve_parameter_set(length_type, max_distance, k, max_amenities, f)
+    return scores_source(param_set_id)
 
-    session = get_db_session()
+def precomputed_buildings_query(length_type, max_distance, k, max_amenities, f):
+    accessibility_sql, params = accessibility_source(length_type, max_distance, k, max_amenities, f)
 
     sql = f'''
       WITH accessibility_subquery AS (
-        SELECT
-          building_accessibility.building_gid,
-          building_accessibility.{column_name} AS accessibility_index
-        FROM
-          results.building_accessibility
+        {accessibility_sql}
         )
       SELECT
           r.gid,
@@ -150,29 +514,68 @@ def get_buildings_with_precomputed_accessibility(length_type, max_distance, k, m
           r.gid = accessibility_subquery.building_gid;
     ''' 
 
-    result = session.execute(sa.text(sql))
+    return sql, params
 
-    return result.fetchall()
+def has_upu_aggregates(param_set_id):
+    with session_scope() as session:
+        return session.execute(sa.text(
+            f"SELECT EXISTS (SELECT 1 FROM {UPU_SCORES_TABLE} WHERE param_set_id = :param_set_id);"
+        ), {"param_set_id": param_set_id}).scalar()
 
-def get_upu_with_precomputed_accessibility(length_type, max_distance, k, max_amenities, f):
-    column_name = sanitize_column_name(length_type, max_distance, k, max_amenities, f)
-
-    session = get_db_session()
+def precomputed_upus_query(length_type, max_distance, k, max_amenities, f):
+    """The parameter set is resolved like for the buildings. Its materialized aggregates are read
+    when they exist, otherwise its scores are aggregated through the building -> UPU assignment.
+    No spatial join either way.
+    """
+    param_set_id, _ = resolve_parameter_set(length_type, max_distance, k, max_amenities, f)
+    if has_upu_aggregates(param_set_id):
+        sql = f'''
+          SELECT
+              upu.gid AS gid,
+              upu.regname,
+              upu.rajon,
+              ST_AsText(upu.geom) AS geom,
+              s.app_count,
+              s.floor_count,
+              s.building_count,
+              s.accessibility_index
+          FROM
+              {UPU_SCORES_TABLE} AS s
+          JOIN
+              raw.urban_planning_units AS upu
+          ON
+              upu.gid = s.upu_gid
+          WHERE
+              s.param_set_id = :param_set_id;
+        '''
+        return sql, {"param_set_id": param_set_id}
+
+    accessibility_sql, params = scores_source(param_set_id)
+    ensure_building_upu()
 
     sql = f'''
-      WITH building_accessibility_data AS (
+      WITH accessibility_subquery AS (
+        {accessibility_sql}
+        ),
+      upu_aggregates AS (
         SELECT
-            r.gid AS building_gid,
-            r.geom AS building_geom,
-            r.appcount AS building_appcount,
-            r.floorcount AS building_floorcount,
-            ba.{column_name} AS accessibility_index
+            bu.upu_gid,
+            SUM(r.appcount) AS app_count,
+            SUM(r.floorcount) AS floor_count,
+            COUNT(r.gid) AS building_count,
+            SUM(ba.accessibility_index * r.appcount) / NULLIF(SUM(r.appcount), 0) AS accessibility_index
         FROM
-            raw.buildings_all_residential_2024 AS r
+            accessibility_subquery AS ba
+        JOIN
+            {BUILDING_UPU_TABLE} AS bu
+        ON
+            bu.building_gid = ba.building_gid
         JOIN
-            results.building_accessibility AS ba
+            raw.buildings_all_residential_2024 AS r
         ON
             r.gid = ba.building_gid
+        GROUP BY
+            bu.upu_gid
         )
 
       SELECT
@@ -180,20 +583,22 @@ def get_upu_with_precomputed_accessibility(length_type, max_distance, k, max_ame
           upu.regname,
           upu.rajon,
           ST_AsText(upu.geom) AS geom,
-          SUM(bad.building_appcount) AS app_count,
-          SUM(bad.building_floorcount) AS floor_count,
-          COUNT(bad.building_gid) AS building_count,
-          SUM(bad.accessibility_index * bad.building_appcount) / NULLIF(SUM(bad.building_appcount), 0) AS accessibility_index
+          agg.app_count,
+          agg.floor_count,
+          agg.building_count,
+          agg.accessibility_index
       FROM
-          raw.urban_planning_units AS upu
+          upu_aggregates AS agg
       JOIN
-          building_accessibility_data AS bad
+          raw.urban_planning_units AS upu
       ON
-          ST_Within(bad.building_geom, upu.geom)
-      GROUP BY
-          upu.gid, upu.regname, upu.rajon, upu.geom;
+          upu.gid = agg.upu_gid;
     '''
 
-    result = session.execute(sa.text(sql))
+    return sql, params
 
-    return result.fetchall()
+def get_buildings_with_precomputed_accessibility(length_type, max_distance, k, max_amenities, f):
+    return fetch_all(*precomputed_buildings_query(length_type, max_distance, k, max_amenities, f))
+
+def get_upu_with_precomputed_accessibility(length_type, max_distance, k, max_amenities, f):
+    return fetch_all(*precomputed_upus_query(length_type, max_distance, k, max_amenities, f))
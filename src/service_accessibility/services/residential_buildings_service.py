@@ -1,43 +1,35 @@
-from ..database.connection import get_db_session
+from ..database.connection import session_scope
 from ..models.residential import Residential
-from ..models.urban_planning_unit import UrbanPlanningUnit
+from ..models.building_upu import BuildingUpu
 from geoalchemy2.shape import to_shape
 from shapely import wkt
-from shapely.geometry import mapping
-from .crs_transform import get_transformer, crs_transform
-from .walkability_service import compute_accessibility_index
-from geoalchemy2 import functions as gfunc
-
-from multiprocessing import Pool, cpu_count
+from .geojson import geometry_mapping
+from .crs_transform import get_transformer, crs_transform_many
+from .accessibility_pool import score_node_ids
+from .precompute_accessibility import ensure_building_upu
 
 def get_all():
-    session = get_db_session()
-    try:
+    with session_scope() as session:
         residential_buildings = session.query(Residential).all()
-        transformer = get_transformer()
-        return [
-            {
-                "type": "Feature",
-                "geometry": mapping(crs_transform(transformer, to_shape(building.geom), swap_coords=False)),
-                "properties": {
-                    "gid": building.gid,
-                    "floorcount": building.floorcount,
-                    "appcount": building.appcount,
-                }
+
+    geometries = crs_transform_many(get_transformer(), [to_shape(building.geom) for building in residential_buildings])
+    return (
+        {
+            "type": "Feature",
+            "geometry": geometry_mapping(geometry),
+            "properties": {
+                "gid": building.gid,
+                "floorcount": building.floorcount,
+                "appcount": building.appcount,
             }
-            for building in residential_buildings
-        ]
-    finally:
-        session.close()
+        }
+        for building, geometry in zip(residential_buildings, geometries)
+    )
 
-def process_building(building, G, transformer, length_type, max_distance, k, max_amenities, f):
-    centroid = to_shape(building.geom).centroid
-    proximity_dict = G.get_closeby_amenities(centroid, length_type, max_distance)
-    index = compute_accessibility_index(proximity_dict, max_distance, k, max_amenities, f)
-    
+def building_feature(building, geometry, index):
     building_features = {
         "type": "Feature",
-        "geometry": mapping(crs_transform(transformer, centroid, swap_coords=False)),
+        "geometry": geometry_mapping(geometry),
         "properties": {
             "gid": building.gid,
             "floorcount": building.floorcount,
@@ -48,42 +40,41 @@ def process_building(building, G, transformer, length_type, max_distance, k, max
     return building_features
 
 def get_with_accessibility(G, length_type, max_distance, k, max_amenities, f, urban_planning_unit_id):
+    if urban_planning_unit_id:
+        ensure_building_upu()
 
-    session = get_db_session()
-    try:
+    with session_scope() as session:
         if urban_planning_unit_id:
             query = (
                 session.query(Residential)
-                .join(
-                    UrbanPlanningUnit,
-                    gfunc.ST_Within(Residential.geom, UrbanPlanningUnit.geom)
-                )
-                .filter(UrbanPlanningUnit.gid == urban_planning_unit_id)
+                .join(BuildingUpu, BuildingUpu.building_gid == Residential.gid)
+                .filter(BuildingUpu.upu_gid == urban_planning_unit_id)
             )
         else:
             query= session.query(Residential.gid, Residential.geom, Residential.floorcount, Residential.appcount)
         
         residential_buildings = query.all()
-        transformer = get_transformer()
 
-        # Parallel processing with Pool
-        with Pool(processes=cpu_count()) as pool:
-            result = pool.starmap(
-                process_building,
-                [(building, G, transformer, length_type, max_distance, k, max_amenities, f) for building in residential_buildings]
-            )
+    # The connection is back in the pool before the scoring starts.
+    # Buildings sharing a graph node get the same score, so every node is searched once
+    node_ids = G.locate_buildings(residential_buildings)
+    scores = score_node_ids(G, node_ids, length_type, max_distance, k, max_amenities, f).tolist()
+
+    centroids = [to_shape(building.geom).centroid for building in residential_buildings]
 
-        return result
-    finally:
-        session.close()
+    geometries = crs_transform_many(get_transformer(), centroids)
+    return (
+        building_feature(building, geometry, index)
+        for building, geometry, index in zip(residential_buildings, geometries, scores)
+    )
 
 def buildings_to_geojson(buildings):
-    transformer = get_transformer()
+    geometries = crs_transform_many(get_transformer(), [wkt.loads(building.geom).centroid for building in buildings])
 
     return(
         {
             "type": "Feature",
-            "geometry": mapping(crs_transform(transformer, wkt.loads(building.geom).centroid, swap_coords=False)),
+            "geometry": geometry_mapping(geometry),
             "properties": {
                 "gid": building.gid,
                 "floorcount": building.floorcount,
@@ -91,5 +82,5 @@ def buildings_to_geojson(buildings):
                 "accessibility": building.accessibility_index,
             }
         }
-        for building in buildings
+        for building, geometry in zip(buildings, geometries)
     )
@@ -1,8 +1,8 @@
-from ..database.connection import get_db_session
+from ..database.connection import session_scope
 from ..models.point_of_interest import SchoolPOI
 from geoalchemy2.shape import to_shape
-from shapely.geometry import mapping
-from .crs_transform import get_transformer, crs_transform
+from .geojson import geometry_mapping
+from .crs_transform import get_transformer, crs_transform_many
 # from .network import build_pedestrian_graph, extend_graph_with, compute_accessibility_isochrone
 
 import logging
@@ -10,23 +10,21 @@ import logging
 logging.basicConfig(level=logging.ERROR)
 
 def get_all():
-    session = get_db_session()
-    try:
+    with session_scope() as session:
         schools = session.query(SchoolPOI).all()
-        transformer = get_transformer()
-        return [
-            {
-                "type": "Feature",
-                "geometry": mapping(crs_transform(transformer, to_shape(school.geom), swap_coords=False)),
-                "properties": {
-                    "gid": school.gid,
-                    "subgroup": school.subgroup_i
-                }
+
+    geometries = crs_transform_many(get_transformer(), [to_shape(school.geom) for school in schools])
+    return (
+        {
+            "type": "Feature",
+            "geometry": geometry_mapping(geometry),
+            "properties": {
+                "gid": school.gid,
+                "subgroup": school.subgroup_i
             }
-            for school in schools
-        ]
-    finally:
-        session.close()
+        }
+        for school, geometry in zip(schools, geometries)
+    )
 
 # def compute_school_isochrone(G, school):
     # isochron = compute_accessibility_isochrone(G=G, source=school, weight_type='length', max_weight=1000)
@@ -57,7 +55,7 @@ def get_all():
 #     return [
 #         {
 #             "type": "Feature",
-#             "geometry": mapping(crs_transform(transformer, compute_school_isochrone(G, school.geom), swap_coords=False)),
+#             "geometry": geometry_mapping(crs_transform(transformer, compute_school_isochrone(G, school.geom), swap_coords=False)),
 #             "properties": {
 #                 "gid": school.gid,
 #                 "subgroup": school.subgroup_i
@@ -1,36 +1,34 @@
-from ..database.connection import get_db_session
+from ..database.connection import session_scope
 from ..models.urban_planning_unit import UrbanPlanningUnit
 from geoalchemy2.shape import to_shape
 from shapely import wkt
-from shapely.geometry import mapping
-from .crs_transform import get_transformer, crs_transform
+from .geojson import geometry_mapping
+from .crs_transform import get_transformer, crs_transform_many
 
 def get_all():
-    session = get_db_session()
-    try:
+    with session_scope() as session:
         urban_planning_units = session.query(UrbanPlanningUnit).all()
-        transformer = get_transformer()
-        return [
-            {
-                "type": "Feature",
-                "geometry": mapping(crs_transform(transformer, to_shape(urban_planning_unit.geom), swap_coords=False)),
-                "properties": {
-                    "gid": urban_planning_unit.gid,
-                    "name": urban_planning_unit.regname,
-                    "district": urban_planning_unit.rajon,
-                }
+
+    geometries = crs_transform_many(get_transformer(), [to_shape(upu.geom) for upu in urban_planning_units])
+    return (
+        {
+            "type": "Feature",
+            "geometry": geometry_mapping(geometry),
+            "properties": {
+                "gid": urban_planning_unit.gid,
+                "name": urban_planning_unit.regname,
+                "district": urban_planning_unit.rajon,
             }
-            for urban_planning_unit in urban_planning_units
-        ]
-    finally:
-        session.close()
+        }
+        for urban_planning_unit, geometry in zip(urban_planning_units, geometries)
+    )
 
 def upus_to_geojson(upus):
-    transformer = get_transformer()
+    geometries = crs_transform_many(get_transformer(), [wkt.loads(upu.geom) for upu in upus])
     return(
         {
             "type": "Feature",
-            "geometry": mapping(crs_transform(transformer, wkt.loads(upu.geom), swap_coords=False)),
+            "geometry": geometry_mapping(geometry),
             "properties": {
                 "gid": upu.gid,
                 "floorcount": upu.floor_count,
@@ -39,5 +37,5 @@ def upus_to_geojson(upus):
                 "appcount": upu.app_count,
             }
         }
-        for upu in upus
+        for upu, geometry in zip(upus, geometries)
     )
@@ -0,0 +1,119 @@
+import os
+import shutil
+import uuid
+from typing import Optional, Tuple
+
+from ..config import TILE_CACHE_DIR
+from .crs_transform import BGS2005
+from .precompute_accessibility import SCORES_TABLE
+
+SOURCE_SRID = int(BGS2005.split(':')[1])
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+# layer -> (table, attribute columns)
+TILE_LAYERS = {
+    'network': ('raw.pedestrian_network', ('id', 'length_m', 'minutes')),
+    'buildings': ('raw.buildings_all_residential_2024', ('gid', 'floorcount', 'appcount')),
+    'schools': ('raw.schools', ('gid', 'subgroup_i')),
+    'upus': ('raw.urban_planning_units', ('gid', 'regname', 'rajon')),
+}
+# Only this layer carries the accessibility index, so only its tiles depend on the parameters
+ACCESSIBILITY_LAYER = 'buildings'
+
+def validate_tile(layer: str, z: int, x: int, y: int):
+    if layer not in TILE_LAYERS:
+        raise ValueError(f"Unknown layer {layer}, expected one of {sorted(TILE_LAYERS)}")
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Tile {z}/{x}/{y} is out of range")
+
+def parameters_key(parameters: Optional[Tuple], generation: Optional[str] = None) -> str:
+    """ Directory name of a (length_type, max_distance, k, max_amenities, f) parameter set
+    and the generation of its scores.
+    """
+    if parameters is None:
+        return 'plain'
+    key = '_'.join(str(value) for value in parameters).replace('.', '_')
+    return key if generation is None else f'{key}-{generation}'
+
+def tile_query(layer: str, z: int, x: int, y: int, param_set_id: Optional[int] = None) -> Tuple[str, dict]:
+    """ SQL returning one MVT tile of `layer` and its bound parameters. Features are selected
+    with the spatial index in the source CRS and clipped in web mercator. With `param_set_id`
+    the buildings carry that parameter set's stored scores.
+    """
+    validate_tile(layer, z, x, y)
+    table, columns = TILE_LAYERS[layer]
+    attributes = ', '.join(f't.{column}' for column in columns)
+    params = {"z": z, "x": x, "y": y, "layer": layer}
+
+    accessibility_join = ''
+    if layer == ACCESSIBILITY_LAYER and param_set_id is not None:
+        params["param_set_id"] = param_set_id
+        accessibility_join = f'LEFT JOIN {SCORES_TABLE} AS a ON a.param_set_id = :param_set_id AND a.building_gid = t.gid'
+        attributes += ', CAST(a.score AS double precision) AS accessibility'
+
+    sql = f'''
+      WITH
+      bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS envelope
+      ),
+      features AS (
+        SELECT
+            {attributes},
+            ST_AsMVTGeom(ST_Transform(t.geom, 3857), bounds.envelope, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom
+        FROM
+            {table} AS t
+        CROSS JOIN
+            bounds
+        {accessibility_join}
+        WHERE
+            t.geom && ST_Transform(bounds.envelope, {SOURCE_SRID})
+      )
+      SELECT ST_AsMVT(features, :layer, {TILE_EXTENT}, 'geom') FROM features WHERE geom IS NOT NULL;
+    '''
+    return sql, params
+
+class TileCache:
+    """ Generated tiles on disk, under {cache_dir}/{version}/{layer}/{parameters}/{z}/{x}/{y}.mvt.
+
+    The graph version is part of the path, so tiles of a previous build are never served
+    after a rebuild, and `prune` can drop them wholesale. So is the generation of the
+    parameter set's scores, which changes whenever they are rewritten.
+    """
+
+    def __init__(self, cache_dir: str = TILE_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, version: Optional[str], layer: str, z: int, x: int, y: int, parameters: Optional[Tuple] = None,
+             generation: Optional[str] = None) -> str:
+        if layer != ACCESSIBILITY_LAYER:
+            parameters = None
+        key = parameters_key(parameters, generation)
+        return os.path.join(self.cache_dir, version or 'unversioned', layer, key, str(z), str(x), f'{y}.mvt')
+
+    def read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path: str, tile: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent requests for the same tile each write their own file, the last rename wins
+        staging_path = f'{path}.tmp-{uuid.uuid4().hex}'
+        with open(staging_path, 'wb') as f:
+            f.write(tile)
+        os.replace(staging_path, path)
+
+    def prune(self, keep_version: Optional[str]):
+        """ Remove the tiles of every version other than `keep_version`. """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != (keep_version or 'unversioned'):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+tile_cache = TileCache()
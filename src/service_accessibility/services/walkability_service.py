@@ -1,5 +1,6 @@
 import numpy as np
 import heapq
+from functools import lru_cache
 
 WEIGHTS = {
   's_gr_01_01': 0.5 * 15,
@@ -103,3 +104,67 @@ def compute_accessibility_index(proximity_dict, max_distance=1000, k=100, max_am
         return 0
 
     return round((total_score / max_possible_score) * 100, 2)
+
+@lru_cache(maxsize=32)
+def _default_weights_vector(subgroups):
+    return np.array([WEIGHTS[subgroup] for subgroup in subgroups], dtype=np.float64)
+
+def weights_vector(subgroups, weights_dict=WEIGHTS) -> np.ndarray:
+    """ Weights in the order of `subgroups`, cached for the default weights. """
+    if weights_dict is WEIGHTS:
+        return _default_weights_vector(tuple(subgroups))
+    return np.array([weights_dict[subgroup] for subgroup in subgroups], dtype=np.float64)
+
+def compute_accessibility_index_batch(distances, counts, subgroups, max_distance=1000, k=100, max_amenities=3, f=0.5, weights_dict=WEIGHTS, decimals=2):
+    """ Vectorized compute_accessibility_index for many buildings and parameter sets at once.
+
+    distances: (buildings, subgroups, width) nearest amenity distances per subgroup, padded with inf
+    counts: (buildings, subgroups) amenities reachable within the search cutoff, which may exceed width
+    subgroups: subgroup names for the second axis of `distances`
+
+    max_distance, k, max_amenities and f broadcast against each other. The result has shape
+    params_shape + (buildings,), e.g. (buildings,) when all parameters are scalars.
+    """
+    distances = np.sort(np.asarray(distances, dtype=np.float64), axis=-1)
+    counts = np.asarray(counts)
+    width = distances.shape[-1]
+
+    max_distance, k, max_amenities, f = np.broadcast_arrays(
+        *(np.asarray(value, dtype=np.float64) for value in (max_distance, k, max_amenities, f))
+    )
+    if np.any(max_amenities < 1) or np.any(max_amenities > width):
+        raise ValueError(f"max_amenities must be between 1 and the distance width {width}")
+
+    # Parameters get three trailing axes to broadcast against (buildings, subgroups, width)
+    max_distance, k, max_amenities, f = (value[..., None, None, None] for value in (max_distance, k, max_amenities, f))
+
+    within = distances <= max_distance
+    within_count = within.sum(axis=-1)
+    # Distances can come from a longer search than max_distance. If every stored entry is within
+    # max_distance, the full count is at least width >= max_amenities and saturates the same way.
+    count = np.where(within_count < width, within_count, counts)
+
+    max_amenities = max_amenities[..., 0]
+    f = f[..., 0]
+    averaged = np.minimum(count, max_amenities)
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        normalized = np.where(
+            distances <= max_distance / 2,
+            1.0,
+            np.where(within, np.exp(-(distances - max_distance / 2) / k), 0.0),
+        )
+    mask = np.arange(width) < averaged[..., None]
+    avg_score = np.where(mask, normalized, 0.0).sum(axis=-1) / np.maximum(averaged, 1)
+    diminishing = 1 + (np.clip(count, 1, max_amenities) - 1) * f
+
+    weights = weights_vector(subgroups, weights_dict)
+    present = count > 0
+    total_score = (avg_score * diminishing * weights * present).sum(axis=-1)
+    total_weight = (weights * present).sum(axis=-1)
+    max_possible_score = (weights * (1 + (max_amenities - 1) * f) * present).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(total_weight == 0, 0.0, total_score / max_possible_score * 100)
+
+    return scores if decimals is None else np.round(scores, decimals)
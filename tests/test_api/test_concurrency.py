@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import pytest
+from types import SimpleNamespace
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from service_accessibility.api.concurrency import (
+    SLOTS_SCOPE_KEY, ConcurrencyLimiter, ConcurrencySlotsMiddleware, iterate_on_cpu, limiter_stats, run_cpu,
+)
+
+def test_limiter_rejects_over_limit_with_retry_after():
+    limiter = ConcurrencyLimiter("test", limit=1, retry_after=7)
+
+    async def scenario():
+        slots = []
+        request = SimpleNamespace(scope={SLOTS_SCOPE_KEY: slots})
+        await limiter(request)
+        with pytest.raises(HTTPException) as excinfo:
+            await limiter(request)
+        assert slots == [limiter]
+        limiter.release()
+        return excinfo.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "7"
+    assert limiter.stats() == {"limit": 1, "in_flight": 0, "rejected": 1}
+    assert limiter_stats()["test"] == limiter.stats()
+
+def test_limiter_as_route_dependency():
+    limiter = ConcurrencyLimiter("route test", limit=2)
+    app = FastAPI()
+    app.add_middleware(ConcurrencySlotsMiddleware)
+
+    @app.get("/limited", dependencies=[Depends(limiter)])
+    async def limited():
+        return {"in_flight": limiter.in_flight}
+
+    @app.get("/failing", dependencies=[Depends(limiter)])
+    async def failing():
+        raise HTTPException(status_code=400)
+
+    client = TestClient(app)
+    response = client.get("/limited")
+    assert response.status_code == 200
+    assert response.json() == {"in_flight": 1}
+    assert limiter.in_flight == 0
+    assert client.get("/failing").status_code == 400
+    assert limiter.in_flight == 0
+
+def test_limiter_slot_is_held_while_the_body_streams():
+    limiter = ConcurrencyLimiter("streaming test", limit=1)
+    app = FastAPI()
+    app.add_middleware(ConcurrencySlotsMiddleware)
+    seen = []
+
+    def body():
+        for chunk in (b'a', b'b'):
+            seen.append(limiter.in_flight)
+            yield chunk
+
+    @app.get("/streamed", dependencies=[Depends(limiter)])
+    async def streamed():
+        return StreamingResponse(iterate_on_cpu(body()))
+
+    response = TestClient(app).get("/streamed")
+    assert response.content == b'ab'
+    assert seen == [1, 1]
+    assert limiter.in_flight == 0
+
+def test_limiter_requires_the_middleware():
+    limiter = ConcurrencyLimiter("unmanaged test", limit=1)
+    app = FastAPI()
+
+    @app.get("/limited", dependencies=[Depends(limiter)])
+    async def limited():
+        return {}
+
+    with pytest.raises(RuntimeError):
+        TestClient(app).get("/limited")
+    assert limiter.in_flight == 0
+
+def test_run_cpu_runs_off_the_event_loop():
+    async def scenario():
+        loop_thread = threading.get_ident()
+        worker_thread = await run_cpu(threading.get_ident)
+        return loop_thread, worker_thread, await run_cpu(sum, [1, 2, 3])
+
+    loop_thread, worker_thread, total = asyncio.run(scenario())
+    assert worker_thread != loop_thread
+    assert total == 6
+
+def test_iterate_on_cpu_produces_items_on_the_executor():
+    def items():
+        for i in range(3):
+            yield i, threading.current_thread().name
+
+    async def scenario():
+        return [item async for item in iterate_on_cpu(items())]
+
+    produced = asyncio.run(scenario())
+    assert [i for i, _ in produced] == [0, 1, 2]
+    assert all(name.startswith("cpu") for _, name in produced)
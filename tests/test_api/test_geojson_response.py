@@ -0,0 +1,55 @@
+import gzip
+import json
+from decimal import Decimal
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from service_accessibility.api.geojson_response import compress_chunks, feature_collection_chunks, geojson_response, negotiate_encoding
+
+def features(count):
+    return (
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": (23.3 + i, 42.6)},
+            "properties": {"gid": i, "accessibility": Decimal("0.5"), "length_m": np.float32(1.5)},
+        }
+        for i in range(count)
+    )
+
+def test_feature_collection_chunks_is_valid_geojson():
+    for count in (0, 1, 3, 7):
+        chunks = list(feature_collection_chunks(features(count), features_per_chunk=3))
+        collection = json.loads(b''.join(chunks))
+        assert collection["type"] == "FeatureCollection"
+        assert [feature["properties"]["gid"] for feature in collection["features"]] == list(range(count))
+        if count:
+            assert collection["features"][0]["properties"]["accessibility"] == 0.5
+            assert collection["features"][0]["properties"]["length_m"] == 1.5
+
+def test_negotiate_encoding():
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+
+def test_compress_chunks_gzip():
+    chunks = [b'{"a":', b'1}']
+    assert gzip.decompress(b''.join(compress_chunks(chunks, "gzip"))) == b'{"a":1}'
+
+def test_geojson_response_streams_compressed():
+    app = FastAPI()
+
+    @app.get("/features")
+    async def get_features(request: Request):
+        return geojson_response(request, features(1000))
+
+    client = TestClient(app)
+    response = client.get("/features", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"] == "application/geo+json"
+    assert len(response.json()["features"]) == 1000
+
+    response = client.get("/features", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert len(response.json()["features"]) == 1000
@@ -0,0 +1,64 @@
+import gzip
+import json
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from service_accessibility.api.geojson_response import GZIP_LEVEL
+from service_accessibility.api.layer_cache import CachedLayer, LayerCache, cached_geojson_response
+
+def make_app():
+    cache = LayerCache()
+    state = {"version": "v1", "calls": 0}
+
+    def features():
+        state["calls"] += 1
+        return ({"type": "Feature", "geometry": None, "properties": {"gid": i, "version": state["version"]}} for i in range(3))
+
+    app = FastAPI()
+
+    @app.get("/layer")
+    async def get_layer(request: Request):
+        return cached_geojson_response(request, cache.get("layer", state["version"], features))
+
+    return TestClient(app), cache, state
+
+def test_layer_is_built_once_per_version():
+    client, cache, state = make_app()
+    first = client.get("/layer", headers={"Accept-Encoding": "identity"})
+    second = client.get("/layer", headers={"Accept-Encoding": "identity"})
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert len(first.json()["features"]) == 3
+    assert state["calls"] == 1
+    assert cache.stats()["hits"] == 1
+
+    state["version"] = "v2"
+    third = client.get("/layer", headers={"Accept-Encoding": "identity"})
+    assert state["calls"] == 2
+    assert third.json()["features"][0]["properties"]["version"] == "v2"
+    assert third.headers["etag"] != first.headers["etag"]
+
+def test_if_none_match_returns_304():
+    client, _, _ = make_app()
+    response = client.get("/layer", headers={"Accept-Encoding": "identity"})
+    etag = response.headers["etag"]
+    assert etag.startswith('"')
+
+    not_modified = client.get("/layer", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.content == b''
+
+    assert client.get("/layer", headers={"Accept-Encoding": "identity", "If-None-Match": '"stale"'}).status_code == 200
+
+def test_compressed_variant_has_its_own_etag():
+    client, cache, _ = make_app()
+    plain = client.get("/layer", headers={"Accept-Encoding": "identity"})
+    compressed = client.get("/layer", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["etag"] != plain.headers["etag"]
+    assert json.loads(gzip.decompress(cache._layers["layer"].bodies["gzip"])) == plain.json()
+
+def test_layer_is_compressed_at_the_streaming_levels():
+    layer = CachedLayer("v1", b'{"type": "FeatureCollection", "features": []}')
+    assert layer.bodies['gzip'] == gzip.compress(layer.bodies[None], compresslevel=GZIP_LEVEL)
+    assert set(layer.stats()["bytes"]) >= {'identity', 'gzip'}
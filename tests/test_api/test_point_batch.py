@@ -0,0 +1,38 @@
+import json
+import numpy as np
+import pytest
+from service_accessibility.api.point_batch import POINTS_MEDIA_TYPE, parse_points, scores_response
+
+def test_parse_json_and_binary_points():
+    points = np.array([[316221.9, 4729194.7], [316500.0, 4729300.0]])
+    from_json = parse_points(json.dumps({"points": points.tolist()}).encode(), 'application/json; charset=utf-8')
+    from_binary = parse_points(points.astype('<f8').tobytes(), POINTS_MEDIA_TYPE)
+
+    np.testing.assert_array_equal(from_json, points)
+    np.testing.assert_array_equal(from_binary, points)
+    assert parse_points(b'{"points": []}', 'application/json').shape == (0, 2)
+
+@pytest.mark.parametrize("body, content_type", [
+    (b'{"points": [[1, 2, 3]]}', 'application/json'),
+    (b'{"coordinates": [[1, 2]]}', 'application/json'),
+    (b'{"points": [[1, "a"]]}', 'application/json'),
+    (b'{"points": [[1, NaN]]}', 'application/json'),
+    (b'\x00' * 24, POINTS_MEDIA_TYPE),
+    (np.array([1.0, np.inf]).tobytes(), POINTS_MEDIA_TYPE),
+    (b'1,2', 'text/csv'),
+])
+def test_parse_rejects_malformed_points(body, content_type):
+    with pytest.raises(ValueError):
+        parse_points(body, content_type)
+
+def test_parse_rejects_too_many_points():
+    with pytest.raises(ValueError):
+        parse_points(np.zeros((3, 2)).tobytes(), POINTS_MEDIA_TYPE, max_points=2)
+
+def test_scores_response_follows_accept():
+    scores = np.array([12.5, 0.0, 99.1])
+    assert json.loads(scores_response(scores, None).body) == {"scores": [12.5, 0.0, 99.1]}
+
+    binary = scores_response(scores, POINTS_MEDIA_TYPE)
+    assert binary.media_type == POINTS_MEDIA_TYPE
+    np.testing.assert_array_equal(np.frombuffer(binary.body, dtype='<f8'), scores)
@@ -0,0 +1,34 @@
+import random
+import pytest
+from shapely.geometry import Point
+from service_accessibility.services.network import PedestrianGraph
+
+AMENITY_TYPES = ['s_gr_01_01', 's_gr_2_1', 's_gr_5_2', 's_gr_8_13']
+
+@pytest.fixture
+def grid_graph(tmp_path):
+    """ A 12x12 grid street network with irregular weights and amenities on ~15% of the nodes. """
+    rng = random.Random(42)
+    G = PedestrianGraph(data_dir=str(tmp_path), filename='grid')
+    size, spacing = 12, 100.0
+
+    node_ids = {}
+    for i in range(size):
+        for j in range(size):
+            node_ids[(i, j)] = G.add_or_get_node(Point(i * spacing, j * spacing))
+
+    for (i, j), node_id in node_ids.items():
+        for di, dj in ((1, 0), (0, 1)):
+            neighbour = node_ids.get((i + di, j + dj))
+            if neighbour is None or rng.random() < 0.1:
+                continue
+            length_m = spacing * rng.uniform(1.0, 1.6)
+            G.G.add_edge(node_id, neighbour, length_m=length_m, minutes=length_m / rng.uniform(60, 90))
+            G.get_edge_id(node_id, neighbour)
+
+    for node_id in G.G.nodes:
+        if rng.random() < 0.15:
+            for amenity_type in rng.sample(AMENITY_TYPES, rng.randint(1, 2)):
+                G.G.nodes[node_id].setdefault('amenity_types', set()).add(amenity_type)
+
+    return G
@@ -0,0 +1,29 @@
+import numpy as np
+from shapely.geometry import Point
+from service_accessibility.services.accessibility_pool import AccessibilityPool, score_node_ids, score_nodes
+from service_accessibility.services.walkability_service import compute_accessibility_index
+
+def test_scores_follow_input_order_with_repeated_nodes(grid_graph):
+    points = np.array([[600.0, 600.0], [0.0, 0.0], [601.0, 599.0], [1100.0, 300.0], [0.0, 0.0]])
+    node_ids = grid_graph.find_nearest_nodes(points)
+    assert node_ids[0] == node_ids[2]
+
+    scores = score_node_ids(grid_graph, node_ids, 'length_m', 800, 100, 3, 0.5)
+
+    expected = [
+        compute_accessibility_index(grid_graph.get_closeby_amenities(Point(x, y), 'length_m', 800), 800, 100, 3, 0.5)
+        for x, y in points
+    ]
+    np.testing.assert_allclose(scores, expected)
+
+def test_pool_workers_load_the_artifact(grid_graph, tmp_path):
+    grid_graph.save_graph()
+    node_ids = [int(node_id) for node_id in grid_graph.compact().node_ids[::7]]
+    pool = AccessibilityPool(processes=2, chunk_size=4, data_dir=str(tmp_path), filename='grid')
+    try:
+        scores = pool.score_nodes(node_ids, 'length_m', 800, 100, 3, 0.5)
+    finally:
+        pool.close()
+
+    np.testing.assert_allclose(scores, score_nodes(grid_graph, node_ids, 'length_m', 800, 100, 3, 0.5))
+    assert pool._pool is None
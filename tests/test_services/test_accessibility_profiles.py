@@ -0,0 +1,29 @@
+import networkx as nx
+import numpy as np
+import pytest
+from service_accessibility.services.accessibility_profiles import AccessibilityProfiles, build_profiles, find_profiles, profiles_path
+from service_accessibility.services.walkability_service import compute_accessibility_index
+
+def test_profiles_rescore_like_a_fresh_search(grid_graph, tmp_path):
+    compact = grid_graph.compact()
+    building_nodes = np.arange(0, compact.number_of_nodes, 3)
+    building_gids = building_nodes + 1000
+
+    path = profiles_path('length_m', 1500, data_dir=str(tmp_path))
+    build_profiles(compact, building_gids, building_nodes, 'length_m', 1500, width=5).save(path)
+    profiles = find_profiles('length_m', 900, 3, data_dir=str(tmp_path))
+
+    assert isinstance(profiles, AccessibilityProfiles)
+    assert find_profiles('length_m', 1600, 3, data_dir=str(tmp_path)) is None
+    assert find_profiles('length_m', 900, 6, data_dir=str(tmp_path)) is None
+
+    scores = profiles.scores_by_gid(900, 150, 3, 0.5)
+    for gid, node_index in zip(building_gids, building_nodes):
+        source_node = int(compact.node_ids[node_index])
+        distances = nx.single_source_dijkstra_path_length(grid_graph.G, source_node, cutoff=900, weight='length_m')
+        proximity_dict = {}
+        for node, distance in distances.items():
+            for amenity in grid_graph.G.nodes[node].get('amenity_types', ()):
+                proximity_dict.setdefault(amenity, []).append(distance)
+
+        assert scores[int(gid)] == pytest.approx(compute_accessibility_index(proximity_dict, 900, 150, 3, 0.5), abs=0.011)
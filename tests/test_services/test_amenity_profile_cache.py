@@ -0,0 +1,64 @@
+import pytest
+from service_accessibility.services.amenity_profile_cache import AmenityProfile, AmenityProfileCache
+
+def saved(grid_graph):
+    grid_graph.save_graph()
+    return grid_graph
+
+def test_smaller_cutoffs_are_cut_from_the_cached_profile(grid_graph):
+    G = saved(grid_graph)
+    cache = AmenityProfileCache()
+    compact = G.compact()
+    node = int(compact.node_ids[70])
+
+    assert cache.get(G, node, 'length_m', 900) == compact.get_closeby_amenities(node, 'length_m', 900)
+    for cutoff in (0, 150, 420.5, 900):
+        assert cache.get(G, node, 'length_m', cutoff) == compact.get_closeby_amenities(node, 'length_m', cutoff)
+    assert (cache.hits, cache.misses) == (4, 1)
+
+    # A larger cutoff searches again and replaces the entry, other distance types are separate
+    cache.get(G, node, 'length_m', 1200)
+    cache.get(G, node, 'minutes', 5)
+    assert cache.stats()["entries"] == 2
+    assert (cache.hits, cache.misses) == (4, 3)
+
+def test_eviction_keeps_the_cache_under_its_byte_budget(grid_graph):
+    G = saved(grid_graph)
+    compact = G.compact()
+    entry_bytes = AmenityProfile(900, compact.get_closeby_amenities(int(compact.node_ids[0]), 'length_m', 900)).nbytes
+    cache = AmenityProfileCache(max_bytes=3 * entry_bytes)
+
+    for node in compact.node_ids[:20].tolist():
+        cache.get(G, node, 'length_m', 900)
+
+    stats = cache.stats()
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] == 20 - stats["entries"] > 0
+    # The most recently used node is still cached
+    cache.get(G, int(compact.node_ids[19]), 'length_m', 900)
+    assert cache.hits == 1
+
+def test_unsaved_graphs_are_not_cached(grid_graph):
+    cache = AmenityProfileCache()
+    node = int(grid_graph.compact().node_ids[0])
+    cache.get(grid_graph, node, 'minutes', 8)
+    cache.get(grid_graph, node, 'minutes', 8)
+    assert cache.stats()["entries"] == 0
+
+@pytest.mark.parametrize("saturated", [False, True])
+def test_capped_profiles_only_serve_smaller_caps(grid_graph, saturated):
+    G = saved(grid_graph)
+    cache = AmenityProfileCache(saturated=saturated)
+    compact = G.compact()
+    node = int(compact.node_ids[70])
+    full = compact.get_closeby_amenities(node, 'length_m', 900)
+
+    assert cache.get(G, node, 'length_m', 900, max_amenities=3) == {name: distances[:3] for name, distances in full.items()}
+    assert cache.get(G, node, 'length_m', 600, max_amenities=2) == {
+        name: [d for d in distances if d <= 600][:2] for name, distances in full.items() if distances[0] <= 600
+    }
+    assert cache.hits == 1
+    assert cache.get(G, node, 'length_m', 900) == full
+    assert cache.get(G, node, 'length_m', 900, max_amenities=5) == {name: distances[:5] for name, distances in full.items()}
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.stats()["scoring_searches"] == 1
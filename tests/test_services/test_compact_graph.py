@@ -0,0 +1,131 @@
+import os
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from service_accessibility.services.compact_graph import CompactGraph
+
+def networkx_amenities(G, source_node, distance_type, cutoff):
+    distances = nx.single_source_dijkstra_path_length(G, source_node, cutoff=cutoff, weight=distance_type)
+    amenities = {}
+    for node, distance in distances.items():
+        for amenity in G.nodes[node].get('amenity_types', ()):
+            amenities.setdefault(amenity, []).append(distance)
+    return {amenity: sorted(values) for amenity, values in amenities.items()}
+
+def assert_same_amenities(expected, actual):
+    assert expected.keys() == actual.keys()
+    for amenity in expected:
+        assert actual[amenity] == pytest.approx(expected[amenity], rel=1e-6)
+
+def test_compact_graph_structure(grid_graph):
+    compact = CompactGraph.from_networkx(grid_graph.G)
+    assert compact.number_of_nodes == grid_graph.G.number_of_nodes()
+    assert compact.number_of_edges == grid_graph.G.number_of_edges()
+    assert compact.length_m.dtype == np.float32
+    assert not compact.indices.flags.writeable
+
+@pytest.mark.parametrize("distance_type, cutoff", [('length_m', 450), ('length_m', 1000), ('minutes', 8)])
+def test_compact_graph_matches_networkx(grid_graph, distance_type, cutoff):
+    compact = CompactGraph.from_networkx(grid_graph.G)
+    for source_node in list(grid_graph.G.nodes)[::7]:
+        expected = networkx_amenities(grid_graph.G, source_node, distance_type, cutoff)
+        assert_same_amenities(expected, compact.get_closeby_amenities(source_node, distance_type, cutoff))
+
+def test_pedestrian_graph_engines_agree(grid_graph):
+    source = Point(523.0, 611.0)
+    expected = grid_graph.get_closeby_amenities(source, 'length_m', 800, engine='networkx')
+    actual = grid_graph.get_closeby_amenities(source, 'length_m', 800, engine='csr')
+    assert_same_amenities({amenity: sorted(values) for amenity, values in expected.items()}, actual)
+
+def test_unknown_engine_is_rejected(grid_graph):
+    with pytest.raises(ValueError):
+        grid_graph.get_closeby_amenities(Point(0, 0), 'length_m', 800, engine='igraph')
+
+def test_artifact_round_trip(grid_graph, tmp_path):
+    from service_accessibility.services.network import PedestrianGraph
+
+    grid_graph.save_graph()
+    loaded = PedestrianGraph.load_graph(data_dir=str(tmp_path), filename='grid')
+
+    assert loaded.version == grid_graph.version
+    assert isinstance(loaded.compact().indices, np.memmap)
+    assert loaded.compact().number_of_edges == grid_graph.G.number_of_edges()
+
+    source = Point(523.0, 611.0)
+    assert loaded.find_nearest_node(source) == grid_graph.find_nearest_node(source)
+    assert_same_amenities(
+        grid_graph.get_closeby_amenities(source, 'minutes', 9, engine='csr'),
+        loaded.get_closeby_amenities(source, 'minutes', 9),
+    )
+
+    rebuilt = loaded.G
+    assert rebuilt.number_of_edges() == grid_graph.G.number_of_edges()
+    assert all(rebuilt.nodes[n].get('amenity_types') == grid_graph.G.nodes[n].get('amenity_types') for n in rebuilt.nodes)
+
+def test_artifact_path_always_resolves_to_a_complete_build(grid_graph, tmp_path):
+    from service_accessibility.services.graph_artifact import artifact_exists, build_path
+
+    path = grid_graph.artifact_path
+    grid_graph.save_graph()
+    first = grid_graph.version
+    assert os.path.islink(path)
+    assert os.path.realpath(path) == os.path.realpath(build_path(path, first))
+
+    grid_graph.save_graph()
+    second = grid_graph.version
+    assert os.path.realpath(path) == os.path.realpath(build_path(path, second))
+    # A reader that resolved the previous build can still finish loading it
+    assert artifact_exists(build_path(path, first))
+
+    grid_graph.save_graph()
+    assert not os.path.exists(build_path(path, first))
+    assert artifact_exists(build_path(path, second))
+    assert sorted(os.listdir(tmp_path)) == sorted(['grid.graph', os.path.basename(build_path(path, second)),
+                                                  os.path.basename(build_path(path, grid_graph.version))])
+
+def test_artifact_in_a_plain_directory_is_moved_aside(grid_graph, tmp_path):
+    from service_accessibility.services.network import PedestrianGraph
+
+    path = grid_graph.artifact_path
+    grid_graph.save_graph()
+    legacy = grid_graph.version
+    target = os.path.realpath(path)
+    os.unlink(path)
+    os.rename(target, path)
+
+    grid_graph.save_graph()
+    assert os.path.islink(path)
+    assert PedestrianGraph.load_graph(data_dir=str(tmp_path), filename='grid').version == grid_graph.version != legacy
+
+@pytest.mark.parametrize("distance_type, cutoff, max_amenities", [('length_m', 1500, 1), ('length_m', 800, 3), ('minutes', 12, 2)])
+def test_saturated_search_keeps_the_nearest_amenities(grid_graph, distance_type, cutoff, max_amenities):
+    from service_accessibility.services.walkability_service import compute_accessibility_index
+
+    compact = CompactGraph.from_networkx(grid_graph.G)
+    for source_node in compact.node_ids[::17].tolist():
+        full = compact.get_closeby_amenities(source_node, distance_type, cutoff)
+        saturated, settled = compact.saturated_amenities(source_node, distance_type, cutoff, max_amenities)
+
+        assert_same_amenities({amenity: distances[:max_amenities] for amenity, distances in full.items()}, saturated)
+        assert settled <= np.isfinite(compact.distances_from(compact.index_of(source_node), distance_type, cutoff)).sum()
+        assert compute_accessibility_index(saturated, cutoff, 100, max_amenities, 0.5) == compute_accessibility_index(full, cutoff, 100, max_amenities, 0.5)
+
+def test_saturated_search_stops_early(grid_graph):
+    compact = CompactGraph.from_networkx(grid_graph.G)
+    source_node = grid_graph.find_nearest_node(Point(600.0, 600.0))
+    reached = np.isfinite(compact.distances_from(compact.index_of(source_node), 'length_m', 5000)).sum()
+
+    _, settled = compact.saturated_amenities(source_node, 'length_m', 5000, 1)
+    assert settled < reached / 2
+    # Only the tracked subgroups have to saturate
+    amenities, _ = compact.saturated_amenities(source_node, 'length_m', 5000, 1, subgroups=['s_gr_2_1'])
+    assert list(amenities) == ['s_gr_2_1']
+
+def test_capped_search_matches_the_saturated_one(grid_graph):
+    compact = CompactGraph.from_networkx(grid_graph.G)
+    for source_node in compact.node_ids[::23].tolist():
+        capped, reached = compact.scoring_amenities(source_node, 'length_m', 900, 2)
+        saturated, settled = compact.scoring_amenities(source_node, 'length_m', 900, 2, saturated=True)
+        assert_same_amenities(capped, saturated)
+        assert settled <= reached
@@ -0,0 +1,46 @@
+import pytest
+import sqlalchemy as sa
+from service_accessibility.database import connection
+
+@pytest.fixture
+def sqlite_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(connection, "DATABASE_URL", f"sqlite:///{tmp_path / 'pool.db'}")
+    connection.dispose_engine()
+    connection.pool_metrics.reset()
+    yield connection.get_db_engine()
+    connection.dispose_engine()
+
+def test_engine_is_shared(sqlite_engine):
+    assert connection.get_db_engine() is sqlite_engine
+    assert isinstance(sqlite_engine.pool, connection.TimedQueuePool)
+
+def test_session_scope_returns_connection_to_pool(sqlite_engine):
+    with connection.session_scope() as session:
+        assert session.execute(sa.text("SELECT 1")).scalar() == 1
+        assert connection.pool_status()["checked_out"] == 1
+
+    status = connection.pool_status()
+    assert status["checked_out"] == 0
+    assert status["checkouts"] == 1
+
+def test_session_scope_rolls_back_on_error(sqlite_engine):
+    with connection.session_scope() as session:
+        session.execute(sa.text("CREATE TABLE t (x INTEGER)"))
+
+    with pytest.raises(RuntimeError):
+        with connection.session_scope() as session:
+            session.execute(sa.text("INSERT INTO t VALUES (1)"))
+            raise RuntimeError()
+
+    with connection.session_scope() as session:
+        assert session.execute(sa.text("SELECT COUNT(*) FROM t")).scalar() == 0
+    assert connection.pool_status()["checked_out"] == 0
+
+def test_fetch_all_async_uses_the_shared_pool(sqlite_engine):
+    import asyncio
+
+    rows = asyncio.run(connection.fetch_all_async("SELECT :x", {"x": 3}))
+    assert [tuple(row) for row in rows] == [(3,)]
+    status = connection.pool_status()
+    assert status["checkouts"] == 1
+    assert status["checked_out"] == 0
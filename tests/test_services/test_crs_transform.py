@@ -1,7 +1,7 @@
 import pytest
 from shapely.geometry import Point, MultiPoint, LineString, Polygon, MultiPolygon, GeometryCollection
 from service_accessibility.services.crs_transform import (
-    crs_transform, crs_transform_coords
+    crs_transform, crs_transform_coords, crs_transform_many, get_transformer
 )
 
 def test_crs_transform_point():
@@ -60,3 +60,47 @@ def test_crs_transform_geometrycollection():
     assert isinstance(transformed, GeometryCollection)
     assert transformed.geoms[0].x == pytest.approx(23.325, abs=1e-3)
     assert transformed.geoms[0].y == pytest.approx(42.696, abs=1e-3)
+
+def test_crs_transform_many_matches_per_point_transform():
+    transformer = get_transformer()
+    point = Point(321812.94252381043, 4731192.267176171)
+    linestring = LineString([(320960.4910, 4728848.5264), (320844.2254, 4728875.6080), (320794.2176, 4729493.6845)])
+    transformed_point, transformed_linestring = crs_transform_many(transformer, [point, linestring])
+
+    assert transformed_point.x == pytest.approx(23.325, abs=1e-3)
+    assert transformed_point.y == pytest.approx(42.696, abs=1e-3)
+    for (x, y), (lon, lat) in zip(linestring.coords, transformed_linestring.coords):
+        assert (lon, lat) == pytest.approx(transformer.transform(x, y))
+
+    swapped = crs_transform_many(transformer, [point], swap_coords=True)[0]
+    assert (swapped.x, swapped.y) == pytest.approx((transformed_point.y, transformed_point.x))
+
+def test_crs_transform_many_keeps_holes_and_parts():
+    shell = [(320000, 4728000), (320100, 4728000), (320100, 4728100), (320000, 4728100)]
+    hole = [(320010, 4728010), (320020, 4728010), (320020, 4728020), (320010, 4728020)]
+    polygon = Polygon(shell, [hole])
+    multipolygon = MultiPolygon([polygon, Polygon([(320200, 4728000), (320300, 4728000), (320300, 4728100)])])
+
+    transformed_polygon, transformed_multipolygon = crs_transform_many(get_transformer(), [polygon, multipolygon])
+    assert len(transformed_polygon.interiors) == 1
+    assert len(transformed_polygon.interiors[0].coords) == len(polygon.interiors[0].coords)
+    assert len(transformed_multipolygon.geoms) == 2
+    assert len(transformed_multipolygon.geoms[0].interiors) == 1
+    assert len(crs_transform(get_transformer(), polygon).interiors) == 1
+
+def test_get_transformer_is_cached():
+    assert get_transformer() is get_transformer()
+
+def test_crs_transform_many_rejects_invalid_geometries():
+    bowtie = Polygon([(320000, 4728000), (320100, 4728100), (320100, 4728000), (320000, 4728100)])
+    with pytest.raises(ValueError):
+        crs_transform_many(get_transformer(), [Point(321812.9, 4731192.2), bowtie])
+    with pytest.raises(ValueError):
+        crs_transform(get_transformer(), bowtie)
+
+def test_crs_transform_many_drops_z():
+    # Schools are stored as 3D MultiPoints
+    multipoint = MultiPoint([(321812.9, 4731192.2, 550.0), (321813.9, 4731193.2, 551.0)])
+    transformed = crs_transform_many(get_transformer(), [multipoint])[0]
+    assert not transformed.has_z
+    assert transformed.geoms[0].x == pytest.approx(23.325, abs=1e-3)
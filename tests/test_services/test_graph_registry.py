@@ -0,0 +1,43 @@
+import json
+import os
+from service_accessibility.services.graph_artifact import MANIFEST_FILENAME
+from service_accessibility.services.graph_registry import GraphRegistry
+
+def test_reload_swaps_in_the_new_build(grid_graph, tmp_path):
+    grid_graph.save_graph()
+    registry = GraphRegistry(data_dir=str(tmp_path), filename='grid')
+    first = registry.get()
+    assert first.version == grid_graph.version
+    assert registry.get() is first
+
+    grid_graph.save_graph()
+    second = registry.reload()
+
+    assert second is not first
+    assert registry.get() is second
+    assert registry.version == grid_graph.version != first.version
+    assert registry.stats()["load_count"] == 2
+
+def test_failed_reload_keeps_the_previous_graph(grid_graph, tmp_path):
+    grid_graph.save_graph()
+    registry = GraphRegistry(data_dir=str(tmp_path), filename='grid')
+    graph = registry.load()
+
+    # Unreadable manifest
+    with open(os.path.join(grid_graph.artifact_path, MANIFEST_FILENAME), 'w') as f:
+        json.dump({"format": "something-else"}, f)
+    assert registry.reload() is None
+    assert registry.get() is graph
+
+    # No artifact at all
+    os.unlink(grid_graph.artifact_path)
+    assert registry.reload() is None
+    assert registry.get() is graph
+    assert registry.stats()["load_count"] == 1
+
+def test_missing_graph_is_not_loaded(tmp_path):
+    registry = GraphRegistry(data_dir=str(tmp_path), filename='missing')
+
+    assert registry.get() is None
+    assert not registry.is_loaded
+    assert registry.stats()["loaded"] is False
@@ -0,0 +1,46 @@
+import pytest
+from shapely.geometry import Point
+from service_accessibility.services.isochrones import IsochroneEngine, isochrone_bands
+from service_accessibility.services.network import PedestrianGraph
+
+def test_bands_end_at_max_distance():
+    assert isochrone_bands(1000) == (1000,)
+    assert isochrone_bands(1000, 300) == (300, 600, 900, 1000)
+    with pytest.raises(ValueError):
+        isochrone_bands(1000, 0)
+    with pytest.raises(ValueError):
+        isochrone_bands(100000, 1)
+
+def test_partial_edges_are_cut_at_the_cutoff(tmp_path):
+    G = PedestrianGraph(data_dir=str(tmp_path), filename='street')
+    start = G.add_or_get_node(Point(0, 0))
+    end = G.add_or_get_node(Point(100, 0))
+    G.G.add_edge(start, end, length_m=100.0, minutes=1.25)
+
+    short, whole = IsochroneEngine(buffer=5).polygons(G, start, 'length_m', (40, 150))
+    assert short.bounds == pytest.approx((-5, -5, 45, 5))
+    assert whole.bounds == pytest.approx((-5, -5, 105, 5))
+
+def test_bands_are_nested_and_cover_reached_nodes(grid_graph):
+    engine = IsochroneEngine(buffer=10)
+    source = grid_graph.find_nearest_node(Point(600.0, 600.0))
+    bands = (200, 400, 600)
+    polygons = engine.polygons(grid_graph, source, 'length_m', bands)
+
+    compact = grid_graph.compact()
+    distances = compact.distances_from(compact.index_of(source), 'length_m', bands[-1])
+    for cutoff, polygon in zip(bands, polygons):
+        for i in (distances <= cutoff).nonzero()[0]:
+            assert polygon.contains(Point(grid_graph.node_coords[compact.node_ids[i]]))
+    for smaller, larger in zip(polygons, polygons[1:]):
+        assert larger.buffer(1e-6).contains(smaller)
+
+def test_results_are_cached_per_snapped_node(grid_graph):
+    engine = IsochroneEngine(cache_size=1)
+    first = engine.features(grid_graph, Point(600.0, 600.0), 'minutes', (5, 10))
+    # A nearby point that snaps to the same node is served from the cache
+    assert engine.features(grid_graph, Point(601.0, 599.0), 'minutes', (5, 10)) is first
+    assert [feature['properties']['max_distance'] for feature in first] == [10, 5]
+
+    engine.features(grid_graph, Point(0.0, 0.0), 'minutes', (5, 10))
+    assert engine.stats() == {"entries": 1, "cache_size": 1, "hits": 1, "misses": 2, "evictions": 1}
@@ -0,0 +1,29 @@
+import heapq
+import networkx as nx
+import numpy as np
+import pytest
+from service_accessibility.services.nearest_amenities import compute_nearest_amenities
+from service_accessibility.services.walkability_service import compute_accessibility_index
+
+@pytest.mark.parametrize("max_amenities", [1, 3, 5])
+def test_multi_source_table_matches_per_node_search(grid_graph, max_amenities):
+    compact = grid_graph.compact()
+    targets = np.arange(0, compact.number_of_nodes, 5)
+    table = compute_nearest_amenities(compact, 'length_m', 700, max_amenities, target_indices=targets)
+
+    for node_index in targets:
+        source_node = int(compact.node_ids[node_index])
+        distances = nx.single_source_dijkstra_path_length(grid_graph.G, source_node, cutoff=700, weight='length_m')
+        expected = {}
+        for node, distance in distances.items():
+            for amenity in grid_graph.G.nodes[node].get('amenity_types', ()):
+                expected.setdefault(amenity, []).append(distance)
+
+        actual = table.proximity_dict(int(node_index))
+        assert actual.keys() == expected.keys()
+        for amenity, values in expected.items():
+            assert actual[amenity] == pytest.approx(heapq.nsmallest(max_amenities, values), rel=1e-6)
+
+        assert compute_accessibility_index(actual, 700, 100, max_amenities, 0.5) == pytest.approx(
+            compute_accessibility_index(expected, 700, 100, max_amenities, 0.5), abs=0.011
+        )
@@ -0,0 +1,189 @@
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from service_accessibility.services.network import PedestrianGraph
+
+def straight_street(tmp_path, filename='street'):
+    G = PedestrianGraph(data_dir=str(tmp_path), filename=filename)
+    start = G.add_or_get_node(Point(0, 0))
+    end = G.add_or_get_node(Point(100, 0))
+    G.G.add_edge(start, end, length_m=100.0, minutes=1.25)
+    G.get_edge_id(start, end)
+    G.rebuild_rtree_indices()
+    return G
+
+def test_bulk_extension_matches_point_by_point(grid_graph, tmp_path):
+    # Points far enough apart that each one snaps to a different edge
+    points = np.array([[130.0, 40.0], [520.0, 710.0], [960.0, 330.0], [300.0, 300.0]])
+    sequential = grid_graph
+    sequential.rebuild_rtree_indices()
+    bulk = PedestrianGraph(data_dir=str(tmp_path), filename='bulk')
+    bulk.G = sequential.G.copy()
+    bulk._coords = sequential._coords.copy()
+    bulk.node_id_counter = sequential.node_id_counter
+    bulk.edge_id_to_nodes = dict(sequential.edge_id_to_nodes)
+    bulk.nodes_to_edge_id = dict(sequential.nodes_to_edge_id)
+    bulk.edge_id_counter = sequential.edge_id_counter
+    bulk._node_lookup = None
+    bulk.rebuild_rtree_indices()
+
+    for x, y in points:
+        sequential.extend_graph_with_point(Point(x, y), 's_gr_4_1')
+    bulk_node_ids = bulk.extend_graph_with_points(points, 's_gr_4_1')
+
+    assert bulk.G.number_of_nodes() == sequential.G.number_of_nodes()
+    assert bulk.G.number_of_edges() == sequential.G.number_of_edges()
+    for node_id in bulk_node_ids:
+        expected = nx.single_source_dijkstra_path_length(sequential.G, sequential.point_to_node_id(bulk.node_to_point(node_id)), weight='length_m')
+        actual = nx.single_source_dijkstra_path_length(bulk.G, int(node_id), weight='length_m')
+        assert sorted(actual.values()) == pytest.approx(sorted(expected.values()))
+
+def test_bulk_extension_splits_each_edge_once(tmp_path):
+    G = straight_street(tmp_path)
+    node_ids = G.extend_graph_with_points(np.array([[70.0, 5.0], [20.0, -5.0], [70.0, 5.0], [45.0, 0.0]]), 's_gr_5_1')
+
+    assert node_ids[0] == node_ids[2]
+    # start - 20 - 45 - 70 - end along the street, plus two connectors (the point at 45 lies on it)
+    assert G.G.number_of_edges() == 6
+    assert nx.dijkstra_path_length(G.G, 0, 1, weight='length_m') == pytest.approx(100.0)
+    assert nx.dijkstra_path_length(G.G, 0, int(node_ids[0]), weight='length_m') == pytest.approx(75.0)
+    assert G.G.nodes[int(node_ids[3])]['amenity_types'] == {'s_gr_5_1'}
+    assert len(G.edge_id_to_nodes) == 6
+
+def test_node_deduplication_with_snap_tolerance(tmp_path):
+    exact = PedestrianGraph(data_dir=str(tmp_path), filename='exact')
+    snapped = PedestrianGraph(data_dir=str(tmp_path), filename='snapped', snap_tolerance=0.5)
+
+    for G in (exact, snapped):
+        first = G.add_or_get_node(Point(10.0, 10.0))
+        assert G.add_or_get_node(Point(10.0, 10.0), 's_gr_2_1') == first
+        assert G.G.nodes[first]['amenity_types'] == {'s_gr_2_1'}
+
+    # Across a grid cell boundary, but within the tolerance
+    assert exact.add_or_get_node(Point(10.3, 9.8)) != 0
+    assert snapped.add_or_get_node(Point(10.3, 9.8)) == 0
+    assert snapped.add_or_get_node(Point(10.6, 10.0)) != 0
+
+def test_loaded_graph_finds_existing_nodes(grid_graph, tmp_path):
+    grid_graph.save_graph()
+    loaded = PedestrianGraph.load_graph(data_dir=str(tmp_path), filename='grid')
+
+    assert loaded.point_to_node_id(Point(300.0, 400.0)) == grid_graph.point_to_node_id(Point(300.0, 400.0))
+    assert loaded.point_to_node_id(Point(300.5, 400.0)) is None
+    # The lookup is built from the CSR view, networkx is not materialized for it
+    assert loaded._G is None
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_loaded_graph_can_be_extended(grid_graph, tmp_path, bulk):
+    points = np.array([[130.0, 40.0], [520.0, 710.0]])
+    grid_graph.save_graph()
+    loaded = PedestrianGraph.load_graph(data_dir=str(tmp_path), filename='grid')
+    grid_graph.rebuild_rtree_indices()
+
+    for G in (grid_graph, loaded):
+        if bulk:
+            G.extend_graph_with_points(points, 's_gr_4_1')
+        else:
+            for x, y in points:
+                G.extend_graph_with_point(Point(x, y), 's_gr_4_1')
+
+    assert loaded.G.number_of_edges() == grid_graph.G.number_of_edges()
+    assert len(loaded.edge_id_to_nodes) == len(grid_graph.edge_id_to_nodes)
+    for x, y in points:
+        node_id = loaded.point_to_node_id(Point(x, y))
+        expected = nx.single_source_dijkstra_path_length(grid_graph.G, grid_graph.point_to_node_id(Point(x, y)), weight='length_m')
+        actual = nx.single_source_dijkstra_path_length(loaded.G, node_id, weight='length_m')
+        assert sorted(actual.values()) == pytest.approx(sorted(expected.values()))
+
+def test_building_map_survives_the_artifact(grid_graph, tmp_path):
+    from types import SimpleNamespace
+    from geoalchemy2.shape import from_shape
+    from shapely.geometry import box
+
+    centroids = np.array([[130.0, 40.0], [520.0, 710.0], [523.0, 705.0]])
+    grid_graph.record_buildings([30, 10, 20], centroids)
+    grid_graph.save_graph()
+    loaded = PedestrianGraph.load_graph(data_dir=str(tmp_path), filename='grid')
+
+    expected = [grid_graph.find_nearest_node(Point(x, y)) for x, y in centroids]
+    assert loaded.building_node_ids([30, 10, 20, 99]).tolist() == expected + [-1]
+    assert loaded.find_nearest_nodes(centroids).tolist() == expected
+
+    # A building the graph was not built with is snapped by its centroid
+    buildings = [
+        SimpleNamespace(gid=20, geom=None),
+        SimpleNamespace(gid=99, geom=from_shape(box(880.0, 880.0, 900.0, 900.0), srid=7801)),
+    ]
+    assert loaded.locate_buildings(buildings).tolist() == [expected[2], grid_graph.find_nearest_node(Point(890.0, 890.0))]
+
+def bent_street(tmp_path):
+    """ 0 - 1 - 2 - 3 - 4 with a bend at node 2 and an amenity at node 3. """
+    G = PedestrianGraph(data_dir=str(tmp_path), filename='bent')
+    points = [(0, 0), (10, 0), (20, 5), (30, 0), (40, 0)]
+    nodes = [G.add_or_get_node(Point(x, y), 's_gr_2_1' if i == 3 else None) for i, (x, y) in enumerate(points)]
+    for a, b in zip(nodes, nodes[1:]):
+        G.G.add_edge(a, b, length_m=10.0, minutes=0.125)
+        G.get_edge_id(a, b)
+    return G, nodes
+
+def test_contraction_keeps_amenities_distances_and_geometry(tmp_path):
+    from service_accessibility.services.isochrones import IsochroneEngine
+
+    G, nodes = bent_street(tmp_path)
+    before = G.get_closeby_amenities(Point(0, 0), 'length_m', 100)
+
+    stats = G.contract_chains()
+    assert (stats['nodes_before'], stats['nodes_after'], stats['edges_after']) == (5, 3, 2)
+    assert G.G[nodes[0]][nodes[3]] == {'length_m': 30.0, 'minutes': 0.375}
+    assert G.edge_via()[(nodes[3], nodes[0])] == [nodes[2], nodes[1]]
+    assert G.get_closeby_amenities(Point(0, 0), 'length_m', 100) == before
+
+    G.save_graph()
+    loaded = PedestrianGraph.load_graph(data_dir=str(tmp_path), filename='bent')
+    lines = [feature['geometry']['coordinates'] for feature in loaded.graph_features()]
+    assert sorted(len(line) for line in lines) == [2, 4]
+    # Isochrones follow the bend through the removed nodes instead of the chord
+    polygon, = IsochroneEngine(buffer=1).polygons(loaded, nodes[0], 'length_m', (25,))
+    assert polygon.contains(Point(20, 5))
+    assert not polygon.contains(Point(20, 0))
+
+def test_contracting_again_keeps_the_via_nodes(tmp_path):
+    G, nodes = bent_street(tmp_path)
+    G.contract_chains()
+
+    # Once the amenity is gone, its node is removed along with the edge it already ended
+    G.G.nodes[nodes[3]].pop('amenity_types', None)
+    stats = G.contract_chains()
+    assert (stats['nodes_after'], stats['edges_after']) == (2, 1)
+    assert G.G[nodes[0]][nodes[4]] == {'length_m': 40.0, 'minutes': 0.5}
+    assert G.edge_via()[(nodes[0], nodes[4])] == nodes[1:4]
+    # The first pass's edge is gone, and so is its entry
+    assert len(G.via_edges) == 1
+
+def test_contraction_skips_parallel_edges_and_rings(tmp_path):
+    G = PedestrianGraph(data_dir=str(tmp_path), filename='loops')
+    u, w, v = (G.add_or_get_node(Point(x, y)) for x, y in ((0, 0), (5, 5), (10, 0)))
+    tail = G.add_or_get_node(Point(20, 0))
+    ring = [G.add_or_get_node(Point(x, y)) for x, y in ((100, 0), (110, 0), (105, 10))]
+    for a, b in [(u, w), (w, v), (u, v), (v, tail), (ring[0], ring[1]), (ring[1], ring[2]), (ring[2], ring[0])]:
+        G.G.add_edge(a, b, length_m=1.0, minutes=1.0)
+
+    stats = G.contract_chains()
+    assert stats['nodes_after'] == stats['nodes_before']
+    assert len(G.via_edges) == 0
+
+def test_contraction_preserves_distances_between_kept_nodes(grid_graph):
+    compact = grid_graph.compact()
+    kept = [int(node) for node in compact.node_ids if grid_graph.G.degree(int(node)) != 2][::9]
+    before = {node: compact.get_closeby_amenities(node, 'minutes', 10) for node in kept}
+    grid_graph.record_buildings([1], [grid_graph.node_coords[kept[0]]])
+
+    stats = grid_graph.contract_chains()
+    assert stats['nodes_after'] < stats['nodes_before']
+    contracted = grid_graph.compact()
+    for node, amenities in before.items():
+        after = contracted.get_closeby_amenities(node, 'minutes', 10)
+        assert after.keys() == amenities.keys()
+        for amenity in amenities:
+            assert after[amenity] == pytest.approx(amenities[amenity], rel=1e-5)
@@ -0,0 +1,199 @@
+from contextlib import contextmanager
+from decimal import Decimal
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from service_accessibility.services import precompute_accessibility
+from service_accessibility.services.precompute_accessibility import (
+    accessibility_source, assign_buildings_to_upus, compute_and_store_accessibility, copy_rows, ensure_building_upu, parse_legacy_column_name,
+    partition_name, precomputed_upus_query, resolve_parameter_set, stream_scores_to_partition,
+)
+
+def test_parse_legacy_column_name():
+    assert parse_legacy_column_name('length_m_1000_300_3_0_5') == ('length_m', 1000, 300, 3, 0.5)
+    assert parse_legacy_column_name('minutes_15_100_5_1') == ('minutes', 15, 100, 5, 1.0)
+
+def test_parse_legacy_column_name_rejects_other_columns():
+    assert parse_legacy_column_name('building_gid') is None
+    assert parse_legacy_column_name('length_m_1000') is None
+
+def test_partition_name():
+    assert partition_name(7) == 'results.building_scores_p7'
+
+class RecordingCursor:
+    def __init__(self, log=None):
+        self.log = log if log is not None else []
+
+    def execute(self, sql, params=None):
+        self.log.append(' '.join(sql.split()))
+
+    def copy_expert(self, sql, buffer):
+        self.sql = sql
+        self.data = buffer.read()
+        self.log.append(sql)
+
+class RecordingConnection:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return RecordingCursor(self.log)
+
+    def commit(self):
+        self.log.append('COMMIT')
+
+    def rollback(self):
+        self.log.append('ROLLBACK')
+
+    def close(self):
+        pass
+
+def test_copy_rows_text_format():
+    cursor = RecordingCursor()
+    copy_rows(cursor, 'results.building_scores_p7', ('param_set_id', 'building_gid', 'score'), [
+        (7, 1, 0.25),
+        (7, 2, None),
+        (7, 3, Decimal('0.125')),
+        (7, 4, np.float64(1.0)),
+        (7, 5, 'a\tb\\c\nd'),
+    ])
+
+    assert cursor.sql == 'COPY results.building_scores_p7 (param_set_id, building_gid, score) FROM STDIN'
+    assert cursor.data.split('\n') == [
+        '7\t1\t0.25',
+        '7\t2\t\\N',
+        '7\t3\t0.125',
+        '7\t4\t1.0',
+        '7\t5\ta\\tb\\\\c\\nd',
+        '',
+    ]
+
+def test_scores_are_loaded_into_a_staging_table_and_swapped_in(monkeypatch):
+    connection = RecordingConnection()
+    monkeypatch.setattr(precompute_accessibility, 'get_db_engine', lambda: SimpleNamespace(raw_connection=lambda: connection))
+
+    stream_scores_to_partition(iter([(1, 0.5), (2, 0.25), (3, None)]), 7, chunk_size=2)
+
+    log = connection.log
+    copies = [i for i, statement in enumerate(log) if statement.startswith('COPY')]
+    assert [log[i] for i in copies] == ['COPY results.building_scores_p7_load (param_set_id, building_gid, score) FROM STDIN'] * 2
+    # The table being read is only touched after the rows are committed to the staging table
+    swap = log.index('ALTER TABLE results.building_scores DETACH PARTITION results.building_scores_p7;')
+    assert log[swap - 1] == 'COMMIT' and swap > copies[-1]
+    assert not any('TRUNCATE' in statement for statement in log)
+    assert log[swap:] == [
+        'ALTER TABLE results.building_scores DETACH PARTITION results.building_scores_p7;',
+        'ALTER TABLE results.building_scores ATTACH PARTITION results.building_scores_p7_load FOR VALUES IN (7);',
+        'DROP TABLE results.building_scores_p7;',
+        'ALTER TABLE results.building_scores_p7_load RENAME TO building_scores_p7;',
+        'ALTER TABLE results.building_scores_p7 RENAME CONSTRAINT building_scores_p7_load_pkey TO building_scores_p7_pkey;',
+        'DELETE FROM results.upu_scores WHERE param_set_id = %s;',
+        'UPDATE results.parameter_sets SET computed_at = clock_timestamp(), from_profiles = %s WHERE id = %s;',
+        'COMMIT',
+        'SELECT pg_advisory_unlock(%s, %s);',
+        'COMMIT',
+    ]
+    assert log[0] == 'SELECT pg_advisory_lock(%s, %s);'
+
+def test_profile_scores_are_materialized_once(monkeypatch):
+    parameters = ('length_m', 1000, 300, 3, 0.5)
+    materialized = []
+    monkeypatch.setattr(precompute_accessibility, 'ensure_results_tables', lambda: None)
+    monkeypatch.setattr(precompute_accessibility, 'find_computed_parameter_set', lambda *parameters: None)
+    monkeypatch.setattr(precompute_accessibility, 'materialize_profile_scores', lambda *parameters: materialized.append(parameters))
+    with pytest.raises(ValueError):
+        accessibility_source(*parameters)
+    assert materialized == [parameters]
+
+    monkeypatch.setattr(precompute_accessibility, 'find_computed_parameter_set', lambda *parameters: (7, '7_1000'))
+    assert resolve_parameter_set(*parameters) == (7, '7_1000')
+    sql, params = accessibility_source(*parameters)
+    # Read from the partition, never bound as arrays
+    assert 'FROM results.building_scores' in sql and 'unnest' not in sql
+    assert params == {"param_set_id": 7}
+    assert len(materialized) == 1
+
+class RecordingSession:
+    def __init__(self, log, exists):
+        self.log = log
+        self.exists = exists
+
+    def execute(self, statement, params=None):
+        self.log.append((' '.join(str(statement).split()), params))
+        return SimpleNamespace(scalar=lambda: self.exists)
+
+def record_sessions(monkeypatch, exists=False):
+    log = []
+
+    @contextmanager
+    def session_scope():
+        yield RecordingSession(log, exists)
+
+    monkeypatch.setattr(precompute_accessibility, 'session_scope', session_scope)
+    return log
+
+def test_buildings_are_assigned_to_one_upu_each(monkeypatch):
+    log = record_sessions(monkeypatch)
+    assert assign_buildings_to_upus()
+
+    statements = [statement for statement, _ in log]
+    insert = next(statement for statement in statements if statement.startswith('INSERT INTO results.building_upu'))
+    # A building within two overlapping units goes to the one with the lowest gid
+    assert 'SELECT DISTINCT ON (r.gid) r.gid, upu.gid' in insert
+    assert insert.endswith('ORDER BY r.gid, upu.gid;')
+    assert statements.index('TRUNCATE results.building_upu;') < statements.index(insert)
+    # The aggregates of every stored parameter set are refreshed from the new assignment
+    assert any(statement.startswith('INSERT INTO results.upu_scores') for statement in statements[statements.index(insert):])
+
+def test_existing_assignment_is_kept(monkeypatch):
+    log = record_sessions(monkeypatch, exists=True)
+    assert not assign_buildings_to_upus()
+    assert not any('TRUNCATE' in statement for statement, _ in log)
+
+    assert assign_buildings_to_upus(force=True)
+    assert any('TRUNCATE' in statement for statement, _ in log)
+
+def test_upu_query_reads_materialized_aggregates(monkeypatch):
+    monkeypatch.setattr(precompute_accessibility, 'resolve_parameter_set', lambda *parameters: (7, '7_1000'))
+    monkeypatch.setattr(precompute_accessibility, 'has_upu_aggregates', lambda param_set_id: param_set_id == 7)
+    monkeypatch.setattr(precompute_accessibility, 'ensure_building_upu', lambda: pytest.fail("not needed"))
+
+    sql, params = precomputed_upus_query('length_m', 1000, 300, 3, 0.5)
+    assert 'FROM results.upu_scores AS s' in ' '.join(sql.split())
+    assert 'ST_Within' not in sql
+    assert params == {"param_set_id": 7}
+
+def test_upu_query_aggregates_through_the_assignment(monkeypatch):
+    ensured = []
+    monkeypatch.setattr(precompute_accessibility, 'has_upu_aggregates', lambda param_set_id: False)
+    monkeypatch.setattr(precompute_accessibility, 'resolve_parameter_set', lambda *parameters: (7, '7_1000'))
+    monkeypatch.setattr(precompute_accessibility, 'ensure_building_upu', lambda: ensured.append(True))
+
+    sql, params = precomputed_upus_query('length_m', 1000, 300, 3, 0.5)
+    sql = ' '.join(sql.split())
+    assert 'JOIN results.building_upu AS bu ON bu.building_gid = ba.building_gid' in sql
+    assert 'WHERE param_set_id = :param_set_id' in sql
+    assert 'ST_Within' not in sql
+    assert params == {"param_set_id": 7}
+    assert ensured == [True]
+
+def test_building_upu_is_assigned_once_per_process(monkeypatch):
+    calls = []
+    monkeypatch.setattr(precompute_accessibility, '_building_upu_ready', False)
+    monkeypatch.setattr(precompute_accessibility, 'assign_buildings_to_upus', lambda: calls.append(True))
+
+    ensure_building_upu()
+    ensure_building_upu()
+    assert calls == [True]
+
+def test_precompute_loads_the_configured_graph(monkeypatch):
+    loaded = []
+
+    def load_graph(data_dir, filename):
+        loaded.append((data_dir, filename))
+        raise RuntimeError("stop")
+
+    monkeypatch.setattr(precompute_accessibility.PedestrianGraph, 'load_graph', load_graph)
+    with pytest.raises(RuntimeError):
+        compute_and_store_accessibility('length_m', 1000, 300, 3, 0.5)
+    assert loaded == [(precompute_accessibility.GRAPH_DATA_DIR, precompute_accessibility.GRAPH_FILENAME)]
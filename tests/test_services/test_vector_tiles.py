@@ -0,0 +1,50 @@
+import pytest
+from service_accessibility.services.vector_tiles import TileCache, parameters_key, tile_query, validate_tile
+
+def test_validate_tile():
+    validate_tile('network', 0, 0, 0)
+    validate_tile('upus', 15, 18610, 12050)
+    with pytest.raises(ValueError):
+        validate_tile('rivers', 0, 0, 0)
+    with pytest.raises(ValueError):
+        validate_tile('schools', 2, 4, 0)
+
+def test_tile_query_selects_layer_attributes():
+    sql, params = tile_query('schools', 15, 18610, 12050)
+    assert 'raw.schools' in sql
+    assert 't.subgroup_i' in sql
+    assert 'accessibility' not in sql
+    assert params == {"z": 15, "x": 18610, "y": 12050, "layer": 'schools'}
+
+def test_tile_query_joins_stored_scores():
+    sql, params = tile_query('buildings', 15, 18610, 12050, 7)
+    assert 'results.building_scores AS a ON a.param_set_id = :param_set_id' in sql
+    assert 'unnest' not in sql
+    assert params["param_set_id"] == 7
+
+def test_tile_cache_paths(tmp_path):
+    cache = TileCache(str(tmp_path))
+    parameters = ('length_m', 1000, 300, 3, 0.5)
+    assert parameters_key(parameters) == 'length_m_1000_300_3_0_5'
+
+    # Only the buildings layer depends on the accessibility parameters
+    assert cache.path('v1', 'schools', 1, 0, 1, parameters) == cache.path('v1', 'schools', 1, 0, 1)
+    assert cache.path('v1', 'buildings', 1, 0, 1, parameters) != cache.path('v1', 'buildings', 1, 0, 1)
+    assert cache.path('v1', 'network', 1, 0, 1) != cache.path('v2', 'network', 1, 0, 1)
+    # Rewritten scores get a new generation, so tiles of the previous one are not served
+    assert cache.path('v1', 'buildings', 1, 0, 1, parameters, '7_1000') != cache.path('v1', 'buildings', 1, 0, 1, parameters, '7_2000')
+
+def test_tile_cache_read_write_prune(tmp_path):
+    cache = TileCache(str(tmp_path))
+    old_path = cache.path('v1', 'network', 1, 0, 1)
+    new_path = cache.path('v2', 'network', 1, 0, 1)
+    assert cache.read(old_path) is None
+
+    cache.write(old_path, b'old')
+    cache.write(new_path, b'')
+    assert cache.read(old_path) == b'old'
+    assert cache.read(new_path) == b''
+
+    cache.prune('v2')
+    assert cache.read(old_path) is None
+    assert cache.read(new_path) == b''
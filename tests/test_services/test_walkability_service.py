@@ -0,0 +1,65 @@
+import random
+import numpy as np
+import pytest
+from service_accessibility.services.walkability_service import WEIGHTS, compute_accessibility_index, compute_accessibility_index_batch
+
+SUBGROUPS = list(WEIGHTS)
+
+def random_proximity_dicts(count, max_distance, seed=1):
+    rng = random.Random(seed)
+    proximity_dicts = []
+    for _ in range(count):
+        proximity_dicts.append({
+            subgroup: [rng.uniform(0, max_distance) for _ in range(rng.randint(1, 6))]
+            for subgroup in rng.sample(SUBGROUPS, rng.randint(0, 12))
+        })
+    return proximity_dicts
+
+def to_padded(proximity_dicts, width):
+    distances = np.full((len(proximity_dicts), len(SUBGROUPS), width), np.inf)
+    counts = np.zeros((len(proximity_dicts), len(SUBGROUPS)), dtype=np.int64)
+    for b, proximity_dict in enumerate(proximity_dicts):
+        for subgroup, values in proximity_dict.items():
+            s = SUBGROUPS.index(subgroup)
+            nearest = sorted(values)[:width]
+            distances[b, s, :len(nearest)] = nearest
+            counts[b, s] = len(values)
+    return distances, counts
+
+@pytest.mark.parametrize("max_distance, k, max_amenities, f", [(1000, 100, 3, 0.5), (800, 300, 1, 0.2), (1200, 50, 5, 1.5)])
+def test_batch_matches_scalar(max_distance, k, max_amenities, f):
+    proximity_dicts = random_proximity_dicts(200, max_distance)
+    distances, counts = to_padded(proximity_dicts, max_amenities)
+
+    batch = compute_accessibility_index_batch(distances, counts, SUBGROUPS, max_distance, k, max_amenities, f)
+    scalar = [compute_accessibility_index(p, max_distance, k, max_amenities, f) for p in proximity_dicts]
+
+    np.testing.assert_allclose(batch, scalar, rtol=0, atol=1e-9)
+
+def test_batch_broadcasts_over_parameters():
+    proximity_dicts = random_proximity_dicts(50, 1000)
+    distances, counts = to_padded(proximity_dicts, 5)
+    ks = np.array([50, 100, 300])[:, None]
+    fs = np.array([0.2, 0.5, 1.0, 2.0])[None, :]
+
+    batch = compute_accessibility_index_batch(distances, counts, SUBGROUPS, 1000, ks, 3, fs)
+
+    assert batch.shape == (3, 4, 50)
+    for i, k in enumerate(ks[:, 0]):
+        for j, f in enumerate(fs[0]):
+            expected = [compute_accessibility_index(p, 1000, k, 3, f) for p in proximity_dicts]
+            np.testing.assert_allclose(batch[i, j], expected, rtol=0, atol=1e-9)
+
+def test_batch_rescores_shorter_max_distance():
+    # Profiles from a 1500m search must score like a fresh 1000m search
+    proximity_dicts = random_proximity_dicts(100, 1500, seed=7)
+    distances, counts = to_padded(proximity_dicts, 4)
+
+    batch = compute_accessibility_index_batch(distances, counts, SUBGROUPS, 1000, 200, 3, 0.5)
+    truncated = [
+        {subgroup: [d for d in values if d <= 1000] for subgroup, values in p.items() if any(d <= 1000 for d in values)}
+        for p in proximity_dicts
+    ]
+    expected = [compute_accessibility_index(p, 1000, 200, 3, 0.5) for p in truncated]
+
+    np.testing.assert_allclose(batch, expected, rtol=0, atol=1e-9)